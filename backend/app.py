@@ -1,24 +1,64 @@
 import sys
 import os
+import atexit
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from flask import Flask, Blueprint, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify
 from flask_cors import CORS
 from models.policy_engine import PolicyEngine
+from models.base_model import BaseModel
+from models.change_log import published_version, reset_published_version
+from models.user_import import start_import_job, get_import_job
 from models.object import Object as PolicyObject
 from models.role import Role
 from backend.auth import auth, ensure_admin_exists, login_required, get_current_user_id
 
 app = Flask(__name__)
 
-policy_engine = PolicyEngine()
+policy_engine = PolicyEngine(decision_cache_size=int(os.environ.get('DECISION_CACHE_SIZE', '0')),
+                             access_journal_path=os.environ.get('ACCESS_JOURNAL_PATH') or None,
+                             change_log=os.environ.get('POLICY_CHANGE_LOG', '0') == '1',
+                             change_poll_interval=float(os.environ.get('POLICY_CHANGE_POLL_INTERVAL', '1.0')),
+                             snapshot_path=os.environ.get('POLICY_SNAPSHOT_PATH') or None,
+                             user_cache_size=int(os.environ.get('USER_CACHE_SIZE', '0')),
+                             prewarm_users=[user_id for user_id in os.environ.get('USER_CACHE_PREWARM', '').split(',') if user_id],
+                             load_batch_size=int(os.environ.get('LOAD_BATCH_SIZE', '1000')),
+                             password_hash_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '0')))
+atexit.register(policy_engine.close)
+# Processes hashing the passwords of a bulk import, by default half the cores, leaving the rest to
+# interactive requests (which have their own pool of PASSWORD_HASH_WORKERS)
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // 2))))
+
+# With the change log enabled, every request first catches up with the mutations made by other
+# worker processes. Responses carry the policy version they reflect (including the request's own
+# writes) in X-Policy-Version; a client sending it back as X-Min-Policy-Version reads its own writes
+# from any worker.
+@app.before_request
+def sync_policy():
+    reset_published_version()
+    min_version = request.headers.get('X-Min-Policy-Version')
+    policy_engine.sync(int(min_version) if min_version and min_version.isdigit() else None)
+
+@app.after_request
+def add_policy_version(response):
+    if policy_engine.change_log:
+        response.headers['X-Policy-Version'] = str(max(policy_engine.change_seq, published_version()))
+    return response
 
 general_api = Blueprint('general_api', __name__, url_prefix='/api')
 
+def json_array_response(items):
+    """Streams the documents produced by items as a JSON array, without building the whole list first."""
+    def generate():
+        yield '['
+        for i, item in enumerate(items):
+            yield (',' if i else '') + app.json.dumps(item)
+        yield ']'
+    return Response(generate(), mimetype='application/json')
+
 @general_api.route('/users', methods=['GET'])
 def get_users():
-    users = policy_engine.get_users()
-    return jsonify(users)
+    return json_array_response(policy_engine.iter_users())
 
 @general_api.route('/users', methods=['POST'])
 def add_user_route():
@@ -33,6 +73,24 @@ def add_user_route():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/users/import', methods=['POST'])
+def import_users_route():
+    # The body is the file itself, streamed: JSONL, or CSV with ?format=csv or a text/csv content type.
+    # The import runs in the background; poll the returned job for its report.
+    file_format = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'jsonl')
+    try:
+        job_id = start_import_job(policy_engine, request.stream, file_format, workers=IMPORT_HASH_WORKERS)
+        return jsonify({"job_id": job_id, "status": "running"}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@general_api.route('/users/import/<job_id>', methods=['GET'])
+def import_job_route(job_id: str):
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({"error": f"Import job {job_id} not found"}), 404
+    return jsonify(job)
+
 @general_api.route('/users/<user_id>', methods=['PUT'])
 def update_user_route(user_id: str):
     data = request.json
@@ -59,8 +117,7 @@ def delete_user_route(user_id: str):
 
 @general_api.route('/objects', methods=['GET'])
 def get_objects():
-    objects_data = policy_engine.get_objects()
-    return jsonify(objects_data)
+    return json_array_response(policy_engine.iter_objects())
 
 @general_api.route('/objects', methods=['POST'])
 def add_object_route():
@@ -101,8 +158,7 @@ def delete_object_route(object_id: str):
 
 @general_api.route('/roles', methods=['GET'])
 def get_roles():
-    roles_data = policy_engine.get_roles()
-    return jsonify(roles_data)
+    return json_array_response(policy_engine.iter_roles())
 
 @general_api.route('/roles', methods=['POST'])
 def add_role_route():
@@ -137,10 +193,16 @@ def delete_role_route(role_id: str):
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/roles/<role_id>/users', methods=['GET'])
+def get_role_users_route(role_id: str):
+    try:
+        return jsonify(policy_engine.get_role_users(role_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+
 @general_api.route('/datasets', methods=['GET'])
 def get_datasets():
-    datasets_data = policy_engine.get_datasets()
-    return jsonify(datasets_data)
+    return json_array_response(policy_engine.iter_datasets())
 
 @general_api.route('/datasets', methods=['POST'])
 def add_dataset_route():
@@ -176,10 +238,16 @@ def delete_dataset_route(dataset_id: str):
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/datasets/<dataset_id>/objects', methods=['GET'])
+def get_dataset_objects_route(dataset_id: str):
+    try:
+        return jsonify(policy_engine.get_dataset_objects(dataset_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+
 @general_api.route('/conflict_classes', methods=['GET'])
 def get_conflict_classes():
-    cc_data = policy_engine.get_conflict_classes()
-    return jsonify(cc_data)
+    return json_array_response(policy_engine.iter_conflict_classes())
 
 @general_api.route('/conflict_classes', methods=['POST'])
 def add_conflict_class_route():
@@ -254,6 +322,19 @@ def grant_direct_permission_route():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/policy/batch', methods=['POST'])
+def policy_batch_route():
+    # {"ops": [{"op": "assign_role_to_user", "user_id": ..., "role_id": ...}, ...]}, or the list itself
+    data = request.json
+    ops = data.get('ops') if isinstance(data, dict) else data
+    if not isinstance(ops, list):
+        return jsonify({"error": "Missing required parameter 'ops' (list of {op, ...arguments})"}), 400
+    try:
+        outcome = policy_engine.apply_batch(ops)
+        return jsonify(outcome), 200 if outcome['applied'] else 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @general_api.route('/check_access', methods=['POST'])
 def check_access_route():
     data = request.json
@@ -262,12 +343,56 @@ def check_access_route():
     action = data.get('action')
     if not all([user_id, object_id, action]):
         return jsonify({"error": "Missing required parameters (user_id, object_id, action)"}), 400
+    # ?verbose=false skips rendering the reason and returns the decision code instead
+    verbose = request.args.get('verbose', 'true').lower() != 'false'
+    try:
+        decision = policy_engine.check_access(user_id, object_id, action)
+        return jsonify(decision.to_dict(verbose=verbose))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@general_api.route('/check_access/batch', methods=['POST'])
+def check_access_batch_route():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    default_user_id = data.get('user_id')
+    checks = data.get('checks')
+    with_reasons = data.get('reasons', True)
+    if not isinstance(checks, list):
+        return jsonify({"error": "Missing required parameter 'checks' (list of {user_id, object_id, action})"}), 400
+    if not isinstance(with_reasons, bool):
+        return jsonify({"error": "Parameter 'reasons' must be true or false"}), 400
+
+    triples = []
+    for i, check in enumerate(checks):
+        user_id = check.get('user_id', default_user_id) if isinstance(check, dict) else None
+        object_id = check.get('object_id') if isinstance(check, dict) else None
+        action = check.get('action') if isinstance(check, dict) else None
+        if not all([user_id, object_id, action]):
+            return jsonify({"error": f"Check {i} is missing required parameters (user_id, object_id, action)"}), 400
+        triples.append((user_id, object_id, action))
+
     try:
-        allowed, reason = policy_engine.check_access(user_id, object_id, action)
-        return jsonify({"allowed": allowed, "reason": reason})
+        decisions = policy_engine.check_access_many(triples, with_reasons=with_reasons)
+        if with_reasons:
+            return jsonify({"results": [decision.to_dict() for decision in decisions]})
+        return jsonify({"results": decisions})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/check_access/cache_stats', methods=['GET'])
+def decision_cache_stats_route():
+    return jsonify(policy_engine.decision_cache_stats())
+
+@general_api.route('/users/cache_stats', methods=['GET'])
+def user_cache_stats_route():
+    return jsonify(policy_engine.user_cache_stats())
+
+@general_api.route('/storage/stats', methods=['GET'])
+def get_storage_stats():
+    return jsonify(BaseModel.storage().stats())
+
 @general_api.route('/record_access', methods=['POST'])
 def record_access_route():
     data = request.json
@@ -303,6 +428,13 @@ def get_user_permissions_route(user_id: str):
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@general_api.route('/users/<user_id>/walled_datasets', methods=['GET'])
+def get_walled_datasets_route(user_id: str):
+    try:
+        return jsonify(policy_engine.get_walled_datasets(user_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @general_api.route('/conflict_datasets/<dataset_id>', methods=['GET'])
 def get_conflict_datasets_route(dataset_id: str):
     try:
@@ -337,7 +469,7 @@ def change_password_route():
 
 app.register_blueprint(general_api)
 app.register_blueprint(auth)
-CORS(app)
+CORS(app, expose_headers=['X-Policy-Version'])
 
 def initialize_system():
     print("Initializing system data...")
@@ -0,0 +1,67 @@
+"""
+Microbenchmark: allocations of check_access with and without rendering reason strings.
+
+    python benchmarks/bench_decisions.py [n_checks]
+
+Runs against the in-memory storage backend so it never touches a real deployment.
+"""
+import sys
+import os
+import time
+import random
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.policy_engine import PolicyEngine
+
+
+def build_engine(n_users=50, n_datasets=20, n_objects=500, n_roles=10, seed=0) -> PolicyEngine:
+    BaseModel.use_storage(MemoryStorage())
+    rnd = random.Random(seed)
+    pe = PolicyEngine()
+    with mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed"):
+        for i in range(n_users):
+            pe.add_user(f"user{i}", f"User {i}")
+    for i in range(n_datasets):
+        pe.add_dataset(f"ds{i}", f"Dataset {i}")
+    for i in range(0, n_datasets, 4):
+        pe.add_conflict_class(f"cc{i}", f"Conflict Class {i}", [f"ds{j}" for j in range(i, min(i + 4, n_datasets))])
+    for i in range(n_objects):
+        pe.add_object(f"obj{i}", f"Object {i}", f"ds{rnd.randrange(n_datasets)}")
+    for i in range(n_roles):
+        pe.add_role(f"role{i}", f"Role {i}")
+        for _ in range(n_objects // 2):
+            pe.add_permission_to_role(f"role{i}", f"obj{rnd.randrange(n_objects)}", rnd.choice(["read", "write"]))
+    for i in range(n_users):
+        pe.assign_role_to_user(f"user{i}", f"role{rnd.randrange(n_roles)}")
+        pe.grant_direct_permission(f"user{i}", f"obj{rnd.randrange(n_objects)}", "delete")
+        pe.record_access(f"user{i}", f"obj{rnd.randrange(n_objects)}")
+    return pe
+
+
+def measure(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    # Second run under tracemalloc, since tracing distorts the timing
+    tracemalloc.start()
+    results = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed * 1e3:9.1f} ms  retained {current / 1024:9.1f} KiB  peak {peak / 1024:9.1f} KiB")
+    return results
+
+
+if __name__ == "__main__":
+    n_checks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    pe = build_engine()
+    rnd = random.Random(1)
+    checks = [(f"user{rnd.randrange(50)}", f"obj{rnd.randrange(500)}", rnd.choice(["read", "write", "delete"]))
+              for _ in range(n_checks)]
+    print(f"{n_checks} checks")
+    measure("reasons rendered", lambda: [tuple(pe.check_access(*check)) for check in checks])
+    measure("decision objects", lambda: [pe.check_access(*check) for check in checks])
+    measure("booleans only", lambda: [pe.check_access(*check).allowed for check in checks])
+    measure("batch, booleans only", lambda: pe.check_access_many(checks, with_reasons=False))
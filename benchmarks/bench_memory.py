@@ -0,0 +1,74 @@
+"""
+Heap used by the roles of a policy with many permissions, before and after slotted models,
+Permission tuples with interned strings and set-based role permissions.
+
+    python benchmarks/bench_memory.py [n_permissions]
+
+Hydrates the same role documents twice, as the policy engine loads them, measuring what stays
+allocated with tracemalloc: once into the previous layout (models and permissions with a
+per-instance __dict__, one Permission object per grant in a list, and a copy of the stored list
+kept for delta saves), reproduced below, and once into the current Role and Permission classes.
+"""
+import sys
+import os
+import gc
+import time
+import random
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.interning import intern_str
+from models.role import Role
+
+
+# The layout before the change
+class DictPermission:
+    def __init__(self, object_id: str, action: str):
+        self.object_id = intern_str(object_id)
+        self.action = intern_str(action)
+
+class DictRole:
+    def __init__(self, id: str, name: str, permissions=None):
+        self.id = id
+        self.name = name
+        self.permissions = permissions if permissions is not None else []
+        self._persisted = None
+
+    @classmethod
+    def _hydrate(cls, data):
+        role = cls(id=data['_id'], name=data.get('name'),
+                   permissions=[DictPermission(p['object_id'], p['action']) for p in data.get('permissions', [])])
+        role._persisted = {'name': data.get('name'), 'permissions': list(data.get('permissions', []))}
+        return role
+
+
+def role_documents(n_permissions: int, per_role: int = 1000, seed=0):
+    # Roles draw their grants from a shared pool of objects and actions, as real policies do
+    rnd = random.Random(seed)
+    n_objects = max(n_permissions // 20, 10)
+    actions = ["read", "write", "delete", "share"]
+    for i in range(n_permissions // per_role):
+        yield {'_id': f"role{i}", 'name': f"Role {i}",
+               'permissions': [{'object_id': f"obj{rnd.randrange(n_objects)}", 'action': rnd.choice(actions)}
+                               for _ in range(per_role)]}
+
+
+def measure(label, hydrate, n_permissions):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    roles = [hydrate(doc) for doc in role_documents(n_permissions)] # Each document is freed once hydrated
+    seconds = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<34} {current / 2**20:8.1f} MiB {current / n_permissions:8.1f} B/permission {seconds:6.2f} s")
+    return roles, current
+
+
+if __name__ == "__main__":
+    n_permissions = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{n_permissions} permissions in {n_permissions // 1000} roles")
+    before, before_bytes = measure("before (__dict__ models, lists)", DictRole._hydrate, n_permissions)
+    del before
+    after, after_bytes = measure("after (__slots__, interned sets)", Role._hydrate, n_permissions)
+    print(f"heap reduced by {1 - after_bytes / before_bytes:.0%}")
@@ -0,0 +1,68 @@
+"""
+Startup time of PolicyEngine with and without a snapshot.
+
+    python benchmarks/bench_startup.py [n_users]
+
+Builds a policy in a temporary SQLite database, then times a cold start (reading and hydrating every
+document) against a warm start from a snapshot that has to catch up with a few later changes.
+"""
+import sys
+import os
+import time
+import random
+import tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.base_model import BaseModel
+from models.storage import SQLiteStorage
+from models.policy_engine import PolicyEngine
+from models.snapshot import write_snapshot
+
+
+def populate(pe: PolicyEngine, n_users: int, seed=0):
+    rnd = random.Random(seed)
+    n_datasets, n_objects, n_roles = max(n_users // 50, 4), max(n_users // 5, 10), max(n_users // 500, 2)
+    storage = BaseModel.storage()
+    with storage.transaction(), mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed"):
+        for i in range(n_datasets):
+            pe.add_dataset(f"ds{i}", f"Dataset {i}")
+        for i in range(0, n_datasets, 4):
+            pe.add_conflict_class(f"cc{i}", f"Conflict Class {i}", [f"ds{j}" for j in range(i, min(i + 4, n_datasets))])
+        for i in range(n_objects):
+            pe.add_object(f"obj{i}", f"Object {i}", f"ds{rnd.randrange(n_datasets)}")
+        for i in range(n_roles):
+            pe.add_role(f"role{i}", f"Role {i}")
+            for _ in range(50):
+                pe.add_permission_to_role(f"role{i}", f"obj{rnd.randrange(n_objects)}", rnd.choice(["read", "write"]))
+        for i in range(n_users):
+            pe.add_user(f"user{i}", f"User {i}")
+            pe.assign_role_to_user(f"user{i}", f"role{rnd.randrange(n_roles)}")
+            pe.grant_direct_permission(f"user{i}", f"obj{rnd.randrange(n_objects)}", "delete")
+            pe.record_access(f"user{i}", f"obj{rnd.randrange(n_objects)}")
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<36} {time.perf_counter() - start:8.2f} s")
+    return result
+
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as directory:
+        BaseModel.use_storage(SQLiteStorage(os.path.join(directory, 'policy.db')))
+        snapshot_path = os.path.join(directory, 'policy.snap')
+        pe = PolicyEngine(change_log=True)
+        timed(f"populate ({n_users} users)", lambda: populate(pe, n_users))
+        header = timed("write snapshot", lambda: write_snapshot(pe, snapshot_path))
+        print(f"snapshot: {header['size'] / 2**20:.1f} MiB at change {header['change_seq']}")
+        for i in range(100): # Changes the warm start has to catch up with
+            pe.record_access(f"user{i}", f"obj{i}")
+
+        cold = timed("cold start (database)", lambda: PolicyEngine(change_log=True))
+        warm = timed("warm start (snapshot + change log)", lambda: PolicyEngine(change_log=True, snapshot_path=snapshot_path))
+        print(f"warm start applied {warm.startup_stats['changes_applied']} changes")
+        checks = [(f"user{i}", f"obj{i}", "read") for i in range(0, n_users, max(n_users // 1000, 1))]
+        assert [d.allowed for d in cold.check_access_many(checks)] == [d.allowed for d in warm.check_access_many(checks)]
+        BaseModel.storage().close()
@@ -0,0 +1,189 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+from typing import Dict, List, Iterable, Tuple
+from models.base_model import BaseModel
+from models.user import User
+from models.policy_engine import AccessHistoryEntry
+
+# Bulk evaluation of the full users x objects x actions decision matrix.
+# The state of a PolicyEngine is compiled into boolean arrays and every decision is computed
+# with a handful of array operations instead of one check_access call per triple:
+#   rbac    = each role's (object, action) columns set for the users holding it
+#   blocked = history @ conflicts                      (U x D) @ (D x D), then mapped to objects
+#   allowed = (rbac | caps) & ~blocked
+# Roles are kept sparse, as the columns of the permissions they grant, rather than as a dense
+# roles x (objects * actions) array. An engine in lazy user mode holds only some of its users,
+# so their roles and access histories are read from storage, resident users taking precedence.
+class AccessMatrixEngine:
+    def __init__(self, policy_engine, actions: Iterable[str] = None):
+        self.policy_engine = policy_engine
+        self._requested_actions = list(actions) if actions is not None else None
+        self.user_ids: List[str] = []
+        self.object_ids: List[str] = []
+        self.actions: List[str] = []
+        self.decisions: np.ndarray = None
+        self.compile()
+
+    def compile(self) -> np.ndarray:
+        """(Re)builds the incidence arrays from the policy engine and computes all decisions."""
+        pe = self.policy_engine
+        user_roles, user_histories = self._users_and_histories()
+        self.user_ids = list(user_roles)
+        self.object_ids = list(pe.objects)
+        role_ids = list(pe.roles)
+        self._user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self._object_index = {obj_id: i for i, obj_id in enumerate(self.object_ids)}
+        role_index = {role_id: i for i, role_id in enumerate(role_ids)}
+
+        if self._requested_actions is not None:
+            self.actions = self._requested_actions
+        else:
+            actions = set()
+            for role in pe.roles.values():
+                actions.update(perm.action for perm in role.permissions)
+            for objects in pe.caps.matrix.values():
+                for obj_actions in objects.values():
+                    actions.update(obj_actions)
+            self.actions = sorted(actions)
+        self._action_index = {action: i for i, action in enumerate(self.actions)}
+
+        # Datasets referenced anywhere in the policy, not only the registered ones
+        dataset_ids = list(pe.datasets)
+        dataset_index = {ds_id: i for i, ds_id in enumerate(dataset_ids)}
+        def ds_idx(ds_id: str) -> int:
+            if ds_id not in dataset_index:
+                dataset_index[ds_id] = len(dataset_ids)
+                dataset_ids.append(ds_id)
+            return dataset_index[ds_id]
+        object_datasets = np.array([ds_idx(pe.objects[obj_id].dataset) for obj_id in self.object_ids], dtype=np.intp)
+        history_pairs = [(self._user_index[user_id], ds_idx(ds_id))
+                         for user_id, history in user_histories.items() if user_id in self._user_index
+                         for ds_id in history]
+        class_members = [[ds_idx(ds_id) for ds_id in cc.datasets] for cc in pe.conflict_classes.values()]
+
+        n_users, n_objects, n_actions = len(self.user_ids), len(self.object_ids), len(self.actions)
+        n_roles, n_datasets = len(role_ids), len(dataset_ids)
+
+        # Each role's permissions as columns of the (object, action) axis, flattened
+        role_columns: List[List[int]] = [[] for _ in range(n_roles)]
+        for role_id, role in pe.roles.items():
+            for perm in role.permissions:
+                o, a = self._object_index.get(perm.object_id), self._action_index.get(perm.action)
+                if o is not None and a is not None:
+                    role_columns[role_index[role_id]].append(o * n_actions + a)
+
+        # The users holding each role
+        role_holders: List[List[int]] = [[] for _ in range(n_roles)]
+        for user_id, roles in user_roles.items():
+            for role_id in roles:
+                if role_id in role_index:
+                    role_holders[role_index[role_id]].append(self._user_index[user_id])
+
+        # Direct capabilities from CapabilityList.matrix
+        caps = np.zeros((n_users, n_objects, n_actions), dtype=bool)
+        for user_id, objects in pe.caps.matrix.items():
+            u = self._user_index.get(user_id)
+            if u is None:
+                continue
+            for obj_id, obj_actions in objects.items():
+                o = self._object_index.get(obj_id)
+                if o is None:
+                    continue
+                for action in obj_actions:
+                    a = self._action_index.get(action)
+                    if a is not None:
+                        caps[u, o, a] = True
+
+        # Chinese Wall: a dataset is blocked once a *different* dataset of a shared conflict class was accessed
+        history = np.zeros((n_users, n_datasets), dtype=np.float32)
+        for u, d in history_pairs:
+            history[u, d] = 1
+        conflicts = np.zeros((n_datasets, n_datasets), dtype=np.float32)
+        for members in class_members:
+            conflicts[np.ix_(members, members)] = 1
+        np.fill_diagonal(conflicts, 0)
+        blocked_datasets = (history @ conflicts) > 0
+        blocked_objects = blocked_datasets[:, object_datasets]
+
+        rbac = np.zeros((n_users, n_objects * n_actions), dtype=bool)
+        for holders, columns in zip(role_holders, role_columns):
+            if holders and columns:
+                rbac[np.ix_(holders, columns)] = True
+        rbac = rbac.reshape(n_users, n_objects, n_actions)
+        self.decisions = (rbac | caps) & ~blocked_objects[:, :, np.newaxis]
+        return self.decisions
+
+    def _users_and_histories(self) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+        """Every user's roles and accessed datasets, by user id."""
+        pe = self.policy_engine
+        if not pe.lazy_users:
+            return {user_id: user.roles for user_id, user in pe.users.items()}, pe.user_access_history
+        if pe.access_writer:
+            pe.access_writer.flush() # Accesses recorded by users evicted since are only in the journal
+        user_roles, resident = {}, set()
+        for doc in User.collection().find({}, {'_id': 1, 'roles': 1}, batch_size=pe.load_batch_size):
+            user = pe.users.peek(doc['_id'])
+            if user is not None:
+                resident.add(user.id)
+            user_roles[doc['_id']] = user.roles if user is not None else doc.get('roles', [])
+        histories = {user_id: pe.user_access_history.get(user_id, []) for user_id in resident}
+        for doc in BaseModel.get_access_history_collection().find({}, batch_size=pe.load_batch_size):
+            entry = AccessHistoryEntry.from_dict(doc)
+            if entry.user_id not in resident:
+                histories[entry.user_id] = entry.accessed_datasets
+        return user_roles, histories
+
+    def matrix(self) -> np.ndarray:
+        """Returns the users x objects x actions boolean decision matrix."""
+        return self.decisions
+
+    def check(self, user_id: str, object_id: str, action: str) -> bool:
+        u, o, a = self._user_index.get(user_id), self._object_index.get(object_id), self._action_index.get(action)
+        if u is None or o is None or a is None:
+            return False
+        return bool(self.decisions[u, o, a])
+
+    def row(self, user_id: str) -> Dict[str, List[str]]:
+        """Returns object_id -> allowed actions for one user."""
+        u = self._user_index.get(user_id)
+        if u is None:
+            raise ValueError(f"User {user_id} not found.")
+        return self._entitlements(self.decisions[u], self.object_ids)
+
+    def column(self, object_id: str) -> Dict[str, List[str]]:
+        """Returns user_id -> allowed actions for one object."""
+        o = self._object_index.get(object_id)
+        if o is None:
+            raise ValueError(f"Object {object_id} not found.")
+        return self._entitlements(self.decisions[:, o], self.user_ids)
+
+    def _entitlements(self, plane: np.ndarray, ids: List[str]) -> Dict[str, List[str]]:
+        result: Dict[str, List[str]] = {}
+        for i, a in zip(*np.nonzero(plane)):
+            result.setdefault(ids[i], []).append(self.actions[a])
+        return result
+
+    def allowed_triples(self) -> Iterable[Tuple[str, str, str]]:
+        for u, o, a in zip(*np.nonzero(self.decisions)):
+            yield self.user_ids[u], self.object_ids[o], self.actions[a]
+
+    def export(self, path: str):
+        """Writes the decision matrix and its axis labels to a compressed .npz file."""
+        np.savez_compressed(
+            path,
+            decisions=self.decisions,
+            user_ids=np.array(self.user_ids, dtype=str),
+            object_ids=np.array(self.object_ids, dtype=str),
+            actions=np.array(self.actions, dtype=str)
+        )
+
+if __name__ == "__main__":
+    from models.policy_engine import PolicyEngine
+    engine = AccessMatrixEngine(PolicyEngine())
+    print(f"{len(engine.user_ids)} users x {len(engine.object_ids)} objects x {len(engine.actions)} actions, "
+          f"{int(engine.matrix().sum())} allowed")
+    if len(sys.argv) > 1:
+        engine.export(sys.argv[1])
+        print(f"Exported decision matrix to {sys.argv[1]}")
@@ -1,23 +1,50 @@
-from pymongo import MongoClient
-from typing import Dict, Any, List, TypeVar, Type
+from typing import Dict, Any, Iterator, List, Tuple, TypeVar, Type
+from .storage import StorageBackend, WriteOperation, storage_from_config
+from .change_log import record_change
 
 T = TypeVar('T', bound='BaseModel')  # Type variable for class methods
 
 class BaseModel:
-    # Initialize client and db as class attributes
-    # In a real application, you might want to manage this connection differently
-    # (e.g., as a singleton or part of app context)
-    _client = None
-    _db = None
+    # Models are slotted, without a per-instance __dict__, as millions of them can be cached;
+    # subclasses list their fields in __slots__ too.
+    # _persisted holds the fields as last loaded from or written to the database, so that save()
+    # sends only what changed; None while the stored state is unknown, e.g. for a newly created
+    # model. Scalar fields are compared with their stored values. The lists named in LIST_FIELDS
+    # are not copied: _persisted refers to the model's own list, and the values added and removed
+    # through append_to() and remove_from() are recorded in _pushed and _pulled (None until then),
+    # for save() to send as $push/$pull without comparing the lists. Other in-place changes to those
+    # lists are not saved; assigning a new list writes it in full.
+    __slots__ = ('_persisted', '_pushed', '_pulled')
+
+    # Storage backend shared by all models, created from the environment on first use
+    # (see models/storage.py) unless one is installed with use_storage()
+    _storage: StorageBackend = None
+
+    # Secondary indexes for the queries made on the collection other than by _id, as tuples of
+    # (possibly dotted) field names, created by ensure_indexes()
+    INDEXES: List[Tuple[str, ...]] = []
+    # Indexes that also reject two documents with the same values of their (top-level) fields
+    UNIQUE_INDEXES: List[Tuple[str, ...]] = []
+    # The list fields, changed in place through append_to() and remove_from()
+    LIST_FIELDS: Tuple[str, ...] = ()
+
+    def __new__(cls, *args, **kwargs):
+        # Here rather than in __init__, which subclasses do not chain to, and which unpickling skips
+        instance = super().__new__(cls)
+        instance._persisted = None
+        instance._pushed = instance._pulled = None
+        return instance
 
     @classmethod
-    def _get_db(cls):
-        if cls._client is None or cls._db is None:
-            # print("Initializing MongoDB connection for BaseModel...") # For debugging
-            cls._client = MongoClient('mongodb://localhost:27017/')
-            cls._db = cls._client['security_policy_db']
-            # print(f"DB initialized: {cls._db.name}") # For debugging
-        return cls._db
+    def storage(cls) -> StorageBackend:
+        if BaseModel._storage is None:
+            BaseModel._storage = storage_from_config()
+        return BaseModel._storage
+
+    @staticmethod
+    def use_storage(storage: StorageBackend | None) -> None:
+        """Installs the storage backend used by every model; None reverts to the configured one."""
+        BaseModel._storage = storage
 
     @classmethod
     def _get_collection_name(cls) -> str:
@@ -26,22 +53,133 @@ class BaseModel:
 
     @classmethod
     def collection(cls):
-        db = cls._get_db()
         collection_name = cls._get_collection_name()
-        # print(f"Accessing collection: {collection_name} in db: {db.name}") # For debugging
-        return db[collection_name]
+        # print(f"Accessing collection: {collection_name}") # For debugging
+        return cls.storage().collection(collection_name)
+
+    @classmethod
+    def ensure_indexes(cls) -> None:
+        """Creates the indexes declared in INDEXES and UNIQUE_INDEXES, if the storage backend has not got them already."""
+        indexes = cls.INDEXES
+        if not cls.storage().indexes_array_elements:
+            # An index on the whole list could never serve a query for one of its elements
+            indexes = [fields for fields in indexes if fields[0].split('.')[0] not in cls.LIST_FIELDS]
+        if indexes:
+            cls.storage().ensure_indexes(cls._get_collection_name(), indexes)
+        if cls.UNIQUE_INDEXES:
+            cls.storage().ensure_indexes(cls._get_collection_name(), cls.UNIQUE_INDEXES, unique=True)
 
     @classmethod
-    def get_by_id(cls: Type[T], doc_id: str) -> T | None:
+    def get_by_id(cls: Type[T], doc_id: str, projection: Dict[str, Any] = None) -> T | None:
         # print(f"Getting {cls.__name__} by id: {doc_id}") # For debugging
-        document = cls.collection().find_one({'_id': doc_id})
-        return cls.from_dict(document) if document else None
+        if projection:
+            document = cls.collection().find_one({'_id': doc_id}, projection)
+        else:
+            document = cls.collection().find_one({'_id': doc_id})
+        return cls._hydrate(document, projection) if document else None
 
     @classmethod
     def get_all(cls: Type[T]) -> List[T]:
         # print(f"Getting all {cls.__name__}s") # For debugging
-        documents = cls.collection().find({})
-        return [cls.from_dict(doc) for doc in documents if doc]
+        return list(cls.iter_all())
+
+    @classmethod
+    def iter_all(cls: Type[T], query: Dict[str, Any] = None, projection: Dict[str, Any] = None,
+                 batch_size: int = None) -> Iterator[T]:
+        """
+        Yields the matching models one at a time as the cursor reads them, batch_size documents per
+        round trip, so a whole collection is never held in memory at once. projection limits the
+        fields read, e.g. {'password': 0}; the fields left out are never written back by save().
+        """
+        options = {'batch_size': batch_size} if batch_size else {}
+        for document in cls.collection().find(query or {}, projection, **options):
+            if document:
+                yield cls._hydrate(document, projection)
+
+    @classmethod
+    def _hydrate(cls: Type[T], document: Dict[str, Any], projection: Dict[str, Any] = None) -> T:
+        instance = cls.from_dict(document)
+        if instance is not None:
+            if projection:
+                # Fields the projection left out get their default values from from_dict; counting those
+                # as persisted keeps a delta save() from overwriting the stored values with them
+                instance._mark_persisted({**instance.to_dict(), **document})
+            else:
+                instance._mark_persisted(document)
+        return instance
+
+    def _mark_persisted(self, doc_data: Dict[str, Any]) -> None:
+        self._persisted = {field: value for field, value in doc_data.items() if field != '_id' and field not in self.LIST_FIELDS}
+        for field in self.LIST_FIELDS:
+            self._persisted[field] = getattr(self, field) # The model's own list, whatever doc_data holds
+        self._pushed = self._pulled = None
+
+    def mark_field_persisted(self, field: str) -> None:
+        """Records the current value of a field as stored, for writes made outside save()."""
+        if self._persisted is not None:
+            self._persisted[field] = getattr(self, field) if field in self.LIST_FIELDS else self.to_dict().get(field)
+            for changes in (self._pushed, self._pulled):
+                if changes:
+                    changes.pop(field, None)
+
+    def append_to(self, field: str, value: Any) -> bool:
+        """Appends value to one of the LIST_FIELDS, for the next save() to $push; False if it was there already."""
+        values = getattr(self, field)
+        if value in values:
+            return False
+        values.append(value)
+        if self._tracks(field):
+            self._pushed_values(field).append(value) # Pushed even if pulled before, to keep the order
+        return True
+
+    def remove_from(self, field: str, value: Any) -> bool:
+        """Removes value from one of the LIST_FIELDS, for the next save() to $pull; False if it was not there."""
+        values = getattr(self, field)
+        if value not in values:
+            return False
+        while value in values: # $pull removes every copy too
+            values.remove(value)
+        if self._tracks(field):
+            pushed = self._pushed_values(field)
+            if value in pushed: # Added since the last save, so not stored yet
+                pushed.remove(value)
+            else:
+                self._pulled_values(field).append(value)
+        return True
+
+    def _tracks(self, field: str) -> bool:
+        # Otherwise the next save() writes the whole list anyway
+        return self._persisted is not None and self._persisted.get(field) is getattr(self, field)
+
+    def _pushed_values(self, field: str) -> List[Any]:
+        if self._pushed is None:
+            self._pushed = {}
+        return self._pushed.setdefault(field, [])
+
+    def _pulled_values(self, field: str) -> List[Any]:
+        if self._pulled is None:
+            self._pulled = {}
+        return self._pulled.setdefault(field, [])
+
+    def _delta_updates(self, doc_data: Dict[str, Any]) -> List[Dict[str, Dict[str, Any]]]:
+        """The updates turning the stored document into doc_data: one, or two when a list has both pulls and pushes."""
+        sets, pulls, pushes = {}, {}, {}
+        for field, value in doc_data.items():
+            if field == '_id':
+                continue
+            if field in self.LIST_FIELDS and self._persisted.get(field) is value:
+                if self._pulled and self._pulled.get(field):
+                    pulls[field] = {'$in': list(self._pulled[field])}
+                if self._pushed and self._pushed.get(field):
+                    pushes[field] = {'$each': list(self._pushed[field])}
+            elif field not in self._persisted or field in self.LIST_FIELDS or self._persisted[field] != value:
+                sets[field] = value
+        update = {operator: fields for operator, fields in (('$set', sets), ('$pull', pulls)) if fields}
+        if pushes and pulls.keys() & pushes.keys(): # One update cannot both $pull from and $push to a field
+            return [update, {'$push': pushes}] if update else [{'$push': pushes}]
+        if pushes:
+            update['$push'] = pushes
+        return [update] if update else []
 
     def save(self: T) -> None:
         # print(f"Saving {self.__class__.__name__} with id: {getattr(self, 'id', getattr(self, '_id', 'N/A'))}") # For debugging
@@ -51,7 +189,31 @@ class BaseModel:
             # This case should ideally be handled by ensuring 'id' is set before save
             # or by letting MongoDB generate an ID if that's the design
             raise ValueError("Document must have an '_id' to save.")
+        if self._persisted is not None:
+            updates = self._delta_updates(doc_data)
+            if not updates:
+                return # Nothing changed since the last load or save
+            if all(self.collection().update_one({'_id': doc_id}, update).matched_count for update in updates):
+                self._mark_persisted(doc_data)
+                record_change(self._get_collection_name(), doc_id)
+                return
+            # The document is gone from the database; fall back to writing it in full
         self.collection().update_one({'_id': doc_id}, {'$set': doc_data}, upsert=True)
+        self._mark_persisted(doc_data)
+        record_change(self._get_collection_name(), doc_id)
+
+    def pending_writes(self) -> List[WriteOperation]:
+        """
+        The writes save() would make, as operations for StorageBackend.bulk_write, so that many
+        models can be saved in one round trip. Call mark_saved() once they are applied.
+        """
+        doc_data = self.to_dict()
+        if self._persisted is None:
+            return [('update_one', ({'_id': doc_data['_id']}, {'$set': doc_data}), {'upsert': True})]
+        return [('update_one', ({'_id': doc_data['_id']}, update), {}) for update in self._delta_updates(doc_data)]
+
+    def mark_saved(self) -> None:
+        self._mark_persisted(self.to_dict())
 
     def delete(self: T) -> None:
         doc_id = getattr(self, 'id', getattr(self, '_id', None))
@@ -59,6 +221,8 @@ class BaseModel:
             raise ValueError("Document must have an 'id' or '_id' to delete.")
         # print(f"Deleting {self.__class__.__name__} with id: {doc_id}") # For debugging
         self.collection().delete_one({'_id': doc_id})
+        self._persisted = None
+        record_change(self._get_collection_name(), doc_id)
 
     @classmethod
     def from_dict(cls: Type[T], data: Dict[str, Any]) -> T:
@@ -73,10 +237,8 @@ class BaseModel:
     @classmethod
     def get_capability_lists_collection(cls):
         # Special case for 'capability_lists' as it's singular in db schema but class might be CapabilityList
-        db = cls._get_db()
-        return db['capability_lists']
+        return cls.storage().collection('capability_lists')
 
     @classmethod
     def get_access_history_collection(cls):
-        db = cls._get_db()
-        return db['access_history'] 
\ No newline at end of file
+        return cls.storage().collection('access_history') 
\ No newline at end of file
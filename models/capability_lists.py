@@ -1,56 +1,201 @@
-from typing import Dict, List, Any
+from typing import Dict, FrozenSet, List, Any
 from .base_model import BaseModel
+from .storage import WriteOperation, DuplicateKeyError
+from .interning import intern_str, intern_set
+from .change_log import record_change
 
-# This model represents a single document in the 'capability_lists' collection.
-# The document ID is fixed to 'caps_matrix'.
+# In-memory user -> object -> actions matrix of direct capabilities. The actions of a pair are an
+# interned frozenset, shared by every pair with the same actions: checks take constant time, and a
+# grant or revoke swaps in the set with the action added or removed.
+# Each (user, object) pair is stored as its own document in the 'capability_lists' collection:
+#   {'user_id': ..., 'object_id': ..., 'actions': [...]}
+# Mutations queue $addToSet/$pull/delete deltas that save() applies, so the write cost of a
+# grant no longer depends on the total number of grants.
+# Older databases kept the whole matrix in a single document with the ID 'caps_matrix';
+# load() migrates it to the per-pair layout.
 class CapabilityList(BaseModel):
-    FIXED_ID = "caps_matrix"
+    __slots__ = ('id', 'matrix', '_pending')
+    FIXED_ID = "caps_matrix" # ID of the legacy singleton document
+    INDEXES = [('object_id',)]
+    # (user_id, object_id) is the filter of every grant and revoke, and its prefix serves per-user
+    # queries. Unique, as grants upsert by it: two concurrent first grants of a pair must not both
+    # insert a document, or a revoke would only remove one of them.
+    UNIQUE_INDEXES = [('user_id', 'object_id')]
 
     # Override collection name because it's 'capability_lists' not 'capabilitylists'
     @classmethod
     def _get_collection_name(cls) -> str:
         return 'capability_lists'
 
-    def __init__(self, matrix: Dict[str, Dict[str, List[str]]] = None):
-        self.id = self.FIXED_ID # Fixed ID for this singleton document
+    def __init__(self, matrix: Dict[str, Dict[str, FrozenSet[str]]] = None):
+        self.id = self.FIXED_ID
         self.matrix = matrix if matrix is not None else {}
+        self._pending = [] # (collection method, args, kwargs) deltas not yet sent to the database
 
     def to_dict(self) -> Dict[str, Any]:
         return {
             '_id': self.id,
-            'matrix': self.matrix
+            'matrix': {user_id: {obj_id: sorted(actions) for obj_id, actions in objects.items()}
+                       for user_id, objects in self.matrix.items()}
         }
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'CapabilityList':
+        """Builds a capability list from a legacy singleton document."""
         if not data:
             # Return a default/empty instance if no data found in DB for the fixed ID
             return cls(matrix={})
+        matrix = {
+            intern_str(user_id): {intern_str(obj_id): intern_set(actions) for obj_id, actions in objects.items()}
+            for user_id, objects in data.get('matrix', {}).items()
+        }
         return cls(
-            matrix=data.get('matrix', {})
+            matrix=matrix
             # id is fixed, no need to get from data['_id'] explicitly for instantiation
         )
     
     @classmethod
-    def load(cls) -> 'CapabilityList':
-        """Loads the single capability list document from the database."""
-        return cls.get_by_id(cls.FIXED_ID) or cls() # Ensure an instance is always returned
+    def load(cls, batch_size: int = None) -> 'CapabilityList':
+        """Loads every capability document from the database, migrating the legacy singleton first."""
+        cls.migrate_singleton()
+        caps = cls()
+        options = {'batch_size': batch_size} if batch_size else {}
+        for doc in cls.collection().find({}, {'_id': 0, 'user_id': 1, 'object_id': 1, 'actions': 1}, **options):
+            objects = caps.matrix.setdefault(intern_str(doc['user_id']), {})
+            object_id = intern_str(doc['object_id'])
+            objects[object_id] = intern_set([*objects.get(object_id, ()), *doc.get('actions', [])])
+        return caps
+
+    def reload(self, query: Dict[str, str]) -> List[tuple]:
+        """
+        Replaces the in-memory entries matching query (a user_id and/or object_id filter) with the
+        documents now stored. Returns the (user, object) pairs whose actions may have changed.
+        """
+        affected = []
+        for user_id in [query['user_id']] if 'user_id' in query else list(self.matrix):
+            objects = self.matrix.get(user_id, {})
+            for object_id in [query['object_id']] if 'object_id' in query else list(objects):
+                if object_id in objects:
+                    del objects[object_id]
+                    affected.append((user_id, object_id))
+            if user_id in self.matrix and not objects:
+                del self.matrix[user_id]
+        for doc in self.collection().find(query, {'_id': 0, 'user_id': 1, 'object_id': 1, 'actions': 1}):
+            if not doc.get('actions'):
+                continue
+            user_id, object_id = intern_str(doc['user_id']), intern_str(doc['object_id'])
+            self.matrix.setdefault(user_id, {})[object_id] = intern_set(doc['actions'])
+            if (user_id, object_id) not in affected:
+                affected.append((user_id, object_id))
+        return affected
+
+    @classmethod
+    def ensure_indexes(cls) -> None:
+        try:
+            super().ensure_indexes()
+        except DuplicateKeyError:
+            # Written before the index was unique
+            print(f"Merged {cls.merge_duplicates()} duplicate capability documents before indexing (user_id, object_id).")
+            super().ensure_indexes()
+
+    @classmethod
+    def merge_duplicates(cls) -> int:
+        """Merges the actions of documents for the same (user, object) pair into one. Returns the number removed."""
+        first: Dict[tuple, Any] = {}
+        removed = 0
+        for doc in cls.collection().find({}, {'_id': 1, 'user_id': 1, 'object_id': 1, 'actions': 1}):
+            if 'user_id' not in doc or 'object_id' not in doc:
+                continue # The legacy singleton
+            pair = (doc['user_id'], doc['object_id'])
+            if pair not in first:
+                first[pair] = doc['_id']
+                continue
+            cls.collection().update_one({'_id': first[pair]}, {'$addToSet': {'actions': {'$each': doc.get('actions', [])}}})
+            cls.collection().delete_one({'_id': doc['_id']})
+            removed += 1
+        return removed
+
+    @classmethod
+    def migrate_singleton(cls) -> int:
+        """
+        Splits the legacy 'caps_matrix' document into one document per (user, object) pair.
+        The upserts are idempotent, so an interrupted migration is finished on the next load.
+        Returns the number of pairs migrated.
+        """
+        legacy = cls.collection().find_one({'_id': cls.FIXED_ID})
+        if not legacy:
+            return 0
+        migrated = 0
+        for user_id, objects in legacy.get('matrix', {}).items():
+            for object_id, actions in objects.items():
+                if actions:
+                    cls.collection().update_one({'user_id': user_id, 'object_id': object_id},
+                                                {'$addToSet': {'actions': {'$each': actions}}}, upsert=True)
+                    migrated += 1
+        cls.collection().delete_one({'_id': cls.FIXED_ID})
+        print(f"Migrated {migrated} capabilities from the '{cls.FIXED_ID}' document.")
+        return migrated
+
+    def save(self) -> None:
+        """Sends the queued capability deltas to the database."""
+        if not self._pending:
+            return
+        operations, self._pending = self._pending, []
+        collection = self.collection()
+        for method, args, kwargs in operations:
+            getattr(collection, method)(*args, **kwargs)
+            record_change(self._get_collection_name(), args[0]) # The filter names the documents written
+
+    def pending_writes(self) -> List[WriteOperation]:
+        """The queued deltas, as operations for StorageBackend.bulk_write."""
+        return list(self._pending)
+
+    def mark_saved(self) -> None:
+        self._pending = []
+
+    def _queue(self, method: str, *args, **kwargs):
+        self._pending.append((method, args, kwargs))
+
+    def delete(self) -> None:
+        self._pending = []
+        self.matrix = {}
+        self.collection().delete_many({})
+        record_change(self._get_collection_name(), {})
 
     def add_permission(self, user_id: str, object_id: str, action: str):
         if user_id not in self.matrix:
             self.matrix[user_id] = {}
-        if object_id not in self.matrix[user_id]:
-            self.matrix[user_id][object_id] = []
-        if action not in self.matrix[user_id][object_id]:
-            self.matrix[user_id][object_id].append(action)
+        actions = self.matrix[user_id].get(object_id, frozenset())
+        if action not in actions:
+            self.matrix[user_id][object_id] = intern_set(actions | {action})
+            self._queue('update_one', {'user_id': user_id, 'object_id': object_id},
+                        {'$addToSet': {'actions': action}}, upsert=True)
 
     def remove_permission(self, user_id: str, object_id: str, action: str):
         if user_id in self.matrix and object_id in self.matrix[user_id] and action in self.matrix[user_id][object_id]:
-            self.matrix[user_id][object_id].remove(action)
-            if not self.matrix[user_id][object_id]: # Clean up empty list
+            self.matrix[user_id][object_id] = intern_set(self.matrix[user_id][object_id] - {action})
+            if not self.matrix[user_id][object_id]: # Clean up empty set
                 del self.matrix[user_id][object_id]
+                self._queue('delete_one', {'user_id': user_id, 'object_id': object_id})
+            else:
+                self._queue('update_one', {'user_id': user_id, 'object_id': object_id}, {'$pull': {'actions': action}})
+            if not self.matrix[user_id]: # Clean up empty user entry
+                del self.matrix[user_id]
+
+    def remove_object_permissions(self, user_id: str, object_id: str):
+        if user_id in self.matrix and object_id in self.matrix[user_id]:
+            del self.matrix[user_id][object_id]
             if not self.matrix[user_id]: # Clean up empty user entry
                 del self.matrix[user_id]
+            self._queue('delete_one', {'user_id': user_id, 'object_id': object_id})
+
+    def remove_user(self, user_id: str):
+        if user_id in self.matrix:
+            del self.matrix[user_id]
+            self._queue('delete_many', {'user_id': user_id})
+
+    def has_object(self, user_id: str, object_id: str) -> bool:
+        return user_id in self.matrix and object_id in self.matrix[user_id]
 
     def remove_all_permissions_for_object(self, object_id: str):
         users_to_update = []
@@ -62,6 +207,8 @@ class CapabilityList(BaseModel):
             del self.matrix[user_id][object_id]
             if not self.matrix[user_id]: # Clean up empty user entry
                 del self.matrix[user_id]
+        if users_to_update:
+            self._queue('delete_many', {'object_id': object_id})
 
     def check_permission(self, user_id: str, object_id: str, action: str) -> bool:
         return user_id in self.matrix and \
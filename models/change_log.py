@@ -0,0 +1,104 @@
+import contextvars
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List
+
+# Policy change log shared by every PolicyEngine using the same storage.
+# Each mutation appends one entry naming the documents it wrote:
+#   {'_id': seq, 'origin': <engine id>, 'changes': [[collection, key], ...], 'ts': <unix time>}
+# where key is a document id, or for capability_lists the filter of the documents written.
+# seq comes from an atomic counter, so it doubles as a global policy version: an engine that has
+# applied every entry up to seq reflects every mutation made anywhere up to that version.
+# Other engines tail the log and reload the named documents into their in-memory caches.
+
+# Changes recorded by the mutation running in the current context, see capture_changes
+_recorder: contextvars.ContextVar = contextvars.ContextVar('policy_change_recorder', default=None)
+# Version of the last entry published from the current context, for read-your-writes tokens
+_published: contextvars.ContextVar = contextvars.ContextVar('policy_change_published', default=0)
+
+def record_change(collection: str, key: Any):
+    """Notes that a document was written, if a mutation is capturing changes in this context."""
+    changes = _recorder.get()
+    if changes is not None and [collection, key] not in changes:
+        changes.append([collection, key])
+
+def capturing_changes() -> bool:
+    return _recorder.get() is not None
+
+class capture_changes:
+    """Collects the record_change calls made inside the with block into a list."""
+    def __enter__(self) -> List[List[Any]]:
+        self._token = _recorder.set([])
+        return _recorder.get()
+
+    def __exit__(self, exc_type, exc, tb):
+        _recorder.reset(self._token)
+        return False
+
+def published_version() -> int:
+    return _published.get()
+
+def reset_published_version():
+    _published.set(0)
+
+
+class ChangeLog:
+    COLLECTION = 'policy_changelog'
+
+    def __init__(self, storage: Callable, poll_interval: float = 1.0, gap_timeout: float = 5.0):
+        self._storage = storage # Returns the current StorageBackend, e.g. BaseModel.storage
+        self.origin = uuid.uuid4().hex # Identifies the entries written by this engine
+        self.poll_interval = poll_interval
+        self.gap_timeout = gap_timeout # How long to wait for an entry whose sequence number was taken
+        self._last_poll = 0.0
+        self._new_entries = threading.Event()
+        self.watching = False
+
+    def _collection(self):
+        return self._storage().collection(self.COLLECTION)
+
+    def append(self, changes: List[List[Any]]) -> int:
+        seq = self._storage().next_sequence(self.COLLECTION)
+        self._collection().insert_one({'_id': seq, 'origin': self.origin, 'changes': changes, 'ts': time.time()})
+        _published.set(seq)
+        return seq
+
+    def latest_version(self) -> int:
+        return self._storage().current_sequence(self.COLLECTION)
+
+    def entry(self, seq: int) -> Dict[str, Any] | None:
+        return self._collection().find_one({'_id': seq})
+
+    def should_poll(self) -> bool:
+        """
+        Rate-limits polling: True when a change stream reported new entries, or when poll_interval
+        has passed since the last poll.
+        """
+        now = time.monotonic()
+        if self._new_entries.is_set() or now - self._last_poll >= self.poll_interval:
+            self._new_entries.clear()
+            self._last_poll = now
+            return True
+        return False
+
+    def start_watching(self):
+        """
+        Listens for inserts through a MongoDB change stream, so new entries are picked up without
+        waiting for poll_interval. Storage without change streams (standalone servers, SQLite,
+        memory) keeps polling.
+        """
+        collection = self._collection()
+        if not hasattr(collection, 'watch'):
+            return
+        threading.Thread(target=self._watch, args=(collection,), name='policy-changelog-watch', daemon=True).start()
+
+    def _watch(self, collection):
+        try:
+            with collection.watch([{'$match': {'operationType': 'insert'}}]) as stream:
+                self.watching = True
+                for _ in stream:
+                    self._new_entries.set()
+        except Exception as e:
+            print(f"Change streams unavailable, polling the policy change log every {self.poll_interval}s: {e}")
+        self.watching = False
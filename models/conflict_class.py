@@ -1,7 +1,12 @@
 from typing import List, Dict, Any
 from .base_model import BaseModel
+from .interning import intern_list
 
 class ConflictClass(BaseModel):
+    __slots__ = ('id', 'name', 'datasets')
+    INDEXES = [('datasets',)] # Conflict classes containing a dataset
+    LIST_FIELDS = ('datasets',)
+
     # Override collection name because it's 'conflict_classes' not 'conflictclasss'
     @classmethod
     def _get_collection_name(cls) -> str:
@@ -26,7 +31,7 @@ class ConflictClass(BaseModel):
         return cls(
             class_id=data['_id'], # Load from _id
             name=data.get('name'),
-            datasets=data.get('datasets', [])
+            datasets=intern_list(data.get('datasets', []))
         )
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
 from typing import List, Dict, Any
 from .base_model import BaseModel
+from .interning import intern_list
 
 class Dataset(BaseModel):
+    __slots__ = ('id', 'name', 'description', 'objects')
+    LIST_FIELDS = ('objects',)
+
     def __init__(self, id: str, name: str, description: str = None, objects: List[str] = None):
         self.id = id
         self.name = name
@@ -24,7 +28,7 @@ class Dataset(BaseModel):
             id=data['_id'],
             name=data.get('name'),
             description=data.get('description'),
-            objects=data.get('objects', [])
+            objects=intern_list(data.get('objects', []))
         )
 
 if __name__ == "__main__":
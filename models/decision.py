@@ -0,0 +1,65 @@
+from enum import Enum
+from typing import Any, Dict, Iterator
+
+class DecisionCode(Enum):
+    GRANTED_BY_ROLE = "granted_by_role"
+    GRANTED_BY_CAPABILITY = "granted_by_capability"
+    OBJECT_NOT_FOUND = "object_not_found"
+    CHINESE_WALL_CONFLICT = "chinese_wall_conflict"
+    NO_PERMISSION = "no_permission"
+    ERROR = "error"
+
+# Compact result of an access check: the outcome, a code and the ids involved.
+# The human-readable reason is only rendered when .reason is read, so callers that
+# only look at .allowed never pay for string formatting or name lookups.
+# Unpacks like the (allowed, reason) tuples check_access used to return.
+class Decision:
+    __slots__ = ('allowed', 'code', 'user_id', 'object_id', 'action', 'detail', 'grant', '_engine')
+
+    def __init__(self, allowed: bool, code: DecisionCode, user_id: str, object_id: str, action: str,
+                 detail: str = None, engine=None, grant: bool = False):
+        self.allowed = allowed
+        self.code = code
+        self.user_id = user_id
+        self.object_id = object_id
+        self.action = action
+        self.detail = detail # Granting role id, blocking dataset id or error message, depending on code
+        self.grant = grant # Rendered as the outcome of grant_access rather than check_access
+        self._engine = engine
+
+    @property
+    def reason(self) -> str:
+        return self._engine.render_reason(self)
+
+    def as_grant(self) -> 'Decision':
+        return Decision(self.allowed, self.code, self.user_id, self.object_id, self.action,
+                        self.detail, self._engine, grant=True)
+
+    def to_dict(self, verbose: bool = True) -> Dict[str, Any]:
+        if verbose:
+            return {'allowed': self.allowed, 'reason': self.reason}
+        return {'allowed': self.allowed, 'code': self.code.value}
+
+    def __iter__(self) -> Iterator[Any]:
+        yield self.allowed
+        yield self.reason
+
+    def __getitem__(self, index: int) -> Any:
+        return (self.allowed, self.reason)[index] if index else self.allowed
+
+    def __len__(self) -> int:
+        return 2
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Decision):
+            return (self.allowed, self.code, self.user_id, self.object_id, self.action, self.detail, self.grant) == \
+                   (other.allowed, other.code, other.user_id, other.object_id, other.action, other.detail, other.grant)
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Decision(allowed={self.allowed}, code={self.code.value}, user_id={self.user_id!r}, " \
+               f"object_id={self.object_id!r}, action={self.action!r}, detail={self.detail!r})"
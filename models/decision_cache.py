@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+# Bounded LRU cache of access decisions.
+# Every entry is stamped with the policy versions it was computed under; an entry whose
+# stamp no longer matches the engine's current versions is treated as a miss and dropped.
+class DecisionCache:
+    def __init__(self, max_size: int = 10000):
+        if max_size <= 0:
+            raise ValueError("Decision cache size must be positive.")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, versions: Tuple[int, ...]) -> Any:
+        """Returns the cached decision for key, or None if missing or computed under other versions."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != versions:
+                if entry is not None:
+                    del self._entries[key] # Stale: policy changed since it was cached
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, versions: Tuple[int, ...], decision: Any):
+        with self._lock:
+            self._entries[key] = (versions, decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+if __name__ == "__main__":
+    cache = DecisionCache(max_size=2)
+    cache.put(("user1", "obj1", "read"), (1, 0), (True, "allowed"))
+    print(cache.get(("user1", "obj1", "read"), (1, 0))) # (True, 'allowed')
+    print(cache.get(("user1", "obj1", "read"), (2, 0))) # None, stale
+    print(cache.stats())
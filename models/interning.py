@@ -0,0 +1,58 @@
+import sys
+from typing import Any, Dict, List, Iterable
+
+# Maps string identifiers (user, object, dataset, conflict class and action ids) to dense
+# integers so hot-path indexes can key on small ints instead of arbitrary strings, and so
+# array-based structures can use the ids directly as positions.
+# Ids are never reused: removing an entity from the policy leaves its id allocated.
+class IdInterner:
+    def __init__(self, names: Iterable[str] = ()):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name: str) -> int:
+        """Returns the id of name, allocating the next free id on first use."""
+        i = self._ids.get(name)
+        if i is None:
+            i = len(self._names)
+            self._ids[name] = i
+            self._names.append(name)
+        return i
+
+    def get(self, name: str) -> int | None:
+        """Returns the id of name without allocating one."""
+        return self._ids.get(name)
+
+    def name(self, i: int) -> str:
+        return self._names[i]
+
+    def names(self, ids: Iterable[int]) -> List[str]:
+        return [self._names[i] for i in ids]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+# Helpers for sharing one string object between identical identifiers loaded from the database
+def intern_str(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+def intern_list(values: Iterable[Any]) -> List[Any]:
+    return [intern_str(value) for value in values]
+
+# Small immutable sets (e.g. the actions of one capability) recur across millions of entries;
+# each distinct one is kept once here and shared
+_frozensets: Dict[frozenset, frozenset] = {}
+
+def intern_set(values: Iterable[Any]) -> frozenset:
+    values = frozenset(intern_str(value) for value in values)
+    return _frozensets.setdefault(values, values)
+
+if __name__ == "__main__":
+    interner = IdInterner(["read", "write"])
+    print(interner.intern("read"), interner.intern("delete")) # 0 2
+    print(interner.get("share"), interner.name(1)) # None write
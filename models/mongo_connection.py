@@ -0,0 +1,139 @@
+import os
+import threading
+import weakref
+from typing import Any, Dict
+from pymongo import MongoClient, monitoring
+
+# Tracks connection pool events so pool usage can be reported without reaching into pymongo internals
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'created': 0, 'closed': 0, 'checked_out': 0, 'checked_in': 0,
+                         'check_out_failed': 0, 'pools_cleared': 0}
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def connection_created(self, event):
+        self._count('created')
+
+    def connection_closed(self, event):
+        self._count('closed')
+
+    def connection_checked_out(self, event):
+        self._count('checked_out')
+
+    def connection_checked_in(self, event):
+        self._count('checked_in')
+
+    def connection_check_out_failed(self, event):
+        self._count('check_out_failed')
+
+    def pool_cleared(self, event):
+        self._count('pools_cleared')
+
+    # Remaining pool events are not tracked
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats['open'] = stats['created'] - stats['closed']
+        stats['in_use'] = stats['checked_out'] - stats['checked_in']
+        return stats
+
+
+# Owns the MongoClient of one process.
+# A client must not be used across fork(): its sockets and monitor threads belong to the parent.
+# The manager remembers the PID that created the client and, when it is asked for the client from a
+# different PID (a prefork worker such as gunicorn's), drops the inherited client and connects anew.
+# Clients are created with connect=False, so a master process that never runs a query opens no sockets.
+class MongoConnectionManager:
+    def __init__(self, uri: str = 'mongodb://localhost:27017/', db_name: str = 'security_policy_db',
+                 max_pool_size: int = 100, min_pool_size: int = 0, server_selection_timeout_ms: int = 30000,
+                 write_concern: str = None, read_concern: str = None):
+        self.uri = uri
+        self.db_name = db_name
+        self.client_options: Dict[str, Any] = {
+            'maxPoolSize': max_pool_size,
+            'minPoolSize': min_pool_size,
+            'serverSelectionTimeoutMS': server_selection_timeout_ms,
+        }
+        if write_concern:
+            # Numeric write concerns ("1", "2") are acknowledgement counts, anything else is a tag such as "majority"
+            self.client_options['w'] = int(write_concern) if write_concern.isdigit() else write_concern
+        if read_concern:
+            self.client_options['readConcernLevel'] = read_concern
+        self._lock = threading.Lock()
+        self._client: MongoClient = None
+        self._pid = None
+        self._listener: PoolStatsListener = None
+        self.reconnects = 0 # Clients replaced after a fork
+        if hasattr(os, 'register_at_fork'):
+            # The lock may have been held by another thread of the parent at the time of the fork
+            manager = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: manager() and manager()._reset_lock())
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, str]) -> 'MongoConnectionManager':
+        return cls(
+            uri=config.get('MONGODB_URI', 'mongodb://localhost:27017/'),
+            db_name=config.get('MONGODB_DB', 'security_policy_db'),
+            max_pool_size=int(config.get('MONGODB_MAX_POOL_SIZE', '100')),
+            min_pool_size=int(config.get('MONGODB_MIN_POOL_SIZE', '0')),
+            server_selection_timeout_ms=int(config.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '30000')),
+            write_concern=config.get('MONGODB_WRITE_CONCERN'),
+            read_concern=config.get('MONGODB_READ_CONCERN')
+        )
+
+    @property
+    def client(self) -> MongoClient:
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    if self._client is not None:
+                        # Inherited from the parent: abandon it rather than closing sockets the parent still uses
+                        self.reconnects += 1
+                    self._listener = PoolStatsListener()
+                    self._client = MongoClient(self.uri, connect=False, event_listeners=[self._listener], **self.client_options)
+                    self._pid = pid
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            'pid': self._pid,
+            'reconnects': self.reconnects,
+            'max_pool_size': self.client_options['maxPoolSize'],
+            'min_pool_size': self.client_options['minPoolSize'],
+        }
+        stats.update(self._listener.snapshot() if self._listener else {})
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
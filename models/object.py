@@ -1,7 +1,11 @@
 from typing import Dict, Any
 from .base_model import BaseModel
+from .interning import intern_str
 
 class Object(BaseModel):
+    __slots__ = ('id', 'name', 'dataset', 'conflict_class')
+    INDEXES = [('dataset',), ('conflict_class',)]
+
     def __init__(self, id: str, name: str, dataset: str, conflict_class: str = None):
         self.id = id # Used as _id
         self.name = name
@@ -23,8 +27,8 @@ class Object(BaseModel):
         return cls(
             id=data['_id'],
             name=data.get('name'),
-            dataset=data.get('dataset'),
-            conflict_class=data.get('conflict_class')
+            dataset=intern_str(data.get('dataset')),
+            conflict_class=intern_str(data.get('conflict_class'))
         )
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from .user import hash_password_util
+
+# Hashes passwords with bcrypt in a bounded pool of worker processes, by default one per core.
+# A bcrypt hash at the default cost takes a few hundred milliseconds of CPU; done inline, every
+# user creation or password change holds a request thread and competes for the cores serving the
+# other requests, and a bulk import hashes one password at a time. The pool is started on first
+# use. Workers are forked where possible: the spawn and forkserver start methods would import the
+# main script (e.g. backend/app.py, which loads a policy engine) again in every worker.
+class PasswordHasher:
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool: ProcessPoolExecutor = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def submit(self, password: str) -> Future:
+        """Queues a password for hashing; the future's result is the hash, as from hash_password_util."""
+        return self._executor().submit(hash_password_util, password)
+
+    def hash(self, password: str) -> str:
+        return self.submit(password).result()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
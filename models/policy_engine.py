@@ -1,7 +1,12 @@
-from collections import UserDict
+from collections import UserDict, deque
+import functools
 import json
+import pickle
 import sys
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from models.conflict_class import ConflictClass
 from models.capability_lists import CapabilityList
@@ -9,8 +14,17 @@ from models.dataset import Dataset
 from models.object import Object
 from models.role import Role, Permission
 from models.user import User, hash_password_util
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, Callable, Iterable, List, Set
 from models.base_model import BaseModel
+from models.storage import DEFAULT_BATCH_SIZE, DuplicateKeyError
+from models.decision_cache import DecisionCache
+from models.decision import Decision, DecisionCode
+from models.interning import IdInterner
+from models.write_behind import AccessWriteBehind
+from models.change_log import ChangeLog, capture_changes, capturing_changes, record_change
+from models.snapshot import load_snapshot, SnapshotError
+from models.user_cache import UserCache
+from models.password_hasher import PasswordHasher
 
 class AccessHistoryEntry:
     def __init__(self, user_id: str, accessed_datasets: List[str]):
@@ -24,57 +38,715 @@ class AccessHistoryEntry:
     def from_dict(cls, data):
         return cls(user_id=data['user_id'], accessed_datasets=data.get('accessed_datasets', []))
 
+# Dataset id of the objects that belong to no dataset, in PolicyEngine.object_datasets
+NO_DATASET = -1
+
+# Mutations accepted by PolicyEngine.apply_batch, with their required arguments
+BATCH_OPERATIONS = {
+    'add_permission_to_role': ('role_id', 'object_id', 'action'),
+    'revoke_permission_from_role': ('role_id', 'object_id', 'action'),
+    'grant_direct_permission': ('user_id', 'object_id', 'action'),
+    'revoke_direct_permission': ('user_id', 'object_id', 'action'),
+    'assign_role_to_user': ('user_id', 'role_id'),
+    'revoke_role_from_user': ('user_id', 'role_id'),
+}
+
+def publishes_changes(method):
+    """Appends the documents written by a PolicyEngine mutation to its change log, if enabled."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.change_log is None or capturing_changes():
+            return method(self, *args, **kwargs) # Nested mutations publish with the outermost one
+        with capture_changes() as changes:
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if changes: # Also after a failure part way through, for the writes that did happen
+                    self._publish(changes)
+    return wrapper
+
 class PolicyEngine:
-    def __init__(self):
+    def __init__(self, decision_cache_size: int = 0, access_journal_path: str = None,
+                 change_log: bool = False, change_poll_interval: float = 1.0, snapshot_path: str = None,
+                 user_cache_size: int = 0, prewarm_users: List[str] = None, load_batch_size: int = DEFAULT_BATCH_SIZE,
+                 password_hash_workers: int = 0):
+        # Documents read per cursor round trip when loading and listing collections
+        self.load_batch_size = load_batch_size
+        # With password_hash_workers, passwords are hashed in a pool of that many processes instead of inline
+        self.password_hasher = PasswordHasher(password_hash_workers) if password_hash_workers > 0 else None
         # In-memory caches
-        self.users: Dict[str, User] = {}
+        # With user_cache_size, users and their access history are loaded on first use into a bounded
+        # LRU cache instead of all at startup; role_users stays complete (it is built from the roles
+        # field alone) and the per-user indexes below only cover resident users.
+        self.lazy_users = user_cache_size > 0
+        self.users: Dict[str, User] = UserCache(user_cache_size, self._fetch_user, self._evict_user) if self.lazy_users else {}
         self.roles: Dict[str, Role] = {}
         self.objects: Dict[str, Object] = {}
         self.datasets: Dict[str, Dataset] = {}
         self.conflict_classes: Dict[str, ConflictClass] = {}
         self.caps: CapabilityList = None
         self.user_access_history: Dict[str, List[str]] = {} # user_id -> list of dataset_ids
-        self._load_data()
+        # Dense integer ids for the identifiers used as keys by the hot-path indexes below
+        self.user_ids = IdInterner()
+        self.object_ids = IdInterner()
+        self.dataset_ids = IdInterner()
+        self.conflict_class_ids = IdInterner()
+        self.action_ids = IdInterner()
+        self.dataset_conflict_classes: Dict[int, List[int]] = {} # dataset id -> conflict class ids
+        self.role_users: Dict[str, Set[int]] = {} # role_id -> ids of the users holding the role
+        self.dataset_objects: Dict[int, Set[int]] = {} # dataset id -> ids of the objects it contains
+        self.object_datasets: Dict[int, int] = {} # object id -> id of its dataset (NO_DATASET if none), for every object
+        # user id -> object id -> action id -> ids of the roles granting it (flattened RBAC)
+        self.effective_permissions: Dict[int, Dict[int, Dict[int, List[str]]]] = {}
+        # Reverse indexes used by delete_object to touch only the affected roles and capability holders
+        self.object_roles: Dict[int, Dict[str, List[str]]] = {} # object id -> role_id -> actions it grants on it
+        self.object_cap_holders: Dict[int, Set[int]] = {} # object id -> ids of users with direct capabilities on it
+        # user id -> dataset id the user is walled off from -> id of the accessed dataset blocking it
+        self.user_blocked_datasets: Dict[int, Dict[int, int]] = {}
+        # Policy version counters used to invalidate cached decisions
+        self.policy_version = 0 # Bumped on role, object, dataset, conflict class and capability mutations
+        self.user_versions: Dict[str, int] = {} # Bumped on a user's access history and role changes
+        self.decision_cache = DecisionCache(decision_cache_size) if decision_cache_size > 0 else None
+        # Optional policy change log keeping engines in other processes coherent with this one's
+        # mutations and vice versa (see models/change_log.py and sync())
+        self.change_log = ChangeLog(BaseModel.storage, change_poll_interval) if change_log else None
+        self.change_seq = 0 # Last change log entry reflected in the caches
+        self._sync_lock = threading.Lock()
+        self._gap_since: float = None # When sync() first found the next entry missing
+        self._startup_seq = 0 # Entries up to this one are applied even if this engine wrote them (journal replay)
+        # Optional write-behind mode for record_access, journaling to access_journal_path
+        self.access_writer = AccessWriteBehind(access_journal_path, on_write=self._publish_accesses) if access_journal_path else None
+        if self.access_writer:
+            self.access_writer.replay() # Before loading, so accesses journaled by a previous run are included
+        start = time.perf_counter()
+        self.startup_stats: Dict[str, Any] = {'source': "database"}
+        if self.change_log:
+            # Read before loading: entries written meanwhile are applied again by sync(), which is harmless
+            self.change_seq = self._startup_seq = self.change_log.latest_version()
+            self.change_log.start_watching()
+        self._ensure_indexes()
+        if not (snapshot_path and self._load_snapshot(snapshot_path)):
+            self._load_data()
+        for user_id in prewarm_users or []: # Known-hot users, loaded now rather than on their first request
+            self.users.get(user_id)
+        self.startup_stats['seconds'] = round(time.perf_counter() - start, 3)
+        print(f"Policy engine loaded from {self.startup_stats['source']} in {self.startup_stats['seconds']}s.")
+        if self.access_writer:
+            self.access_writer.start()
+
+    def _ensure_indexes(self):
+        """Creates the secondary indexes the models declare in INDEXES, for queries other than by _id."""
+        for model in (User, Role, Object, Dataset, ConflictClass, CapabilityList):
+            try:
+                model.ensure_indexes()
+            except DuplicateKeyError as e: # The data of this collection breaks a unique index, the others may be fine
+                print(f"Warning: could not create the indexes of {model._get_collection_name()}: {e}")
+            except Exception as e: # E.g. a database user without the createIndex privilege; queries still work
+                # Stop at the first failure: without a reachable database, every model would wait out
+                # the server selection timeout again
+                print(f"Warning: could not create the indexes of {model._get_collection_name()}, "
+                      f"skipping the remaining collections: {e}")
+                return
+
+    def _load_snapshot(self, path: str) -> bool:
+        """Loads the state saved by models/snapshot.py and applies the changes made since. False if unusable."""
+        if self.change_log is None:
+            print(f"Ignoring snapshot {path}: snapshots need the policy change log to catch up.")
+            return False
+        if not os.path.exists(path):
+            return False
+        latest = self.change_seq
+        try:
+            header = load_snapshot(self, path, max_change_seq=latest)
+        except (OSError, SnapshotError, pickle.UnpicklingError) as e:
+            print(f"Ignoring snapshot {path}: {e}")
+            return False
+        self.sync(latest)
+        self.startup_stats.update(source=f"snapshot {path}", snapshot_seq=header['change_seq'],
+                                  changes_applied=self.change_seq - header['change_seq'])
+        return True
+
+    def close(self):
+        """Flushes pending write-behind accesses to the database and stops the password hashing workers. Call on shutdown."""
+        if self.access_writer:
+            self.access_writer.close()
+        if self.password_hasher:
+            self.password_hasher.close()
     
     def _load_data(self):
         """Load all data from MongoDB into memory using ORM methods."""
-        self.users = {user.id: user for user in User.get_all()}
-        self.roles = {role.id: role for role in Role.get_all()}
-        self.objects = {obj.id: obj for obj in Object.get_all()}
-        self.datasets = {ds.id: ds for ds in Dataset.get_all()}
-        self.conflict_classes = {cc.id: cc for cc in ConflictClass.get_all()}
-        
-        self.caps = CapabilityList.load()
-        if not self.caps:
-            self.caps = CapabilityList()
-            self.caps.save()
-        
-        raw_history_docs = BaseModel.get_access_history_collection().find({})
-        for doc in raw_history_docs:
-            entry = AccessHistoryEntry.from_dict(doc)
-            self.user_access_history[entry.user_id] = entry.accessed_datasets
-            if entry.user_id in self.users:
-                self.users[entry.user_id].access_history = entry.accessed_datasets
+        # The collections are read concurrently, each streamed load_batch_size documents at a time
+        # into a dict of its own; the caches and indexes are then built from them in dependency order
+        batch_size = self.load_batch_size
+        def load_users():
+            if not self.lazy_users:
+                return {user.id: user for user in User.iter_all(projection=User.WITHOUT_PASSWORD, batch_size=batch_size)}
+            holders: Dict[str, List[str]] = {} # Lazy user mode only needs to know who holds each role
+            for doc in User.collection().find({}, {'_id': 1, 'roles': 1}, batch_size=batch_size):
+                for role_id in doc.get('roles', []):
+                    holders.setdefault(role_id, []).append(doc['_id'])
+            return holders
+        def load_access_history():
+            # Lazily loaded users bring their access history with them, see _fetch_user
+            if self.lazy_users:
+                return {}
+            entries = (AccessHistoryEntry.from_dict(doc) for doc in BaseModel.get_access_history_collection().find({}, batch_size=batch_size))
+            return {entry.user_id: entry.accessed_datasets for entry in entries}
+        loaded = self._load_concurrently({
+            'users': load_users,
+            'roles': lambda: {role.id: role for role in Role.iter_all(batch_size=batch_size)},
+            'objects': lambda: {obj.id: obj for obj in Object.iter_all(batch_size=batch_size)},
+            'datasets': lambda: {ds.id: ds for ds in Dataset.iter_all(batch_size=batch_size)},
+            'conflict_classes': lambda: {cc.id: cc for cc in ConflictClass.iter_all(batch_size=batch_size)},
+            'capability_lists': lambda: CapabilityList.load(batch_size),
+            'access_history': load_access_history,
+        })
+
+        # Roles before users: indexing a user's roles flattens their permissions
+        self.roles = loaded['roles']
+        self.object_roles = {}
+        for role in self.roles.values():
+            for perm in role.permissions:
+                self._index_role_permission(role.id, perm)
+        self.role_users = {}
+        self.effective_permissions = {}
+        if self.lazy_users:
+            for role_id, user_ids in loaded['users'].items():
+                self.role_users[role_id] = {self.user_ids.intern(user_id) for user_id in user_ids}
+        else:
+            self.users = loaded['users']
+        for user in self.users.values():
+            self._index_user_roles(user)
+        self.objects = loaded['objects']
+        self.datasets = loaded['datasets']
+        self.dataset_objects = {}
+        self.object_datasets = {}
+        for obj in self.objects.values():
+            self._index_dataset_object(obj.dataset, obj.id)
+        self.conflict_classes = loaded['conflict_classes']
+        self.dataset_conflict_classes = {}
+        for cc in self.conflict_classes.values():
+            self._index_conflict_class(cc)
         
+        self.caps = loaded['capability_lists']
+        self.object_cap_holders = {}
+        for user_id, objects in self.caps.matrix.items():
+            u = self.user_ids.intern(user_id)
+            for obj_id in objects:
+                self.object_cap_holders.setdefault(self.object_ids.intern(obj_id), set()).add(u)
         
+        # Access history last: it is merged into the users, and the walls depend on the conflict classes
+        for user_id, accessed_datasets in loaded['access_history'].items():
+            self.user_access_history[user_id] = accessed_datasets
+            if user_id in self.users:
+                # A copy, as record_access appends to each, filled in place so save() still finds the stored list
+                self.users[user_id].access_history[:] = accessed_datasets
+        self._rebuild_blocked_datasets()
+
+    def _load_concurrently(self, loaders: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+        """Runs each collection's loader on a thread pool and returns their results by name, timing each one."""
+        BaseModel.storage() # Created here, so the loader threads do not race to create it
+        timings: Dict[str, float] = {}
+        def timed(name: str, load: Callable[[], Any]) -> Any:
+            start = time.perf_counter()
+            try:
+                return load()
+            finally:
+                timings[name] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix='policy-load') as pool:
+            futures = {name: pool.submit(timed, name, load) for name, load in loaders.items()}
+            loaded = {name: future.result() for name, future in futures.items()}
+        self.startup_stats['collections'] = timings
+        slowest = ", ".join(f"{name} {seconds}s" for name, seconds in sorted(timings.items(), key=lambda item: -item[1]))
+        print(f"Loaded policy collections in {time.perf_counter() - start:.3f}s (slowest first: {slowest}).")
+        return loaded
+
+    def _fetch_user(self, user_id: str) -> User | None:
+        """Loads one user and its access history into the per-user indexes (lazy user mode)."""
+        user = User.get_by_id(user_id, User.WITHOUT_PASSWORD)
+        if not user:
+            return None
+        doc = BaseModel.get_access_history_collection().find_one({'_id': user_id})
+        if doc:
+            history = AccessHistoryEntry.from_dict(doc).accessed_datasets
+            self.user_access_history[user_id] = history
+            user.access_history[:] = history
+        self._index_user_roles(user)
+        u = self.user_ids.intern(user_id)
+        for accessed_ds_id in self.user_access_history.get(user_id, []):
+            self._block_conflicting_datasets(u, accessed_ds_id)
+        return user
+
+    def _evict_user(self, user: User):
+        # role_users keeps the user: it has to answer for every user, resident or not
+        u = self.user_ids.get(user.id)
+        self.effective_permissions.pop(u, None)
+        self.user_blocked_datasets.pop(u, None)
+        self.user_access_history.pop(user.id, None)
+
+    def _resident_holders(self, role_id: str) -> List[int]:
+        """Ids of the users holding the role whose per-user indexes are loaded."""
+        holders = self.role_users.get(role_id, ())
+        if not self.lazy_users:
+            return list(holders)
+        return [u for u in holders if self.users.resident(self.user_ids.name(u))]
+
+    def user_cache_stats(self) -> Dict[str, Any]:
+        if not self.lazy_users:
+            return {'enabled': False, 'size': len(self.users)}
+        return {'enabled': True, **self.users.stats()}
+
+    def _index_conflict_class(self, cc: ConflictClass):
+        c = self.conflict_class_ids.intern(cc.id)
+        for ds_id in cc.datasets:
+            cc_ids = self.dataset_conflict_classes.setdefault(self.dataset_ids.intern(ds_id), [])
+            if c not in cc_ids:
+                cc_ids.append(c)
+
+    def _unindex_conflict_class(self, cc: ConflictClass):
+        c = self.conflict_class_ids.get(cc.id)
+        for ds_id in cc.datasets:
+            d = self.dataset_ids.get(ds_id)
+            cc_ids = self.dataset_conflict_classes.get(d)
+            if not cc_ids:
+                continue
+            if c in cc_ids:
+                cc_ids.remove(c)
+            if not cc_ids:
+                del self.dataset_conflict_classes[d]
+
+    def _index_role_permission(self, role_id: str, perm: Permission):
+        role_actions = self.object_roles.setdefault(self.object_ids.intern(perm.object_id), {})
+        role_actions.setdefault(role_id, []).append(perm.action)
+
+    def _unindex_role_permission(self, role_id: str, perm: Permission):
+        o = self.object_ids.get(perm.object_id)
+        role_actions = self.object_roles.get(o)
+        if not role_actions or perm.action not in role_actions.get(role_id, ()):
+            return
+        role_actions[role_id].remove(perm.action)
+        if not role_actions[role_id]:
+            del role_actions[role_id]
+            if not role_actions:
+                del self.object_roles[o]
+
+    def _index_dataset_object(self, dataset_id: str, obj_id: str):
+        o = self.object_ids.intern(obj_id)
+        d = self.dataset_ids.intern(dataset_id) if dataset_id else NO_DATASET
+        self.object_datasets[o] = d
+        if d != NO_DATASET:
+            self.dataset_objects.setdefault(d, set()).add(o)
+
+    def _unindex_dataset_object(self, dataset_id: str, obj_id: str):
+        self.object_datasets.pop(self.object_ids.get(obj_id), None)
+        d = self.dataset_ids.get(dataset_id)
+        members = self.dataset_objects.get(d)
+        if members is None:
+            return
+        members.discard(self.object_ids.get(obj_id))
+        if not members:
+            del self.dataset_objects[d]
+
+    def _block_conflicting_datasets(self, u: int, accessed_ds_id: str):
+        """Walls the user off from every dataset sharing a conflict class with a newly accessed one."""
+        d = self.dataset_ids.intern(accessed_ds_id)
+        cc_ids = self.dataset_conflict_classes.get(d)
+        if not cc_ids:
+            return
+        blocked = self.user_blocked_datasets.setdefault(u, {})
+        for c in cc_ids:
+            cc = self.conflict_classes.get(self.conflict_class_ids.name(c))
+            if not cc:
+                continue
+            for ds_id in cc.datasets:
+                if ds_id != accessed_ds_id:
+                    blocked.setdefault(self.dataset_ids.intern(ds_id), d) # Keep the earliest blocking access
+
+    def _rebuild_blocked_datasets(self):
+        """Recomputes every user's blocked datasets, e.g. after conflict classes change."""
+        self.user_blocked_datasets = {}
+        for user_id, history in self.user_access_history.items():
+            u = self.user_ids.intern(user_id)
+            for accessed_ds_id in history:
+                self._block_conflicting_datasets(u, accessed_ds_id)
+
+    def _bump_policy_version(self):
+        self.policy_version += 1
+
+    def _bump_user_version(self, user_id: str):
+        self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+
+    def _publish(self, changes: List[List[Any]]):
+        seq = self.change_log.append(changes)
+        with self._sync_lock:
+            if self.change_seq == seq - 1: # Nothing from other engines in between, so the caches reflect seq
+                self.change_seq = seq
+
+    def _publish_accesses(self, user_ids: List[str]):
+        # Called by the access writer once a batch of accesses is in the database
+        if self.change_log:
+            self._publish([[collection, user_id] for user_id in user_ids
+                           for collection in (User._get_collection_name(), 'access_history')])
+
+    def sync(self, min_version: int = None, timeout: float = 5.0) -> int:
+        """
+        Applies the change log entries written by other engines since the last sync and returns the
+        change log version now reflected in the caches. Without min_version the log is read at most
+        once per poll interval (or when a change stream reports new entries). With min_version, e.g. a
+        version returned to a client after one of its writes, waits up to timeout for that version.
+        """
+        if self.change_log is None:
+            return 0
+        if min_version is None:
+            if not self.change_log.should_poll():
+                return self.change_seq
+        elif min_version <= self.change_seq:
+            return self.change_seq
+        deadline = time.monotonic() + timeout
+        with self._sync_lock:
+            while True:
+                self._apply_changes(self.change_log.latest_version())
+                if min_version is None or self.change_seq >= min_version or time.monotonic() >= deadline:
+                    break
+                time.sleep(0.01)
+        return self.change_seq
+
+    def _apply_changes(self, latest: int):
+        while self.change_seq < latest:
+            seq = self.change_seq + 1
+            entry = self.change_log.entry(seq)
+            if entry is None:
+                # The writer has taken the number but not written the entry yet, or died in between
+                if self._gap_since is None:
+                    self._gap_since = time.monotonic()
+                if time.monotonic() - self._gap_since < self.change_log.gap_timeout:
+                    return
+                print(f"Policy change {seq} is still missing after {self.change_log.gap_timeout}s, skipping it.")
+            elif entry['origin'] != self.change_log.origin or seq <= self._startup_seq: # Own changes are already applied
+                for collection, key in entry['changes']:
+                    self._apply_change(collection, key)
+                self._bump_policy_version()
+            self._gap_since = None
+            self.change_seq = seq
+
+    def _apply_change(self, collection: str, key: Any):
+        """Reloads the documents another engine wrote and re-indexes them."""
+        if collection == User._get_collection_name():
+            self._refresh_user(key)
+        elif collection == Role._get_collection_name():
+            self._refresh_role(key)
+        elif collection == Object._get_collection_name():
+            self._refresh_object(key)
+        elif collection == Dataset._get_collection_name():
+            self._refresh_dataset(key)
+        elif collection == ConflictClass._get_collection_name():
+            self._refresh_conflict_class(key)
+        elif collection == CapabilityList._get_collection_name():
+            self._refresh_capabilities(key)
+        elif collection == 'access_history':
+            self._refresh_access_history(key)
+
+    def _refresh_user(self, user_id: str):
+        old = self.users.pop(user_id, None)
+        if old:
+            self._unindex_user_roles(old)
+        if self.lazy_users:
+            self._refresh_lazy_user(user_id, reload=old is not None)
+            return
+        user = User.get_by_id(user_id, User.WITHOUT_PASSWORD)
+        if user:
+            if user_id in self.user_access_history:
+                user.access_history[:] = self.user_access_history[user_id]
+            self.users[user_id] = user
+            self._index_user_roles(user)
+        self._bump_user_version(user_id)
+
+    def _refresh_lazy_user(self, user_id: str, reload: bool):
+        # role_users covers non-resident users too, so it is corrected from the stored roles
+        u = self.user_ids.intern(user_id)
+        for role_id in [role_id for role_id, holders in self.role_users.items() if u in holders]:
+            self.role_users[role_id].discard(u)
+            if not self.role_users[role_id]:
+                del self.role_users[role_id]
+        doc = User.collection().find_one({'_id': user_id}, {'_id': 1, 'roles': 1})
+        for role_id in doc.get('roles', []) if doc else []:
+            self.role_users.setdefault(role_id, set()).add(u)
+        self.users.forget_missing(user_id)
+        self.user_blocked_datasets.pop(u, None)
+        self.user_access_history.pop(user_id, None)
+        if reload:
+            self.users.get(user_id)
+        self._bump_user_version(user_id)
+
+    def _refresh_role(self, role_id: str):
+        holders = sorted(self.user_ids.names(self._resident_holders(role_id)))
+        old = self.roles.get(role_id)
+        if old:
+            for user_id in holders:
+                self._unindex_user_role(user_id, role_id)
+            for perm in old.permissions:
+                self._unindex_role_permission(role_id, perm)
+            del self.roles[role_id]
+        role = Role.get_by_id(role_id)
+        if role:
+            self.roles[role_id] = role
+            for perm in role.permissions:
+                self._index_role_permission(role_id, perm)
+        for user_id in holders:
+            self._index_user_role(user_id, role_id)
+
+    def _refresh_object(self, obj_id: str):
+        old = self.objects.pop(obj_id, None)
+        if old:
+            self._unindex_dataset_object(old.dataset, obj_id)
+        obj = Object.get_by_id(obj_id)
+        if obj:
+            self.objects[obj_id] = obj
+            self._index_dataset_object(obj.dataset, obj_id)
+
+    def _refresh_dataset(self, dataset_id: str):
+        self.datasets.pop(dataset_id, None)
+        ds = Dataset.get_by_id(dataset_id)
+        if ds:
+            self.datasets[dataset_id] = ds
+
+    def _refresh_conflict_class(self, cc_id: str):
+        old = self.conflict_classes.pop(cc_id, None)
+        if old:
+            self._unindex_conflict_class(old)
+        cc = ConflictClass.get_by_id(cc_id)
+        if cc:
+            self.conflict_classes[cc_id] = cc
+            self._index_conflict_class(cc)
+        self._rebuild_blocked_datasets()
+
+    def _refresh_capabilities(self, query: Dict[str, str]):
+        for user_id, obj_id in self.caps.reload(query):
+            o = self.object_ids.intern(obj_id)
+            if self.caps.has_object(user_id, obj_id):
+                self.object_cap_holders.setdefault(o, set()).add(self.user_ids.intern(user_id))
+            elif o in self.object_cap_holders:
+                self.object_cap_holders[o].discard(self.user_ids.get(user_id))
+                if not self.object_cap_holders[o]:
+                    del self.object_cap_holders[o]
+
+    def _refresh_access_history(self, user_id: str):
+        if self.lazy_users and not self.users.resident(user_id):
+            return # Read when the user is loaded
+        doc = BaseModel.get_access_history_collection().find_one({'_id': user_id})
+        u = self.user_ids.intern(user_id)
+        self.user_blocked_datasets.pop(u, None)
+        if not doc:
+            self.user_access_history.pop(user_id, None)
+            return
+        history = AccessHistoryEntry.from_dict(doc).accessed_datasets
+        self.user_access_history[user_id] = history
+        if user_id in self.users:
+            self.users[user_id].access_history[:] = history
+        for accessed_ds_id in history:
+            self._block_conflicting_datasets(u, accessed_ds_id)
+        self._bump_user_version(user_id)
+
+    def decision_cache_stats(self) -> Dict[str, Any]:
+        if self.decision_cache is None:
+            return {'enabled': False}
+        return {'enabled': True, **self.decision_cache.stats()}
+
+    def _conflict_class_for_dataset(self, dataset_id: str) -> str | None:
+        """Returns the id of the first conflict class containing the dataset, if any."""
+        cc_ids = self.dataset_conflict_classes.get(self.dataset_ids.get(dataset_id))
+        return self.conflict_class_ids.name(cc_ids[0]) if cc_ids else None
+
+    def _grant_effective(self, u: int, role_id: str, o: int, a: int):
+        granting_roles = self.effective_permissions.setdefault(u, {}).setdefault(o, {}).setdefault(a, [])
+        if role_id not in granting_roles:
+            granting_roles.append(role_id)
+
+    def _revoke_effective(self, u: int, role_id: str, o: int, a: int):
+        user_objects = self.effective_permissions.get(u)
+        if not user_objects or o not in user_objects:
+            return
+        granting_roles = user_objects[o].get(a)
+        if granting_roles and role_id in granting_roles:
+            granting_roles.remove(role_id)
+            if not granting_roles: # Clean up empty entries
+                del user_objects[o][a]
+                if not user_objects[o]:
+                    del user_objects[o]
+                if not user_objects:
+                    del self.effective_permissions[u]
+
+    def _index_user_role(self, user_id: str, role_id: str):
+        u = self.user_ids.intern(user_id)
+        self.role_users.setdefault(role_id, set()).add(u)
+        role = self.roles.get(role_id)
+        if not role:
+            return # Role ID present in user but role itself not loaded/defined
+        for perm in role.permissions:
+            self._grant_effective(u, role_id, self.object_ids.intern(perm.object_id), self.action_ids.intern(perm.action))
+
+    def _unindex_user_role(self, user_id: str, role_id: str):
+        u = self.user_ids.get(user_id)
+        holders = self.role_users.get(role_id)
+        if holders is not None:
+            holders.discard(u)
+            if not holders:
+                del self.role_users[role_id]
+        role = self.roles.get(role_id)
+        if not role or u not in self.effective_permissions:
+            return
+        for perm in role.permissions:
+            o, a = self.object_ids.get(perm.object_id), self.action_ids.get(perm.action)
+            if o is not None and a is not None:
+                self._revoke_effective(u, role_id, o, a)
+
+    def _index_user_roles(self, user: User):
+        for role_id in user.roles:
+            self._index_user_role(user.id, role_id)
+
+    def _unindex_user_roles(self, user: User):
+        u = self.user_ids.get(user.id)
+        for role_id in user.roles:
+            holders = self.role_users.get(role_id)
+            if holders is not None:
+                holders.discard(u)
+                if not holders:
+                    del self.role_users[role_id]
+        self.effective_permissions.pop(u, None)
     
+    @publishes_changes
     def add_user(self, user_id: str, name: str, password_str: str = "password"):
         if user_id in self.users:
             raise Exception(f"User {user_id} already exists.")
-        hashed_pwd = hash_password_util(password_str)
+        hashed_pwd = self._hash_password(password_str)
         user = User(id=user_id, name=name, password_hash=hashed_pwd)
         user.save()
+        user.password_hash = None # Password hashes stay in the database, see User.WITHOUT_PASSWORD
         self.users[user.id] = user
+        self._bump_user_version(user.id) # Drop cached "user not found" decisions
         return user
     
+    def _hash_password(self, password_str: str) -> str:
+        # Only this thread waits for the worker, without holding the GIL or any engine state, and
+        # imports never queue on this pool
+        if self.password_hasher:
+            return self.password_hasher.hash(password_str)
+        return hash_password_util(password_str)
+
+    def import_users(self, records: Iterable[Any], batch_size: int = DEFAULT_BATCH_SIZE, workers: int = None) -> Dict[str, Any]:
+        """
+        Creates users in bulk from {"id", "name", "password"} records, such as those read by
+        models.user_import from a JSONL or CSV file. Records are checked against the existing
+        users batch_size at a time. Passwords are hashed in a pool of `workers` processes (one per
+        core by default) started for the import, separate from the pool used by add_user, with at
+        most two per worker queued at a time. The users are written batch_size at a time with
+        insert_many. Records that cannot be imported are reported and
+        skipped. Returns the counts, the number (from 1) and error of each failed record, and the
+        throughput.
+        """
+        hasher = PasswordHasher(workers)
+        max_in_flight = 2 * hasher.workers # Enough to keep every worker busy
+        start = time.perf_counter()
+        report = {'imported': 0, 'failed': 0, 'errors': []}
+        seen: Set[str] = set()
+        checking: List[Tuple[int, Dict[str, str]]] = [] # Valid records, waiting for the existence check
+        in_flight = deque() # (number, record, future hash), in record order
+        hashed: List[Tuple[int, User]] = [] # Waiting to be written
+        def collect():
+            number, record, future = in_flight.popleft()
+            try:
+                hashed.append((number, User(id=record['id'], name=record['name'], password_hash=future.result())))
+            except Exception as e:
+                report['errors'].append({'record': number, 'id': record['id'], 'error': f"Could not hash the password: {e}"})
+            if len(hashed) >= batch_size:
+                self._import_user_batch(hashed, report)
+                hashed.clear()
+        def submit():
+            existing = self._existing_user_ids([record['id'] for _, record in checking])
+            for number, record in checking:
+                if record['id'] in existing:
+                    report['errors'].append({'record': number, 'id': record['id'], 'error': f"User {record['id']} already exists."})
+                    continue
+                in_flight.append((number, record, hasher.submit(record['password'])))
+                if len(in_flight) >= max_in_flight:
+                    collect()
+            checking.clear()
+        try:
+            for number, record in enumerate(records, 1):
+                error = self._validate_import_record(record, seen)
+                if error:
+                    report['errors'].append({'record': number, 'id': record.get('id') if isinstance(record, dict) else None,
+                                             'error': error})
+                    continue
+                seen.add(record['id'])
+                checking.append((number, record))
+                if len(checking) >= batch_size:
+                    submit()
+            submit()
+            while in_flight:
+                collect()
+            if hashed:
+                self._import_user_batch(hashed, report)
+        finally:
+            for _, _, future in in_flight: # After a failure part way through
+                future.cancel()
+            hasher.close()
+        seconds = time.perf_counter() - start
+        report['errors'].sort(key=lambda error: error['record']) # Batch failures are found after later validation ones
+        report.update(failed=len(report['errors']), seconds=round(seconds, 3),
+                      users_per_second=round(report['imported'] / seconds, 1) if seconds else 0.0)
+        return report
+
+    def _validate_import_record(self, record: Any, seen: Set[str]) -> str | None:
+        if isinstance(record, Exception): # A line the reader could not parse
+            return str(record)
+        if not isinstance(record, dict):
+            return "Expected an object with id, name and password"
+        missing = [field for field in ('id', 'name', 'password') if not record.get(field)]
+        if missing:
+            return f"Missing required fields ({', '.join(missing)})"
+        if not all(isinstance(record[field], str) for field in ('id', 'name', 'password')):
+            return "Fields id, name and password must be strings"
+        if record['id'] in seen:
+            return f"User {record['id']} appears more than once in the import."
+        return None
+
+    def _existing_user_ids(self, user_ids: List[str]) -> Set[str]:
+        if not self.lazy_users:
+            return {user_id for user_id in user_ids if user_id in self.users}
+        # One query for the batch, leaving the user cache alone
+        return {doc['_id'] for doc in User.collection().find({'_id': {'$in': user_ids}}, {'_id': 1})} if user_ids else set()
+
+    @publishes_changes
+    def _import_user_batch(self, numbered_users: List[Tuple[int, User]], report: Dict[str, Any]):
+        # Published per batch, so the change log entries of a large import stay small
+        errors = BaseModel.storage().insert_many(User._get_collection_name(), [user.to_dict() for _, user in numbered_users])
+        for i, (number, user) in enumerate(numbered_users):
+            if i in errors: # E.g. created meanwhile by another process
+                report['errors'].append({'record': number, 'id': user.id, 'error': errors[i]})
+                continue
+            user.mark_saved()
+            user.password_hash = None # Password hashes stay in the database, see User.WITHOUT_PASSWORD
+            if self.lazy_users:
+                self.users.forget_missing(user.id) # Loaded on first use, rather than evicting the hot users
+            else:
+                self.users[user.id] = user
+            self._bump_user_version(user.id)
+            record_change(User._get_collection_name(), user.id)
+            report['imported'] += 1
+
+    @publishes_changes
     def add_role(self, role_id: str, name: str):
         if role_id in self.roles:
             raise Exception(f"Role {role_id} already exists.")
         role = Role(id=role_id, name=name)
         role.save()
         self.roles[role.id] = role
+        self._bump_policy_version()
         return role
     
+    @publishes_changes
     def update_role(self, role_id: str, name: str = None):
         role = self.roles.get(role_id)
         if not role:
@@ -90,47 +762,52 @@ class PolicyEngine:
         if updated:
             role.save()
             self.roles[role.id] = role # Update cache
+            self._bump_policy_version()
         return role
 
+    @publishes_changes
     def delete_role(self, role_id: str):
         role = self.roles.get(role_id)
         if not role:
             return False
 
         # Prevent deletion if the role is assigned to any user
-        for user in self.users.values():
-            if role_id in user.roles:
-                raise Exception(f"Role {role_id} ({role.name}) cannot be deleted because it is assigned to user {user.id} ({user.name}). Unassign the role first.")
+        holders = self.role_users.get(role_id)
+        if holders:
+            user = self.users[min(self.user_ids.names(holders))]
+            raise Exception(f"Role {role_id} ({role.name}) cannot be deleted because it is assigned to user {user.id} ({user.name}). Unassign the role first.")
 
         # If a role is deleted, its permissions become meaningless with it, so they are effectively gone.
         # The Role model itself stores its permissions. Deleting the role document deletes them.
 
         role.delete()
         del self.roles[role_id]
+        self.role_users.pop(role_id, None)
+        for perm in role.permissions:
+            self._unindex_role_permission(role_id, perm)
+        self._bump_policy_version()
         return True
     
+    @publishes_changes
     def add_object(self, obj_id: str, name: str, dataset_id: str):
         if obj_id in self.objects:
             raise Exception(f"Object {obj_id} already exists.")
         if dataset_id not in self.datasets:
             raise Exception(f"Dataset {dataset_id} does not exist. Please add it first.")
         
-        all_conflict_classes = self.conflict_classes.values()
-        conflict_class_id = None
-        for cc in all_conflict_classes:
-            if dataset_id in cc.datasets:
-                conflict_class_id = cc.id
-                break
+        conflict_class_id = self._conflict_class_for_dataset(dataset_id)
         obj = Object(id=obj_id, name=name, dataset=dataset_id, conflict_class=conflict_class_id)
         obj.save()
         self.objects[obj.id] = obj
+        self._index_dataset_object(dataset_id, obj.id)
         
         dataset = self.datasets[dataset_id]
-        if obj.id not in dataset.objects:
-            dataset.objects.append(obj.id)
+        if dataset.append_to('objects', obj.id):
             dataset.save()
+        self._bump_policy_version()
         return obj
     
+    @publishes_changes
     def update_object(self, obj_id: str, name: str = None, dataset_id: str = None):
         obj = self.objects.get(obj_id)
         if not obj:
@@ -148,11 +825,7 @@ class PolicyEngine:
                 raise Exception(f"New dataset {dataset_id} does not exist.")
             obj.dataset = dataset_id
             # Re-evaluate conflict_class based on the new dataset
-            new_conflict_class_id = None
-            for cc in self.conflict_classes.values():
-                if dataset_id in cc.datasets:
-                    new_conflict_class_id = cc.id
-                    break
+            new_conflict_class_id = self._conflict_class_for_dataset(dataset_id)
             if obj.conflict_class != new_conflict_class_id:
                 obj.conflict_class = new_conflict_class_id
             updated = True
@@ -160,20 +833,22 @@ class PolicyEngine:
         if updated:
             obj.save()
             self.objects[obj.id] = obj # Update cache
+            self._bump_policy_version()
 
             if dataset_id is not None and original_dataset_id != dataset_id:
+                self._unindex_dataset_object(original_dataset_id, obj_id)
+                self._index_dataset_object(dataset_id, obj_id)
                 if original_dataset_id and original_dataset_id in self.datasets:
                     old_dataset = self.datasets[original_dataset_id]
-                    if obj_id in old_dataset.objects:
-                        old_dataset.objects.remove(obj_id)
+                    if old_dataset.remove_from('objects', obj_id):
                         old_dataset.save()
                 
                 new_dataset = self.datasets[dataset_id]
-                if obj_id not in new_dataset.objects:
-                    new_dataset.objects.append(obj_id)
+                if new_dataset.append_to('objects', obj_id):
                     new_dataset.save()
         return obj
 
+    @publishes_changes
     def delete_object(self, obj_id: str):
         obj = self.objects.get(obj_id)
         if not obj:
@@ -181,37 +856,51 @@ class PolicyEngine:
 
         # 1. Remove from its dataset's list of objects
         dataset_id = obj.dataset
+        self._unindex_dataset_object(dataset_id, obj_id)
         if dataset_id and dataset_id in self.datasets:
             dataset = self.datasets[dataset_id]
-            if obj_id in dataset.objects:
-                dataset.objects.remove(obj_id)
+            if dataset.remove_from('objects', obj_id):
                 dataset.save()
 
-        # 2. Remove from any role permissions
-        for role in self.roles.values():
-            original_len = len(role.permissions)
-            role.permissions = [p for p in role.permissions if p.object_id != obj_id]
-            if len(role.permissions) != original_len:
-                role.save()
-
-        # 3. Remove from capabilities list
-        if self.caps:
-            self.caps.remove_all_permissions_for_object(obj_id)
+        o = self.object_ids.get(obj_id)
+
+        # 2. Remove from the permissions of the roles referencing it
+        for role_id, actions in self.object_roles.pop(o, {}).items():
+            role = self.roles.get(role_id)
+            if not role:
+                continue
+            for action in actions: # Only the role's permissions on this object, indexed when granted
+                role.remove_permission(Permission(object_id=obj_id, action=action))
+            role.save()
+            for u in self.role_users.get(role_id, ()):
+                user_objects = self.effective_permissions.get(u)
+                if user_objects and user_objects.pop(o, None) is not None and not user_objects:
+                    del self.effective_permissions[u]
+
+        # 3. Remove from the capabilities of the users holding it directly
+        cap_holders = self.object_cap_holders.pop(o, None)
+        if self.caps and cap_holders:
+            for u in cap_holders:
+                self.caps.remove_object_permissions(self.user_ids.name(u), obj_id)
             self.caps.save()
 
         # 4. Delete the object itself
         obj.delete()
         del self.objects[obj_id] # Remove from cache
+        self._bump_policy_version()
         return True
 
+    @publishes_changes
     def add_dataset(self, dataset_id: str, name: str, description: str = None):
         if dataset_id in self.datasets:
             raise Exception(f"Dataset {dataset_id} already exists.")
         dataset = Dataset(id=dataset_id, name=name, description=description)
         dataset.save()
         self.datasets[dataset.id] = dataset
+        self._bump_policy_version()
         return dataset
     
+    @publishes_changes
     def update_dataset(self, dataset_id: str, name: str = None, description: str = None):
         ds = self.datasets.get(dataset_id)
         if not ds:
@@ -230,21 +919,25 @@ class PolicyEngine:
         if updated:
             ds.save()
             self.datasets[ds.id] = ds # Update cache
+            self._bump_policy_version() # Dataset names appear in Chinese Wall reasons
         return ds
 
+    @publishes_changes
     def delete_dataset(self, dataset_id: str):
         ds = self.datasets.get(dataset_id)
         if not ds:
             return False
 
-        if any(obj.dataset == dataset_id for obj in self.objects.values()):
+        if self.dataset_objects.get(self.dataset_ids.get(dataset_id)):
             raise Exception(f"Dataset {dataset_id} cannot be deleted because it contains objects. Remove objects first.")
 
         
         ds.delete()
         del self.datasets[dataset_id]
+        self._bump_policy_version()
         return True
     
+    @publishes_changes
     def add_conflict_class(self, cc_id: str, name: str, dataset_ids: List[str]):
         if cc_id in self.conflict_classes:
             raise Exception(f"Conflict Class {cc_id} already exists.")
@@ -254,8 +947,12 @@ class PolicyEngine:
         cc = ConflictClass(class_id=cc_id, name=name, datasets=dataset_ids)
         cc.save()
         self.conflict_classes[cc.id] = cc
+        self._index_conflict_class(cc)
+        self._rebuild_blocked_datasets()
+        self._bump_policy_version()
         return cc
     
+    @publishes_changes
     def update_conflict_class(self, cc_id: str, name: str = None, dataset_ids: List[str] = None):
         cc = self.conflict_classes.get(cc_id)
         if not cc:
@@ -272,14 +969,19 @@ class PolicyEngine:
                 if ds_id not in self.datasets:
                     raise Exception(f"Dataset {ds_id} for conflict class update does not exist.")
             if set(cc.datasets) != set(dataset_ids): # Check if there's an actual change
+                self._unindex_conflict_class(cc)
                 cc.datasets = dataset_ids
+                self._index_conflict_class(cc)
                 updated = True
 
         if updated:
             cc.save()
             self.conflict_classes[cc.id] = cc
+            self._rebuild_blocked_datasets()
+            self._bump_policy_version()
         return cc
 
+    @publishes_changes
     def delete_conflict_class(self, cc_id: str):
         cc = self.conflict_classes.get(cc_id)
         if not cc:
@@ -291,8 +993,12 @@ class PolicyEngine:
 
         cc.delete()
         del self.conflict_classes[cc_id]
+        self._unindex_conflict_class(cc)
+        self._rebuild_blocked_datasets()
+        self._bump_policy_version()
         return True
     
+    @publishes_changes
     def assign_role_to_user(self, user_id: str, role_id: str):
         user = self.users.get(user_id)
         role = self.roles.get(role_id)
@@ -301,21 +1007,23 @@ class PolicyEngine:
         if not role:
             raise ValueError(f"Role {role_id} not found.")
 
-        if role_id not in user.roles:
-            user.roles.append(role_id)
+        if self._assign_role(user, role_id):
             user.save()
         return user
     
+    @publishes_changes
     def grant_direct_permission(self, user_id: str, object_id: str, action: str):
         if user_id not in self.users:
              raise ValueError(f"User {user_id} not found.")
         if object_id not in self.objects:
             raise ValueError(f"Object {object_id} not found.")
             
-        self.caps.add_permission(user_id, object_id, action)
+        self._grant_capability(user_id, object_id, action)
         self.caps.save()
+        self._bump_policy_version()
         return True
     
+    @publishes_changes
     def record_access(self, user_id: str, object_id: str):
         user = self.users.get(user_id)
         obj = self.objects.get(object_id)
@@ -332,24 +1040,33 @@ class PolicyEngine:
         needs_db_update = False
         if dataset_id not in self.user_access_history[user_id]:
             self.user_access_history[user_id].append(dataset_id)
+            self._block_conflicting_datasets(self.user_ids.intern(user_id), dataset_id)
             needs_db_update = True
 
-        if dataset_id not in user.access_history:
-            user.access_history.append(dataset_id)
-            user.save() 
+        if user.append_to('access_history', dataset_id):
+            if not self.access_writer:
+                user.save() 
            
             needs_db_update = True # Marked for saving the standalone history doc too
         
         if needs_db_update:
-            # Save/update the specific access history document for this user
-            history_doc_data = AccessHistoryEntry(user_id=user_id, accessed_datasets=self.user_access_history[user_id]).to_dict()
-            BaseModel.get_access_history_collection().update_one(
-                {'_id': user_id},
-                {'$set': history_doc_data},
-                upsert=True
-            )
+            self._bump_user_version(user_id)
+            if self.access_writer:
+                # Journaled now, written to both collections by the background writer, so a later
+                # user.save() must not write it again
+                user.mark_field_persisted('access_history')
+                self.access_writer.record(user_id, dataset_id)
+            else:
+                # Add the dataset to the specific access history document for this user
+                BaseModel.get_access_history_collection().update_one(
+                    {'_id': user_id},
+                    {'$set': {'user_id': user_id}, '$addToSet': {'accessed_datasets': dataset_id}},
+                    upsert=True
+                )
+                record_change('access_history', user_id)
         return True
     
+    @publishes_changes
     def add_permission_to_role(self, role_id: str, object_id: str, action: str):
         role = self.roles.get(role_id)
         if not role:
@@ -357,44 +1074,41 @@ class PolicyEngine:
         if object_id not in self.objects:
             raise ValueError(f"Object {object_id} not found.")
             
-        # Avoid duplicate permissions
-        for p in role.permissions:
-            if p.object_id == object_id and p.action == action:
-                return True # Permission already exists
-        
-        permission = Permission(object_id=object_id, action=action)
-        role.permissions.append(permission)
+        if not self._add_role_permission(role, object_id, action):
+            return True # Permission already exists
         role.save()
+        self._bump_policy_version()
         return True
         
+    @publishes_changes
     def revoke_permission_from_role(self, role_id: str, object_id: str, action: str):
         role = self.roles.get(role_id)
         if not role:
             raise ValueError(f"Role {role_id} not found.")
 
-        original_length = len(role.permissions)
-        role.permissions = [p for p in role.permissions 
-                           if not (p.object_id == object_id and p.action == action)]
-        
-        if len(role.permissions) < original_length:
+        if self._remove_role_permission(role, object_id, action):
             role.save()
+            self._bump_policy_version()
             return True
         return False
     
+    @publishes_changes
     def revoke_direct_permission(self, user_id: str, object_id: str, action: str):
         if user_id not in self.users:
              raise ValueError(f"User {user_id} not found.")
         if object_id not in self.objects:
             raise ValueError(f"Object {object_id} not found.")
 
-        self.caps.remove_permission(user_id, object_id, action)
+        self._revoke_capability(user_id, object_id, action)
         self.caps.save()
+        self._bump_policy_version()
         
         rbac_allowed, _ = self._check_rbac(user_id, object_id, action)
         if rbac_allowed:
             print(f"WARNING: Direct permission '{action}' on object '{self.objects[object_id].name}' removed for user '{self.users[user_id].name}', but permission remains via RBAC.")
         return True
     
+    @publishes_changes
     def revoke_role_from_user(self, user_id: str, role_id: str):
         user = self.users.get(user_id)
         if not user:
@@ -402,96 +1116,269 @@ class PolicyEngine:
         if role_id not in self.roles:
             raise ValueError(f"Role {role_id} not found or not loaded.")
         
-        if role_id in user.roles:
-            user.roles.remove(role_id)
+        if self._unassign_role(user, role_id):
             user.save()
             return True
         return False # Role was not assigned to user
-    
-    def _check_chinese_wall(self, user_id: str, object_id: str) -> Tuple[bool, str]:
-        obj = self.objects.get(object_id)
-        if not obj:
-            raise ValueError(f"Object {object_id} not found for Chinese Wall check.")
-        
-        dataset_id = obj.dataset
 
-        if not any(dataset_id in cc.datasets for cc in self.conflict_classes.values()):
-            return True, "Dataset not in any conflict class."
-        
-        target_conflict_class: ConflictClass = None
-        for cc_instance in self.conflict_classes.values():
-            if dataset_id in cc_instance.datasets:
-                target_conflict_class = cc_instance
-                break
-        
-        if not target_conflict_class:
-            return True, "Dataset not associated with a known conflict class."
-
-        # Use the consistent user_access_history cache
-        user_accessed_datasets = self.user_access_history.get(user_id, [])
-        for accessed_ds_id in user_accessed_datasets:
-            if accessed_ds_id != dataset_id and accessed_ds_id in target_conflict_class.datasets:
-                return False, f"Chinese Wall conflict: User has accessed '{self.datasets.get(accessed_ds_id, Dataset(id=accessed_ds_id, name='Unknown')).name}' which conflicts with dataset of current object."
-        
-        return True, "Access allowed by Chinese Wall policy."
+    @publishes_changes
+    def apply_batch(self, ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Applies many of the mutations in BATCH_OPERATIONS, given as {"op": name, **arguments}, in order.
+        Every op is validated first and none is applied if any is invalid; otherwise the caches are
+        updated and the changed users, roles and capabilities are written with one bulk write per
+        collection. Returns whether the batch was applied and a result per op: its error, or
+        whether it changed anything.
+        """
+        results = [{'op': op.get('op') if isinstance(op, dict) else None} for op in ops]
+        errors = [self._validate_batch_op(op) for op in ops]
+        if any(errors):
+            for result, error in zip(results, errors):
+                result['error'] = error
+            return {'applied': False, 'results': results}
+
+        # Held here, rather than looked up for each op, so the lazy user cache cannot evict a
+        # changed user before it is written
+        users: Dict[str, User] = {}
+        roles: Dict[str, Role] = {}
+        caps_touched = False
+        for op, result in zip(ops, results):
+            name = op['op']
+            if name in ('add_permission_to_role', 'revoke_permission_from_role'):
+                role = roles.setdefault(op['role_id'], self.roles[op['role_id']])
+                apply = self._add_role_permission if name == 'add_permission_to_role' else self._remove_role_permission
+                changed = apply(role, op['object_id'], op['action'])
+            elif name in ('grant_direct_permission', 'revoke_direct_permission'):
+                apply = self._grant_capability if name == 'grant_direct_permission' else self._revoke_capability
+                changed = apply(op['user_id'], op['object_id'], op['action'])
+                caps_touched = True
+            else:
+                if op['user_id'] not in users:
+                    users[op['user_id']] = self.users[op['user_id']]
+                user = users[op['user_id']]
+                apply = self._assign_role if name == 'assign_role_to_user' else self._unassign_role
+                changed = apply(user, op['role_id'])
+            result['changed'] = changed
+
+        self._save_batched(list(users.values()) + list(roles.values()) + ([self.caps] if caps_touched else []))
+        if any(result['changed'] for result in results):
+            self._bump_policy_version()
+        if self.lazy_users:
+            for user in users.values():
+                if not self.users.resident(user.id): # Evicted during the batch; drop what it re-derived
+                    self._evict_user(user)
+        return {'applied': True, 'results': results}
+
+    def _validate_batch_op(self, op: Any) -> str | None:
+        if not isinstance(op, dict) or op.get('op') not in BATCH_OPERATIONS:
+            return f"Unknown operation; expected one of {', '.join(BATCH_OPERATIONS)}"
+        missing = [arg for arg in BATCH_OPERATIONS[op['op']] if not op.get(arg)]
+        if missing:
+            return f"Missing required parameters ({', '.join(missing)})"
+        if 'user_id' in op and op['user_id'] not in self.users:
+            return f"User {op['user_id']} not found."
+        if 'role_id' in op and op['role_id'] not in self.roles:
+            return f"Role {op['role_id']} not found."
+        if 'object_id' in op and op['op'] != 'revoke_permission_from_role' and op['object_id'] not in self.objects:
+            return f"Object {op['object_id']} not found."
+        return None
+
+    def _save_batched(self, models: List[BaseModel]):
+        # One bulk_write per collection, in place of a save() per model
+        writes: Dict[str, List[Any]] = {}
+        for model in models:
+            writes.setdefault(model._get_collection_name(), []).extend(model.pending_writes())
+        for collection_name, operations in writes.items():
+            if operations:
+                BaseModel.storage().bulk_write(collection_name, operations)
+        for model in models:
+            model.mark_saved()
+        for collection_name, operations in writes.items():
+            for _, args, _ in operations:
+                record_change(collection_name, args[0].get('_id', args[0])) # The filter names the documents written
+
+    # In-memory halves of the role, permission and capability mutations, shared by the single
+    # mutations above and apply_batch(); each updates the caches and indexes, leaving the writes
+    # to the caller, and returns whether anything changed
+    def _add_role_permission(self, role: Role, object_id: str, action: str) -> bool:
+        permission = Permission(object_id=object_id, action=action)
+        if not role.add_permission(permission):
+            return False
+        self._index_role_permission(role.id, permission)
+        o, a = self.object_ids.intern(object_id), self.action_ids.intern(action)
+        for u in self._resident_holders(role.id):
+            self._grant_effective(u, role.id, o, a)
+        return True
+
+    def _remove_role_permission(self, role: Role, object_id: str, action: str) -> bool:
+        permission = Permission(object_id=object_id, action=action)
+        if not role.remove_permission(permission):
+            return False
+        self._unindex_role_permission(role.id, permission)
+        o, a = self.object_ids.get(object_id), self.action_ids.get(action)
+        if o is not None and a is not None:
+            for u in self.role_users.get(role.id, ()):
+                self._revoke_effective(u, role.id, o, a)
+        return True
+
+    def _grant_capability(self, user_id: str, object_id: str, action: str) -> bool:
+        changed = not self.caps.check_permission(user_id, object_id, action)
+        self.caps.add_permission(user_id, object_id, action)
+        self.object_cap_holders.setdefault(self.object_ids.intern(object_id), set()).add(self.user_ids.intern(user_id))
+        return changed
+
+    def _revoke_capability(self, user_id: str, object_id: str, action: str) -> bool:
+        changed = self.caps.check_permission(user_id, object_id, action)
+        self.caps.remove_permission(user_id, object_id, action)
+        if not self.caps.has_object(user_id, object_id):
+            o = self.object_ids.get(object_id)
+            cap_holders = self.object_cap_holders.get(o)
+            if cap_holders is not None:
+                cap_holders.discard(self.user_ids.get(user_id))
+                if not cap_holders:
+                    del self.object_cap_holders[o]
+        return changed
+
+    def _assign_role(self, user: User, role_id: str) -> bool:
+        if not user.append_to('roles', role_id):
+            return False
+        self._index_user_role(user.id, role_id)
+        self._bump_user_version(user.id)
+        return True
+
+    def _unassign_role(self, user: User, role_id: str) -> bool:
+        if not user.remove_from('roles', role_id): # Every copy, should it have been assigned twice
+            return False
+        self._unindex_user_role(user.id, role_id)
+        self._bump_user_version(user.id)
+        return True
     
+    def _object_label(self, object_id: str) -> str:
+        return self.objects.get(object_id).name if object_id in self.objects else object_id
+
+    def _chinese_wall_reason(self, accessed_ds_id: str) -> str:
+        return f"Chinese Wall conflict: User has accessed '{self.datasets.get(accessed_ds_id, Dataset(id=accessed_ds_id, name='Unknown')).name}' which conflicts with dataset of current object."
+
+    def _rbac_reason(self, object_id: str, action: str, role_id: str) -> str:
+        role = self.roles.get(role_id)
+        return f"Permission '{action}' on object '{self._object_label(object_id)}' granted via role '{role.name if role else role_id}'."
+
+    def _caps_reason(self, object_id: str, action: str) -> str:
+        return f"Permission '{action}' on object '{self._object_label(object_id)}' granted by direct capability."
+
     def _check_rbac(self, user_id: str, object_id: str, action: str) -> Tuple[bool, str]:
         user = self.users.get(user_id)
         if not user:
             return False, f"User {user_id} not found for RBAC check."
 
-        for role_id in user.roles:
-            role = self.roles.get(role_id)
-            if not role:
-                continue # Role ID present in user but role itself not loaded/defined
-            
-            for perm in role.permissions:
-                if perm.object_id == object_id and perm.action == action:
-                    return True, f"Permission '{action}' on object '{self.objects.get(object_id).name if object_id in self.objects else object_id}' granted via role '{role.name}'."
+        granting_roles = self.effective_permissions.get(self.user_ids.get(user_id), {}) \
+            .get(self.object_ids.get(object_id), {}).get(self.action_ids.get(action))
+        if granting_roles:
+            return True, self._rbac_reason(object_id, action, granting_roles[0])
         
         return False, "Permission denied by RBAC policy."
     
-    def _check_caps(self, user_id: str, object_id: str, action: str) -> Tuple[bool, str]:
-        if self.caps.check_permission(user_id, object_id, action):
-            return True, f"Permission '{action}' on object '{self.objects.get(object_id).name if object_id in self.objects else object_id}' granted by direct capability."
-        return False, "Permission denied by direct capabilities."
-    
-    def check_access(self, user_id: str, object_id: str, action: str) -> Tuple[bool, str]:
-        try:
-            cw_allowed, cw_reason = self._check_chinese_wall(user_id, object_id)
-            if not cw_allowed:
-                return False, cw_reason
-        except ValueError as e: # Catch specific errors like object not found
-            return False, str(e)
-        except Exception as e: # Catch other unexpected errors
-            print(f"Error during Chinese Wall check: {e}")
-            return False, "Error during Chinese Wall policy check."
-
-        try:
-            rbac_allowed, rbac_reason = self._check_rbac(user_id, object_id, action)
-            if rbac_allowed:
-                return True, rbac_reason
-        except Exception as e:
-            print(f"Error during RBAC check: {e}")
-            return False, "Error during RBAC policy check."
-        
+    def render_reason(self, decision: Decision) -> str:
+        """Builds the human-readable reason for a decision from its code and ids."""
+        code, object_id, action = decision.code, decision.object_id, decision.action
+        if code is DecisionCode.GRANTED_BY_ROLE:
+            reason = self._rbac_reason(object_id, action, decision.detail)
+        elif code is DecisionCode.GRANTED_BY_CAPABILITY:
+            reason = self._caps_reason(object_id, action)
+        elif code is DecisionCode.CHINESE_WALL_CONFLICT:
+            reason = self._chinese_wall_reason(decision.detail)
+        elif code is DecisionCode.OBJECT_NOT_FOUND:
+            reason = f"Object {object_id} not found for Chinese Wall check."
+        elif code is DecisionCode.NO_PERMISSION:
+            reason = "Access denied: No applicable permissions found."
+        else:
+            reason = "Error during access policy check."
+        if decision.grant:
+            if not decision.allowed:
+                return f"Cannot grant access: {reason}"
+            return f"Access granted for '{action}' on object '{self._object_label(object_id)}'. {reason}"
+        return reason
+
+    def check_access(self, user_id: str, object_id: str, action: str) -> Decision:
+        """
+        Returns a Decision; it unpacks as (allowed, reason) and only renders the reason when read.
+        """
+        if self.decision_cache is None:
+            return self._evaluate_access(user_id, object_id, action)
+
+        key = (user_id, object_id, action)
+        # Read the versions before evaluating so a concurrent mutation leaves the entry stale
+        versions = (self.policy_version, self.user_versions.get(user_id, 0))
+        decision = self.decision_cache.get(key, versions)
+        if decision is None:
+            decision = self._evaluate_access(user_id, object_id, action)
+            self.decision_cache.put(key, versions, decision)
+        return decision
+
+    def _evaluate_access(self, user_id: str, object_id: str, action: str) -> Decision:
+        if self.lazy_users:
+            self.users.get(user_id) # Loads the user's indexes if needed
+        u = self.user_ids.get(user_id)
         try:
-            caps_allowed, caps_reason = self._check_caps(user_id, object_id, action)
-            if caps_allowed:
-                return True, caps_reason
-        except Exception as e:
-            print(f"Error during Capabilities check: {e}")
-            return False, "Error during direct capabilities policy check."
-            
-        return False, "Access denied: No applicable permissions found."
+            return self._decide(user_id, object_id, action, self.object_ids.get(object_id), self.action_ids.get(action),
+                                self.user_blocked_datasets.get(u, {}),
+                                self.effective_permissions.get(u, {}),
+                                self.caps.matrix.get(user_id, {}))
+        except Exception as e: # Catch unexpected errors
+            print(f"Error during access check: {e}")
+            return Decision(False, DecisionCode.ERROR, user_id, object_id, action, str(e), self)
+
+    def _decide(self, user_id: str, object_id: str, action: str, o: int | None, a: int | None,
+                blocked: Dict[int, int], rbac: Dict[int, Dict[int, List[str]]], caps: Dict[str, Any]) -> Decision:
+        """
+        Chinese Wall, then RBAC, then direct capabilities, against one user's precomputed state. o and
+        a are the ids of object_id and action (None if never seen); the checks use only ids, the
+        strings are kept for the reason.
+        """
+        d = self.object_datasets.get(o)
+        if d is None:
+            return Decision(False, DecisionCode.OBJECT_NOT_FOUND, user_id, object_id, action, None, self)
+        blocking_ds = blocked.get(d)
+        if blocking_ds is not None:
+            return Decision(False, DecisionCode.CHINESE_WALL_CONFLICT, user_id, object_id, action,
+                            self.dataset_ids.name(blocking_ds), self)
+        granting_roles = rbac.get(o, {}).get(a)
+        if granting_roles:
+            return Decision(True, DecisionCode.GRANTED_BY_ROLE, user_id, object_id, action, granting_roles[0], self)
+        if action in caps.get(object_id, ()):
+            return Decision(True, DecisionCode.GRANTED_BY_CAPABILITY, user_id, object_id, action, None, self)
+        return Decision(False, DecisionCode.NO_PERMISSION, user_id, object_id, action, None, self)
     
-    def grant_access(self, user_id: str, object_id: str, action: str) -> Tuple[bool, str]:
-        allowed, reason = self.check_access(user_id, object_id, action)
-        if not allowed:
-            return False, f"Cannot grant access: {reason}"
-        
-        self.record_access(user_id, object_id) # Records access if allowed
-        return True, f"Access granted for '{action}' on object '{self.objects.get(object_id).name if object_id in self.objects else object_id}'. {reason}"
+    def check_access_many(self, checks: List[Tuple[str, str, str]], with_reasons: bool = True) -> List[Any]:
+        """
+        Checks a batch of (user_id, object_id, action) triples and returns the Decisions in order.
+        Per-user state (Chinese Wall blocks, flattened roles, direct capabilities) is looked up once
+        per user. With with_reasons=False only the booleans are returned.
+        """
+        results: List[Any] = [None] * len(checks)
+        checks_by_user: Dict[str, List[int]] = {}
+        for i, (user_id, _, _) in enumerate(checks):
+            checks_by_user.setdefault(user_id, []).append(i)
+
+        for user_id, indexes in checks_by_user.items():
+            if self.lazy_users:
+                self.users.get(user_id)
+            u = self.user_ids.get(user_id)
+            blocked = self.user_blocked_datasets.get(u, {})
+            rbac = self.effective_permissions.get(u, {})
+            caps = self.caps.matrix.get(user_id, {}) if self.caps else {}
+            for i in indexes:
+                _, object_id, action = checks[i]
+                decision = self._decide(user_id, object_id, action, self.object_ids.get(object_id),
+                                        self.action_ids.get(action), blocked, rbac, caps)
+                results[i] = decision if with_reasons else decision.allowed
+        return results
+
+    def grant_access(self, user_id: str, object_id: str, action: str) -> Decision:
+        decision = self.check_access(user_id, object_id, action)
+        if decision.allowed:
+            self.record_access(user_id, object_id) # Records access if allowed
+        return decision.as_grant()
         
     def user_check_permissions(self, user_id: str) -> Dict[str, Dict[str, Any]]:
         user = self.users.get(user_id)
@@ -501,15 +1388,12 @@ class PolicyEngine:
         user_perms_summary: Dict[str, Dict[str, Any]] = {}
 
         # Permissions from roles
-        for role_id in user.roles:
-            role = self.roles.get(role_id)
-            if not role: continue
-            for perm in role.permissions:
-                obj = self.objects.get(perm.object_id)
-                if not obj: continue
-                if obj.id not in user_perms_summary:
-                    user_perms_summary[obj.id] = {"name": obj.name, "permissions": set()}
-                user_perms_summary[obj.id]["permissions"].add(perm.action)
+        for o, actions in self.effective_permissions.get(self.user_ids.get(user_id), {}).items():
+            obj = self.objects.get(self.object_ids.name(o))
+            if not obj: continue
+            if obj.id not in user_perms_summary:
+                user_perms_summary[obj.id] = {"name": obj.name, "permissions": set()}
+            user_perms_summary[obj.id]["permissions"].update(self.action_ids.names(actions))
         
         # Direct permissions from capabilities
         if self.caps and user_id in self.caps.matrix: # Added self.caps check
@@ -528,15 +1412,59 @@ class PolicyEngine:
         return user_perms_summary
 
     def get_users(self):
-        return [user.to_dict() for user in self.users.values()] 
+        return list(self.iter_users())
     def get_roles(self):
-        return [role.to_dict() for role in self.roles.values()]
+        return list(self.iter_roles())
     def get_objects(self):
-        return [obj.to_dict() for obj in self.objects.values()]
+        return list(self.iter_objects())
     def get_datasets(self):
-        return [ds.to_dict() for ds in self.datasets.values()]
+        return list(self.iter_datasets())
     def get_conflict_classes(self):
-        return [cc.to_dict() for cc in self.conflict_classes.values()]
+        return list(self.iter_conflict_classes())
+
+    # Generator versions of the get_* listings above, producing one document at a time for streamed
+    # responses. They iterate over a copy of the cache's entries, so concurrent mutations are safe.
+    def iter_users(self):
+        """Yields every user's document, read from storage in lazy user mode so the cache is left alone."""
+        if not self.lazy_users:
+            yield from (user.to_dict() for user in list(self.users.values()))
+            return
+        for doc in User.collection().find({}, User.WITHOUT_PASSWORD, batch_size=self.load_batch_size):
+            yield (self.users.peek(doc['_id']) or User.from_dict(doc)).to_dict()
+    def iter_roles(self):
+        yield from (role.to_dict() for role in list(self.roles.values()))
+    def iter_objects(self):
+        yield from (obj.to_dict() for obj in list(self.objects.values()))
+    def iter_datasets(self):
+        yield from (ds.to_dict() for ds in list(self.datasets.values()))
+    def iter_conflict_classes(self):
+        yield from (cc.to_dict() for cc in list(self.conflict_classes.values()))
+
+    def get_role_users(self, role_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns the id and name of every user the role is assigned to.
+        """
+        if role_id not in self.roles:
+            raise ValueError("Invalid role ID")
+        user_ids = sorted(self.user_ids.names(self.role_users.get(role_id, ())))
+        if self.lazy_users:
+            # Read names from storage for non-resident users rather than loading them into the cache
+            docs = (self.users.peek(user_id) or User.collection().find_one({'_id': user_id}, {'_id': 1, 'name': 1})
+                    for user_id in user_ids)
+            users = ({'id': doc.id, 'name': doc.name} if isinstance(doc, User) else {'id': doc['_id'], 'name': doc.get('name')}
+                     for doc in docs if doc)
+            return list(users)
+        users = (self.users.get(user_id) for user_id in user_ids)
+        return [{'id': user.id, 'name': user.name} for user in users if user]
+
+    def get_dataset_objects(self, dataset_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns the objects belonging to the dataset.
+        """
+        if dataset_id not in self.datasets:
+            raise ValueError("Invalid dataset ID")
+        object_ids = sorted(self.object_ids.names(self.dataset_objects.get(self.dataset_ids.get(dataset_id), ())))
+        return [self.objects[obj_id].to_dict() for obj_id in object_ids]
         
     def get_conflict_datasets(self, conflict_class_id):
         '''
@@ -568,11 +1496,30 @@ class PolicyEngine:
         user = self.users[user_id]
         return user.access_history
 
+    def get_walled_datasets(self, user_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns the datasets the user is walled off from by the Chinese Wall policy,
+        each with the previously accessed dataset that blocks it.
+        """
+        if user_id not in self.users:
+            raise ValueError("Invalid user ID")
+        walled = []
+        for d, blocking_ds in self.user_blocked_datasets.get(self.user_ids.get(user_id), {}).items():
+            ds_id = self.dataset_ids.name(d)
+            blocking_ds_id = self.dataset_ids.name(blocking_ds)
+            walled.append({
+                "dataset_id": ds_id,
+                "name": self.datasets[ds_id].name if ds_id in self.datasets else ds_id,
+                "blocked_by": blocking_ds_id
+            })
+        return walled
+
     def user_check_conflict_classes(self, user_id):
         """
         Returns a list of conflict classes that the user belongs to.
         """
 
+    @publishes_changes
     def update_user(self, user_id: str, name: str = None, password_str: str = None):
         user = self.users.get(user_id)
         if not user:
@@ -584,14 +1531,16 @@ class PolicyEngine:
             updated = True
         
         if password_str is not None and password_str != "": 
-            user.password_hash = hash_password_util(password_str)
+            user.password_hash = self._hash_password(password_str)
             updated = True
         
         if updated:
             user.save()
+            user.password_hash = None
             self.users[user.id] = user
         return user
 
+    @publishes_changes
     def delete_user(self, user_id: str):
         user = self.users.get(user_id)
         if not user:
@@ -601,17 +1550,32 @@ class PolicyEngine:
             raise Exception("Cannot delete the primary admin user.")
 
         if self.caps and user_id in self.caps.matrix:
-            del self.caps.matrix[user_id]
+            u = self.user_ids.get(user_id)
+            for obj_id in self.caps.matrix[user_id]:
+                o = self.object_ids.get(obj_id)
+                cap_holders = self.object_cap_holders.get(o)
+                if cap_holders is not None:
+                    cap_holders.discard(u)
+                    if not cap_holders:
+                        del self.object_cap_holders[o]
+            self.caps.remove_user(user_id)
             self.caps.save()
 
+        self.user_blocked_datasets.pop(self.user_ids.get(user_id), None)
+        if self.access_writer:
+            self.access_writer.flush() # Queued accesses must not recreate the history document below
         if user_id in self.user_access_history:
             del self.user_access_history[user_id]
             BaseModel.get_access_history_collection().delete_one({'_id': user_id})
+            record_change('access_history', user_id)
 
         user.delete()
         del self.users[user_id] 
+        self._unindex_user_roles(user)
+        self._bump_user_version(user_id)
         return True
 
+    @publishes_changes
     def change_user_password(self, user_id: str, current_password_str: str, new_password_str: str) -> bool:
         user = self.users.get(user_id)
         if not user:
@@ -620,14 +1584,16 @@ class PolicyEngine:
                 User.verify_password_util("dummy_hash_should_not_match", current_password_str)
             return False
 
-        if not user.check_password(current_password_str):
+        stored = User.get_by_id(user_id) # The cached user has no password hash
+        if not stored or not stored.check_password(current_password_str):
             return False
 
         if not new_password_str:
             raise ValueError("New password cannot be empty.")
 
-        user.password_hash = hash_password_util(new_password_str)
+        user.password_hash = self._hash_password(new_password_str)
         user.save()
+        user.password_hash = None
         self.users[user.id] = user
         return True
 
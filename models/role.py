@@ -1,11 +1,28 @@
-from typing import List, Dict, Any
+from operator import itemgetter
+from typing import Iterable, Dict, Any, KeysView, List, Set
 from .base_model import BaseModel
+from .storage import WriteOperation
+from .change_log import record_change
+from .interning import intern_str
 
 # Role and permission Models
-class Permission:
-    def __init__(self, object_id: str, action: str):
-        self.object_id = object_id
-        self.action = action
+# A permission is an immutable, hashable (object_id, action) pair costing a single small tuple.
+# Its strings are interned, so the permissions of every role share one copy of each id. The
+# permissions themselves are not: a table of every pair ever created would never shrink.
+class Permission(tuple):
+    __slots__ = ()
+
+    def __new__(cls, object_id: str, action: str):
+        return super().__new__(cls, (intern_str(object_id), intern_str(action)))
+
+    def __getnewargs__(self):
+        return tuple(self) # Unpickled through __new__, so loaded permissions share their strings too
+
+    object_id = property(itemgetter(0))
+    action = property(itemgetter(1))
+
+    def __repr__(self) -> str:
+        return f"Permission(object_id={self.object_id!r}, action={self.action!r})"
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -22,11 +39,88 @@ class Permission:
             action=data.get('action')
         )
 
+# Role permissions are an insertion-ordered set (a dict with unused values), read through the
+# permissions view: adding, removing and checking one take constant time. So does saving them:
+# instead of diffing the stored list, the role tracks the permissions added and removed since it
+# was loaded or saved and save() sends just those as $push/$pull. The stored document keeps its
+# list format. Assigning to permissions replaces them all, written in full by the next save().
 class Role(BaseModel):
-    def __init__(self, id: str, name: str, permissions: List[Permission] = None):
+    __slots__ = ('id', 'name', '_permissions', '_added', '_removed', '_replaced')
+    INDEXES = [('permissions.object_id',)] # Roles granting permissions on an object
+
+    def __init__(self, id: str, name: str, permissions: Iterable[Permission] = None):
         self.id = id # This will be used as _id in MongoDB
         self.name = name
-        self.permissions = permissions if permissions is not None else []
+        self.permissions = permissions if permissions is not None else ()
+
+    @property
+    def permissions(self) -> KeysView[Permission]:
+        return self._permissions.keys()
+
+    @permissions.setter
+    def permissions(self, permissions: Iterable[Permission]):
+        self._permissions: Dict[Permission, None] = dict.fromkeys(permissions) # Duplicates collapse
+        self._added: Dict[Permission, None] = {}
+        self._removed: Set[Permission] = set()
+        self._replaced = True
+
+    def add_permission(self, permission: Permission) -> bool:
+        """Adds the permission; False if the role already had it."""
+        if permission in self._permissions:
+            return False
+        self._permissions[permission] = None
+        if permission in self._removed:
+            self._removed.discard(permission) # Still stored
+        else:
+            self._added[permission] = None
+        return True
+
+    def remove_permission(self, permission: Permission) -> bool:
+        """Removes the permission; False if the role did not have it."""
+        if self._permissions.pop(permission, False) is not None:
+            return False
+        if self._added.pop(permission, False) is not None: # Unless it was never stored
+            self._removed.add(permission)
+        return True
+
+    def _updates(self) -> List[Dict[str, Any]]:
+        # Separate updates, as one cannot both $pull from and $push to a field
+        updates = []
+        if self._removed:
+            updates.append({'$pull': {'permissions': {'$in': [p.to_dict() for p in self._removed]}}})
+        if self._added:
+            updates.append({'$push': {'permissions': {'$each': [p.to_dict() for p in self._added]}}})
+        if 'name' not in self._persisted or self._persisted['name'] != self.name:
+            updates.append({'$set': {'name': self.name}})
+        return updates
+
+    def save(self) -> None:
+        if self._persisted is None or self._replaced:
+            return super().save()
+        updates = self._updates()
+        for update in updates:
+            if not self.collection().update_one({'_id': self.id}, update).matched_count:
+                self._persisted = None # The document is gone; write it in full
+                return super().save()
+        if updates:
+            self.mark_saved()
+            record_change(self._get_collection_name(), self.id)
+
+    def pending_writes(self) -> List[WriteOperation]:
+        if self._persisted is None or self._replaced:
+            return super().pending_writes()
+        return [('update_one', ({'_id': self.id}, update), {}) for update in self._updates()]
+
+    def mark_saved(self) -> None:
+        if self._persisted is None or self._replaced:
+            return super().mark_saved()
+        self._persisted['name'] = self.name
+        self._added, self._removed = {}, set()
+
+    def _mark_persisted(self, doc_data: Dict[str, Any]) -> None:
+        # The stored permissions are tracked through _added and _removed rather than a copy of the list
+        super()._mark_persisted({field: value for field, value in doc_data.items() if field != 'permissions'})
+        self._added, self._removed, self._replaced = {}, set(), False
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -42,7 +136,7 @@ class Role(BaseModel):
         return cls(
             id=data['_id'],
             name=data.get('name'),
-            permissions=[Permission.from_dict(p_data) for p_data in data.get('permissions', [])]
+            permissions=(Permission.from_dict(p_data) for p_data in data.get('permissions', []))
         )
 
 if __name__ == "__main__":
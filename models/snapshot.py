@@ -0,0 +1,137 @@
+import argparse
+import gc
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+import zlib
+from typing import Any, Dict
+
+# Binary snapshot of a PolicyEngine's in-memory state, for warm starts that skip reading and
+# hydrating every document. Layout:
+#   header  MAGIC, format version (uint16), change log version (uint64), payload length (uint64), crc32 (uint32)
+#   payload pickle of the engine's caches and indexes (SNAPSHOT_FIELDS)
+# The change log version stamped in the header is the last entry the state reflects; an engine
+# loading the snapshot applies the entries after it from the database (see PolicyEngine.sync), so
+# snapshots are only used by engines with the change log enabled. Loading memory-maps the file and
+# unpickles straight from the mapping, with the cyclic garbage collector paused: unpickling creates
+# millions of containers, and collections triggered part way through would repeatedly walk all of them.
+# In lazy user mode only the resident users are saved, and the snapshot can only be loaded by an
+# engine in the same mode.
+# Snapshots hold the whole policy (though not password hashes, which the engine does not keep): store them
+# with the same care as the database.
+MAGIC = b'PESNAP\0\0'
+FORMAT_VERSION = 6 # Bump whenever SNAPSHOT_FIELDS or the classes they hold change shape
+HEADER = struct.Struct('<8sHQQI')
+
+SNAPSHOT_FIELDS = [
+    'users', 'roles', 'objects', 'datasets', 'conflict_classes', 'caps', 'user_access_history',
+    'user_ids', 'object_ids', 'dataset_ids', 'conflict_class_ids', 'action_ids',
+    'dataset_conflict_classes', 'role_users', 'dataset_objects', 'object_datasets', 'effective_permissions',
+    'object_roles', 'object_cap_holders', 'user_blocked_datasets',
+]
+
+class SnapshotError(Exception):
+    pass
+
+def write_snapshot(engine, path: str) -> Dict[str, Any]:
+    """Writes the engine's state to path, atomically replacing any previous snapshot. Returns its header."""
+    if engine.change_log is None:
+        raise SnapshotError("Snapshots need the policy change log, to catch up with changes made after them.")
+    with engine._sync_lock: # No change log entry is applied while the state is pickled
+        change_seq = engine.change_seq
+        state = {field: getattr(engine, field) for field in SNAPSHOT_FIELDS}
+        state['users'] = dict(engine.users.items()) # Resident users only, without the lazy loader
+        state['lazy_users'] = engine.lazy_users
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, change_seq, len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {'format_version': FORMAT_VERSION, 'change_seq': change_seq, 'size': HEADER.size + len(payload)}
+
+def _read(path: str, verify: bool) -> tuple:
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < HEADER.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot.")
+            magic, format_version, change_seq, length, crc = HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not a policy snapshot.")
+            if format_version != FORMAT_VERSION:
+                raise SnapshotError(f"{path} has snapshot format {format_version}, expected {FORMAT_VERSION}.")
+            if len(mm) != HEADER.size + length:
+                raise SnapshotError(f"{path} is truncated.")
+            with memoryview(mm) as view:
+                payload = view[HEADER.size:]
+                try:
+                    if verify and zlib.crc32(payload) != crc:
+                        raise SnapshotError(f"{path} is corrupt (checksum mismatch).")
+                    gc_enabled = gc.isenabled()
+                    gc.disable()
+                    try:
+                        state = pickle.loads(payload)
+                    finally:
+                        if gc_enabled:
+                            gc.enable()
+                finally:
+                    payload.release()
+    header = {'format_version': format_version, 'change_seq': change_seq, 'size': HEADER.size + length}
+    return header, state
+
+def load_snapshot(engine, path: str, max_change_seq: int = None, verify: bool = True) -> Dict[str, Any]:
+    """
+    Replaces the engine's state with the snapshot's and returns the snapshot header. Refuses snapshots
+    stamped after max_change_seq, e.g. taken against another database.
+    """
+    header, state = _read(path, verify)
+    if max_change_seq is not None and header['change_seq'] > max_change_seq:
+        raise SnapshotError(f"{path} is newer than the change log ({header['change_seq']} > {max_change_seq}).")
+    missing = [field for field in SNAPSHOT_FIELDS if field not in state]
+    if missing:
+        raise SnapshotError(f"{path} lacks {', '.join(missing)}.")
+    if state.get('lazy_users', False) != engine.lazy_users:
+        raise SnapshotError(f"{path} was {'' if state.get('lazy_users') else 'not '}written in lazy user mode.")
+    for field in SNAPSHOT_FIELDS:
+        if not (field == 'users' and engine.lazy_users):
+            setattr(engine, field, state[field])
+    if engine.lazy_users:
+        # After the indexes, so users evicted for lack of room take their index entries with them
+        for user_id, user in state['users'].items():
+            engine.users[user_id] = user
+    engine.change_seq = header['change_seq']
+    return header
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """Checks a snapshot's header and checksum and returns the header with the number of entities it holds."""
+    header, state = _read(path, verify=True)
+    for field in ['users', 'roles', 'objects', 'datasets', 'conflict_classes']:
+        header[field] = len(state.get(field, {}))
+    return header
+
+
+if __name__ == "__main__":
+    # python -m models.snapshot create policy.snap   (reads the database configured by the environment)
+    # python -m models.snapshot verify policy.snap
+    parser = argparse.ArgumentParser(description="Create or verify PolicyEngine snapshots.")
+    parser.add_argument('command', choices=['create', 'verify'])
+    parser.add_argument('path')
+    args = parser.parse_args()
+    try:
+        if args.command == 'create':
+            from models.policy_engine import PolicyEngine
+            start = time.perf_counter()
+            engine = PolicyEngine(change_log=True)
+            loaded = time.perf_counter()
+            header = write_snapshot(engine, args.path)
+            print(f"Loaded the database in {loaded - start:.2f}s, wrote {args.path} in {time.perf_counter() - loaded:.2f}s: {header}")
+        else:
+            print(f"{args.path} is valid: {verify_snapshot(args.path)}")
+    except (OSError, SnapshotError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
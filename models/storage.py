@@ -0,0 +1,606 @@
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Storage backends behind BaseModel.
+# Every backend hands out collection objects supporting the subset of the pymongo Collection API
+# the models use, so model code is the same whichever backend is configured:
+#   find_one(filter, projection), find(filter, projection, batch_size), insert_one(doc),
+#   update_one(filter, update, upsert) -> result with matched_count, delete_one(filter), delete_many(filter)
+# find() returns an iterator that reads the matching documents batch_size at a time (DEFAULT_BATCH_SIZE
+# when not given), so large collections can be consumed without holding them in memory at once.
+# Filters are equality matches on top-level fields, or {'$in': values} to match any of the values. Updates use the $set, $push, $addToSet and $pull
+# operators (with $each / $in). Backends also provide bulk_update() to apply many updates to one
+# collection in a single round trip or transaction, bulk_write() to do the same with a mix of
+# update_one, delete_one and delete_many calls in order, insert_many() to insert many documents
+# in one round trip or transaction, reporting the ones that could not be inserted rather than
+# stopping at them, atomic named sequence counters, and ensure_indexes() to create the secondary
+# indexes the models declare, optionally unique. Writes that would repeat the _id of another
+# document, or the key of a unique index, raise DuplicateKeyError.
+#
+# The backend is chosen with the STORAGE_BACKEND environment variable:
+#   mongo  (default) MONGODB_URI, MONGODB_DB, plus the pool and concern settings read by
+#                    MongoConnectionManager.from_config (models/mongo_connection.py)
+#   sqlite           SQLITE_PATH, a single file opened in WAL mode
+#   memory           nothing is persisted, for tests, benchmarks and embedded use
+
+# (filter, update, upsert) triples accepted by bulk_update
+BulkUpdate = Tuple[Dict[str, Any], Dict[str, Any], bool]
+# (method, args, kwargs) collection calls accepted by bulk_write, e.g. ('delete_one', ({'_id': 1},), {})
+WriteOperation = Tuple[str, tuple, Dict[str, Any]]
+BULK_WRITE_METHODS = ('update_one', 'delete_one', 'delete_many')
+
+DEFAULT_BATCH_SIZE = 1000
+
+class DuplicateKeyError(ValueError):
+    pass
+
+class UpdateResult:
+    def __init__(self, matched_count: int, upserted_id: Any = None):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+        self.upserted_id = upserted_id
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    return all(field in doc and (doc[field] in value['$in'] if _is_in(value) else doc[field] == value)
+               for field, value in query.items())
+
+def _is_in(value: Any) -> bool:
+    return isinstance(value, dict) and '$in' in value
+
+def project(doc: Dict[str, Any], projection: Dict[str, Any] = None) -> Dict[str, Any]:
+    if not projection:
+        return doc
+    included = [field for field, keep in projection.items() if keep and field != '_id']
+    result = {field: doc[field] for field in included if field in doc} if included else \
+             {field: value for field, value in doc.items() if projection.get(field, 1)}
+    if projection.get('_id', 1) and '_id' in doc:
+        result['_id'] = doc['_id']
+    else:
+        result.pop('_id', None)
+    return result
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any]) -> None:
+    """Applies a Mongo-style update document to doc in place."""
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == '$set':
+                doc[field] = copy.deepcopy(value)
+            elif operator in ('$push', '$addToSet'):
+                values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                target = doc.setdefault(field, [])
+                for v in values:
+                    if operator == '$push' or v not in target:
+                        target.append(copy.deepcopy(v))
+            elif operator == '$pull':
+                removed = value['$in'] if isinstance(value, dict) and '$in' in value else [value]
+                if field in doc:
+                    doc[field] = [v for v in doc[field] if v not in removed]
+            else:
+                raise ValueError(f"Unsupported update operator {operator}")
+
+def new_document(query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    # Document created by an upsert: the equality fields of the filter plus the update
+    doc = copy.deepcopy(query)
+    apply_update(doc, update)
+    doc.setdefault('_id', uuid.uuid4().hex)
+    return doc
+
+
+class StorageBackend:
+    name = None
+    # Whether an index on an array field covers its elements, as Mongo's multikey indexes do
+    indexes_array_elements = False
+
+    def collection(self, name: str):
+        raise NotImplementedError("Storage backends must implement collection")
+
+    def bulk_update(self, collection_name: str, updates: List[BulkUpdate], ordered: bool = False) -> None:
+        raise NotImplementedError("Storage backends must implement bulk_update")
+
+    def bulk_write(self, collection_name: str, operations: List[WriteOperation]) -> None:
+        """Applies the operations to one collection in order, in a single round trip or transaction."""
+        raise NotImplementedError("Storage backends must implement bulk_write")
+
+    @staticmethod
+    def _check_operations(operations: List[WriteOperation]) -> None:
+        for method, _, _ in operations:
+            if method not in BULK_WRITE_METHODS:
+                raise ValueError(f"Unsupported bulk write operation {method}")
+
+    def insert_many(self, collection_name: str, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        """Inserts the documents, continuing past failures. Returns the errors by position in docs."""
+        raise NotImplementedError("Storage backends must implement insert_many")
+
+    def next_sequence(self, name: str) -> int:
+        """Atomically increments the named counter and returns its new value (1 for the first call)."""
+        raise NotImplementedError("Storage backends must implement next_sequence")
+
+    def current_sequence(self, name: str) -> int:
+        """Returns the last value handed out by next_sequence, 0 if none."""
+        raise NotImplementedError("Storage backends must implement current_sequence")
+
+    def ensure_indexes(self, collection_name: str, indexes: List[Tuple[str, ...]], unique: bool = False) -> None:
+        """
+        Creates an ascending index on each tuple of fields; existing indexes are left alone. Unique
+        indexes reject documents repeating the values of their fields, and raise DuplicateKeyError
+        if stored documents already do.
+        """
+        pass # Nothing to index in backends that scan in memory, where upserts run under one lock
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+    def close(self) -> None:
+        pass
+
+
+class MongoStorage(StorageBackend):
+    name = 'mongo'
+    indexes_array_elements = True
+
+    def __init__(self, connection=None, db=None):
+        # Either a MongoConnectionManager, which reconnects after fork(), or an externally managed
+        # database object such as a mongomock one in tests
+        if connection is None and db is None:
+            from .mongo_connection import MongoConnectionManager
+            connection = MongoConnectionManager()
+        self.connection = connection
+        self._db = db
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else self.connection.db
+
+    def collection(self, name: str):
+        return self.db[name]
+
+    def bulk_update(self, collection_name: str, updates: List[BulkUpdate], ordered: bool = False) -> None:
+        from pymongo import UpdateOne
+        if updates:
+            self.db[collection_name].bulk_write([UpdateOne(query, update, upsert=upsert) for query, update, upsert in updates],
+                                                ordered=ordered)
+
+    def ensure_indexes(self, collection_name: str, indexes: List[Tuple[str, ...]], unique: bool = False) -> None:
+        from pymongo import ASCENDING
+        from pymongo.errors import OperationFailure
+        collection = self.db[collection_name]
+        if unique:
+            # The same fields indexed without the constraint, by an older version, would conflict with it
+            keys = [[(field, ASCENDING) for field in fields] for fields in indexes]
+            for name, info in collection.index_information().items():
+                if [tuple(key) for key in info['key']] in keys and not info.get('unique'):
+                    collection.drop_index(name)
+        for fields in indexes:
+            try:
+                # A no-op for indexes that exist; those on array fields are multikey indexes over the elements
+                collection.create_index([(field, ASCENDING) for field in fields], unique=unique)
+            except OperationFailure as e:
+                if e.code == 11000:
+                    raise DuplicateKeyError(f"Duplicate {', '.join(fields)} in {collection_name}: {e}")
+                raise
+
+    def bulk_write(self, collection_name: str, operations: List[WriteOperation]) -> None:
+        from pymongo import UpdateOne, DeleteOne, DeleteMany
+        self._check_operations(operations)
+        requests = {'update_one': UpdateOne, 'delete_one': DeleteOne, 'delete_many': DeleteMany}
+        if operations:
+            self.db[collection_name].bulk_write([requests[method](*args, **kwargs) for method, args, kwargs in operations],
+                                                ordered=True)
+
+    def insert_many(self, collection_name: str, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        from pymongo.errors import BulkWriteError
+        if not docs:
+            return {}
+        try:
+            self.db[collection_name].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            return {error['index']: error['errmsg'] for error in e.details.get('writeErrors', [])}
+        return {}
+
+    def next_sequence(self, name: str) -> int:
+        from pymongo import ReturnDocument
+        counter = self.db['counters'].find_one_and_update({'_id': name}, {'$inc': {'seq': 1}}, upsert=True,
+                                                          return_document=ReturnDocument.AFTER)
+        return counter['seq']
+
+    def current_sequence(self, name: str) -> int:
+        counter = self.db['counters'].find_one({'_id': name})
+        return counter['seq'] if counter else 0
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        if self.connection is not None:
+            stats['pool'] = self.connection.stats()
+        return stats
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+
+class MemoryCollection:
+    def __init__(self, lock: threading.RLock):
+        self._docs: Dict[Any, Dict[str, Any]] = {} # _id -> document
+        self._lock = lock
+
+    def _matching(self, query: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if '_id' in query: # Primary key lookup
+            for doc_id in (dict.fromkeys(query['_id']['$in']) if _is_in(query['_id']) else [query['_id']]):
+                doc = self._docs.get(doc_id)
+                if doc is not None and matches(doc, query):
+                    yield doc
+            return
+        for doc in self._docs.values():
+            if matches(doc, query):
+                yield doc
+
+    def find_one(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None) -> Dict[str, Any] | None:
+        with self._lock:
+            doc = next(self._matching(query or {}), None)
+            return project(copy.deepcopy(doc), projection) if doc is not None else None
+
+    def find(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None,
+             batch_size: int = None) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            docs = list(self._matching(query or {}))
+        return self._copies(docs, projection, batch_size or DEFAULT_BATCH_SIZE)
+
+    def _copies(self, docs: List[Dict[str, Any]], projection: Dict[str, Any], batch_size: int) -> Iterator[Dict[str, Any]]:
+        # Copies are made a batch at a time, and only of the projected fields
+        for i in range(0, len(docs), batch_size):
+            with self._lock:
+                batch = [copy.deepcopy(project(doc, projection)) for doc in docs[i:i + batch_size]]
+            yield from batch
+
+    def insert_one(self, doc: Dict[str, Any]) -> None:
+        with self._lock:
+            doc = copy.deepcopy(doc)
+            doc.setdefault('_id', uuid.uuid4().hex)
+            if doc['_id'] in self._docs:
+                raise DuplicateKeyError(f"Duplicate _id {doc['_id']}")
+            self._docs[doc['_id']] = doc
+
+    def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        with self._lock:
+            doc = next(self._matching(query), None)
+            if doc is not None:
+                apply_update(doc, update)
+                return UpdateResult(1)
+            if not upsert:
+                return UpdateResult(0)
+            doc = new_document(query, update)
+            self._docs[doc['_id']] = doc
+            return UpdateResult(0, doc['_id'])
+
+    def delete_one(self, query: Dict[str, Any]) -> DeleteResult:
+        with self._lock:
+            doc = next(self._matching(query), None)
+            if doc is None:
+                return DeleteResult(0)
+            del self._docs[doc['_id']]
+            return DeleteResult(1)
+
+    def delete_many(self, query: Dict[str, Any]) -> DeleteResult:
+        with self._lock:
+            doc_ids = [doc['_id'] for doc in self._matching(query)]
+            for doc_id in doc_ids:
+                del self._docs[doc_id]
+            return DeleteResult(len(doc_ids))
+
+
+class MemoryStorage(StorageBackend):
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._sequences: Dict[str, int] = {}
+
+    def collection(self, name: str) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self._lock)
+            return self._collections[name]
+
+    def bulk_update(self, collection_name: str, updates: List[BulkUpdate], ordered: bool = False) -> None:
+        collection = self.collection(collection_name)
+        with self._lock:
+            for query, update, upsert in updates:
+                collection.update_one(query, update, upsert=upsert)
+
+    def bulk_write(self, collection_name: str, operations: List[WriteOperation]) -> None:
+        self._check_operations(operations)
+        collection = self.collection(collection_name)
+        with self._lock:
+            for method, args, kwargs in operations:
+                getattr(collection, method)(*args, **kwargs)
+
+    def insert_many(self, collection_name: str, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        collection = self.collection(collection_name)
+        errors = {}
+        with self._lock:
+            for i, doc in enumerate(docs):
+                try:
+                    collection.insert_one(doc)
+                except DuplicateKeyError as e:
+                    errors[i] = str(e)
+        return errors
+
+    def next_sequence(self, name: str) -> int:
+        with self._lock:
+            self._sequences[name] = self._sequences.get(name, 0) + 1
+            return self._sequences[name]
+
+    def current_sequence(self, name: str) -> int:
+        with self._lock:
+            return self._sequences.get(name, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            stats['documents'] = {name: len(collection._docs) for name, collection in self._collections.items()}
+        return stats
+
+
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# One table per collection: the JSON document keyed by its JSON-encoded _id.
+# Top-level fields used in filters get an expression index the first time they are queried.
+class SQLiteCollection:
+    def __init__(self, storage: 'SQLiteStorage', name: str):
+        self._storage = storage
+        self._table = name
+        self._indexed = set()
+        storage.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+
+    def _where(self, query: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+        # SQL narrows the candidates through the indexes, the exact match is checked on the documents
+        clauses, params = [], []
+        for field, value in query.items():
+            if field == '_id' and _is_in(value):
+                clauses.append(f"_id IN ({', '.join('?' * len(value['$in']))})" if value['$in'] else '0')
+                params.extend(json.dumps(doc_id) for doc_id in value['$in'])
+            elif field == '_id':
+                clauses.append('_id = ?')
+                params.append(json.dumps(value))
+            elif _FIELD_NAME.match(field) and isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                self._ensure_index(field)
+                clauses.append(f"json_extract(doc, '$.{field}') = ?")
+                params.append(value)
+        return clauses, params
+
+    def _select(self, query: Dict[str, Any], limit: int = None) -> List[Dict[str, Any]]:
+        clauses, params = self._where(query)
+        sql = f'SELECT doc FROM "{self._table}"'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        docs = [json.loads(row[0]) for row in self._storage.execute(sql, params).fetchall()]
+        docs = [doc for doc in docs if matches(doc, query)]
+        return docs[:limit] if limit else docs
+
+    def _batches(self, query: Dict[str, Any], clauses: List[str], params: List[Any], projection: Dict[str, Any],
+                 batch_size: int) -> Iterator[Dict[str, Any]]:
+        # Keyset pagination on _id: each batch is a short query of its own, so no cursor stays open
+        # on the shared connection between batches and writes in the meantime are safe
+        last_id = None
+        while True:
+            batch_clauses = clauses + (['_id > ?'] if last_id is not None else [])
+            sql = f'SELECT _id, doc FROM "{self._table}"'
+            if batch_clauses:
+                sql += ' WHERE ' + ' AND '.join(batch_clauses)
+            sql += ' ORDER BY _id LIMIT ?'
+            rows = self._storage.execute(sql, params + ([last_id] if last_id is not None else []) + [batch_size]).fetchall()
+            for _, text in rows:
+                doc = json.loads(text)
+                if matches(doc, query):
+                    yield project(doc, projection)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def _ensure_index(self, field: str):
+        if field not in self._indexed:
+            self._storage.execute(f'CREATE INDEX IF NOT EXISTS "{self._table}_{field}" '
+                                  f'ON "{self._table}" (json_extract(doc, \'$.{field}\'))')
+            self._indexed.add(field)
+
+    def ensure_indexes(self, indexes: List[Tuple[str, ...]], unique: bool = False):
+        # Filters only match top-level fields here, so indexes on nested fields would never be used.
+        # Fields are indexed one by one, as _where() does: the first field of a compound index is
+        # what narrows its queries down. Unique indexes cover all their fields, as the constraint must.
+        for fields in indexes:
+            if unique:
+                self._ensure_unique_index(fields)
+            elif _FIELD_NAME.match(fields[0]):
+                self._ensure_index(fields[0])
+
+    def _ensure_unique_index(self, fields: Tuple[str, ...]):
+        if not all(_FIELD_NAME.match(field) for field in fields):
+            raise ValueError(f"Unique indexes need top-level fields, not {', '.join(fields)}")
+        name = f"{self._table}_{'_'.join(fields)}_unique"
+        columns = ', '.join(f"json_extract(doc, '$.{field}')" for field in fields)
+        try:
+            self._storage.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{name}" ON "{self._table}" ({columns})')
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"Duplicate {', '.join(fields)} in {self._table}: {e}")
+
+    def _write(self, doc: Dict[str, Any]):
+        # Not INSERT OR REPLACE, which would delete the other document on a unique index conflict
+        try:
+            self._storage.execute(f'INSERT INTO "{self._table}" (_id, doc) VALUES (?, ?) '
+                                  f'ON CONFLICT(_id) DO UPDATE SET doc = excluded.doc',
+                                  (json.dumps(doc['_id']), json.dumps(doc)))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"Duplicate key in {self._table}: {e}")
+
+    def find_one(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None) -> Dict[str, Any] | None:
+        with self._storage.lock:
+            docs = self._select(query or {}, limit=1)
+        return project(docs[0], projection) if docs else None
+
+    def find(self, query: Dict[str, Any] = None, projection: Dict[str, Any] = None,
+             batch_size: int = None) -> Iterator[Dict[str, Any]]:
+        query = query or {}
+        clauses, params = self._where(query) # Now rather than on first iteration, so indexes exist right away
+        return self._batches(query, clauses, params, projection, batch_size or DEFAULT_BATCH_SIZE)
+
+    def insert_one(self, doc: Dict[str, Any]) -> None:
+        doc = dict(doc)
+        doc.setdefault('_id', uuid.uuid4().hex)
+        with self._storage.transaction():
+            try:
+                self._storage.execute(f'INSERT INTO "{self._table}" (_id, doc) VALUES (?, ?)',
+                                      (json.dumps(doc['_id']), json.dumps(doc)))
+            except sqlite3.IntegrityError:
+                raise DuplicateKeyError(f"Duplicate _id {doc['_id']}")
+
+    def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        with self._storage.transaction():
+            return self._update_one(query, update, upsert)
+
+    def _update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool) -> UpdateResult:
+        docs = self._select(query, limit=1)
+        if docs:
+            apply_update(docs[0], update)
+            self._write(docs[0])
+            return UpdateResult(1)
+        if not upsert:
+            return UpdateResult(0)
+        doc = new_document(query, update)
+        self._write(doc)
+        return UpdateResult(0, doc['_id'])
+
+    def delete_one(self, query: Dict[str, Any]) -> DeleteResult:
+        with self._storage.transaction():
+            docs = self._select(query, limit=1)
+            for doc in docs:
+                self._storage.execute(f'DELETE FROM "{self._table}" WHERE _id = ?', (json.dumps(doc['_id']),))
+            return DeleteResult(len(docs))
+
+    def delete_many(self, query: Dict[str, Any]) -> DeleteResult:
+        with self._storage.transaction():
+            docs = self._select(query)
+            self._storage.executemany(f'DELETE FROM "{self._table}" WHERE _id = ?', [(json.dumps(doc['_id']),) for doc in docs])
+            return DeleteResult(len(docs))
+
+
+class SQLiteStorage(StorageBackend):
+    name = 'sqlite'
+
+    def __init__(self, path: str = 'security_policy.db'):
+        self.path = path
+        self.lock = threading.RLock() # One connection shared by the request and write-behind threads
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._depth = 0 # Nesting level of transaction()
+        self.execute('PRAGMA journal_mode=WAL')
+        self.execute('PRAGMA synchronous=NORMAL')
+        self.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)')
+        self._collections: Dict[str, SQLiteCollection] = {}
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self.lock:
+            return self._connection.execute(sql, tuple(params))
+
+    def executemany(self, sql: str, rows: List[Tuple]) -> None:
+        with self.lock:
+            self._connection.executemany(sql, rows)
+
+    def transaction(self) -> '_Transaction':
+        return _Transaction(self)
+
+    def collection(self, name: str) -> SQLiteCollection:
+        with self.lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+            return self._collections[name]
+
+    def bulk_update(self, collection_name: str, updates: List[BulkUpdate], ordered: bool = False) -> None:
+        collection = self.collection(collection_name)
+        with self.transaction():
+            for query, update, upsert in updates:
+                collection._update_one(query, update, upsert)
+
+    def bulk_write(self, collection_name: str, operations: List[WriteOperation]) -> None:
+        self._check_operations(operations)
+        collection = self.collection(collection_name)
+        with self.transaction():
+            for method, args, kwargs in operations:
+                getattr(collection, method)(*args, **kwargs)
+
+    def insert_many(self, collection_name: str, docs: List[Dict[str, Any]]) -> Dict[int, str]:
+        collection = self.collection(collection_name)
+        errors = {}
+        with self.transaction():
+            for i, doc in enumerate(docs):
+                try:
+                    collection.insert_one(doc)
+                except DuplicateKeyError as e:
+                    errors[i] = str(e)
+        return errors
+
+    def ensure_indexes(self, collection_name: str, indexes: List[Tuple[str, ...]], unique: bool = False) -> None:
+        self.collection(collection_name).ensure_indexes(indexes, unique)
+
+    def next_sequence(self, name: str) -> int:
+        with self.transaction():
+            self.execute('INSERT INTO counters (name, seq) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET seq = seq + 1', (name,))
+            return self.execute('SELECT seq FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def current_sequence(self, name: str) -> int:
+        row = self.execute('SELECT seq FROM counters WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['path'] = self.path
+        stats['journal_mode'] = self.execute('PRAGMA journal_mode').fetchone()[0]
+        return stats
+
+    def close(self) -> None:
+        with self.lock:
+            self._connection.close()
+
+class _Transaction:
+    # Re-entrant BEGIN/COMMIT holding the storage lock, so bulk_update can wrap many updates in one transaction
+    def __init__(self, storage: SQLiteStorage):
+        self._storage = storage
+
+    def __enter__(self):
+        self._storage.lock.acquire()
+        if self._storage._depth == 0:
+            self._storage._connection.execute('BEGIN')
+        self._storage._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._storage._depth -= 1
+            if self._storage._depth == 0:
+                self._storage._connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._storage.lock.release()
+        return False
+
+
+def storage_from_config(config: Dict[str, str] = None) -> StorageBackend:
+    """Creates the storage backend named by STORAGE_BACKEND (mongo, sqlite or memory)."""
+    config = os.environ if config is None else config
+    backend = config.get('STORAGE_BACKEND', 'mongo').lower()
+    if backend == 'mongo':
+        from .mongo_connection import MongoConnectionManager
+        return MongoStorage(connection=MongoConnectionManager.from_config(config))
+    if backend == 'sqlite':
+        return SQLiteStorage(config.get('SQLITE_PATH', 'security_policy.db'))
+    if backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend}. Use mongo, sqlite or memory.")
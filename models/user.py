@@ -1,6 +1,7 @@
 from typing import List, Dict, Any
 import bcrypt # Added for password hashing
 from .base_model import BaseModel
+from .interning import intern_list
 
 # Password utility functions
 def hash_password_util(password: str) -> str:
@@ -18,6 +19,14 @@ def verify_password_util(plain_password: str, hashed_password_str: str) -> bool:
     return bcrypt.checkpw(plain_password_bytes, hashed_password_bytes)
 
 class User(BaseModel):
+    __slots__ = ('id', 'name', 'roles', 'access_history', 'password_hash')
+
+    # Projection for reads that never check passwords, e.g. the policy engine and user listings
+    WITHOUT_PASSWORD = {'password': 0}
+    INDEXES = [('roles',)] # Users holding a role
+    LIST_FIELDS = ('roles', 'access_history')
+
+
     def __init__(self, id: str, name: str, roles: List[str] = None, access_history: List[str] = None, password_hash: str = None):
         self.id = id  # This will be used as _id in MongoDB
         self.name = name
@@ -43,8 +52,8 @@ class User(BaseModel):
         return cls(
             id=data['_id'],
             name=data.get('name'),
-            roles=data.get('roles', []),
-            access_history=data.get('access_history', []),
+            roles=intern_list(data.get('roles', [])),
+            access_history=intern_list(data.get('access_history', [])),
             password_hash=data.get('password') # Load from 'password' in DB
         )
 
@@ -0,0 +1,166 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Bounded LRU cache of users for PolicyEngine's lazy user mode.
+# Users are loaded with loader(user_id) on first use and evicted, least recently used first, once
+# more than max_size are resident; on_evict(user) lets the engine drop the state it derived from
+# an evicted user. Ids the loader did not find are remembered in a bounded negative cache, so
+# repeated lookups of unknown users do not each hit the database; storing a user under such an id
+# forgets it. The loader runs without the cache's lock held, so a miss does not hold up lookups of
+# other users; concurrent lookups of a user being loaded wait for that load instead of repeating it.
+# Supports the dict operations PolicyEngine uses on its users, where get, [] and `in` load the user
+# if needed, and iteration, values() and len() only cover resident users.
+class UserCache:
+    def __init__(self, max_size: int, loader: Callable[[str], Any], on_evict: Callable[[Any], None] = None,
+                 negative_size: int = None):
+        if max_size <= 0:
+            raise ValueError("User cache size must be positive.")
+        self.max_size = max_size
+        self.negative_size = negative_size if negative_size is not None else max_size
+        self._loader = loader
+        self._on_evict = on_evict
+        self._users: "OrderedDict[str, Any]" = OrderedDict()
+        self._missing: "OrderedDict[str, bool]" = OrderedDict()
+        self._loading: Dict[str, threading.Event] = {} # Ids being loaded, set once done
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str, default: Any = None) -> Any:
+        while True:
+            with self._lock:
+                user = self._users.get(user_id)
+                if user is not None:
+                    self._users.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                if user_id in self._missing:
+                    self._missing.move_to_end(user_id)
+                    self.negative_hits += 1
+                    return default
+                loaded = self._loading.get(user_id)
+                if loaded is None:
+                    self.misses += 1
+                    loaded = self._loading[user_id] = threading.Event()
+                    break
+            loaded.wait() # Another thread is loading this user; look again once it is done
+        # The database is read without the lock, so lookups of other users go on meanwhile
+        try:
+            user = self._loader(user_id)
+        except BaseException:
+            with self._lock:
+                del self._loading[user_id]
+            loaded.set() # The waiting threads try the load themselves
+            raise
+        with self._lock:
+            del self._loading[user_id]
+            loaded.set() # The waiting threads find the result once the lock is released
+            if user is None:
+                self._missing[user_id] = True
+                while len(self._missing) > self.negative_size:
+                    self._missing.popitem(last=False)
+                return default
+            resident = self._users.get(user_id)
+            if resident is not None: # Stored meanwhile, e.g. by add_user
+                return resident
+            self._insert(user_id, user)
+            return user
+
+    def _insert(self, user_id: str, user: Any):
+        self._users[user_id] = user
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            _, evicted = self._users.popitem(last=False)
+            self.evictions += 1
+            if self._on_evict:
+                self._on_evict(evicted)
+
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id: str) -> Any:
+        user = self.get(user_id)
+        if user is None:
+            raise KeyError(user_id)
+        return user
+
+    def __setitem__(self, user_id: str, user: Any):
+        with self._lock:
+            self._missing.pop(user_id, None)
+            self._insert(user_id, user)
+
+    def pop(self, user_id: str, default: Any = None) -> Any:
+        """Removes a resident user without loading it or calling on_evict."""
+        with self._lock:
+            return self._users.pop(user_id, default)
+
+    def __delitem__(self, user_id: str):
+        with self._lock:
+            del self._users[user_id]
+
+    def resident(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def peek(self, user_id: str) -> Any:
+        """Returns the user if resident, without loading it or touching the LRU order or statistics."""
+        return self._users.get(user_id)
+
+    def forget_missing(self, user_id: str):
+        """Drops a negative cache entry, e.g. when another process created the user."""
+        with self._lock:
+            self._missing.pop(user_id, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._users))
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def keys(self) -> List[str]:
+        return list(self._users)
+
+    def values(self) -> List[Any]:
+        return list(self._users.values())
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(self._users.items())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._users),
+                'max_size': self.max_size,
+                'negative_size': len(self._missing),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                'resident_bytes': sum(_approximate_size(user) for user in self._users.values())
+            }
+
+def _approximate_size(user: Any) -> int:
+    # The object (its slots, or its attribute dict), and the strings and lists held by its attributes
+    if hasattr(user, '__dict__'):
+        attributes = vars(user)
+        size = sys.getsizeof(user) + sys.getsizeof(attributes)
+    else:
+        slots = [slot for cls in type(user).__mro__ for slot in getattr(cls, '__slots__', ())]
+        attributes = {slot: getattr(user, slot, None) for slot in slots}
+        size = sys.getsizeof(user)
+    for value in attributes.values():
+        size += sys.getsizeof(value)
+        if isinstance(value, (list, dict)):
+            size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+if __name__ == "__main__":
+    database = {"user1": "Victor", "user2": "Yuzhang"}
+    cache = UserCache(max_size=1, loader=database.get)
+    print(cache.get("user1"), cache.get("user2"), cache.get("nobody")) # Victor Yuzhang None
+    print(cache.get("nobody"), cache.stats()) # None, one negative hit and one eviction
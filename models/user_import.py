@@ -0,0 +1,99 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, Iterable, Iterator
+from .base_model import BaseModel
+
+# Reading user records for PolicyEngine.import_users from JSONL (one {"id", "name", "password"}
+# object per line) or CSV (a header row naming the id, name and password columns), one record at a
+# time, so files of any size can be imported. A JSONL line that does not parse is passed on as a
+# ValueError, which import_users reports as that record's error.
+#
+# Imports started from the API run as background jobs: the uploaded file is spooled to a temporary
+# file, the request returns the job id, and the job's status and report are kept in the
+# user_imports collection, so any worker process can answer for it. A job interrupted by a
+# shutdown stays "running".
+FORMATS = ('jsonl', 'csv')
+JOBS_COLLECTION = 'user_imports'
+MAX_STORED_ERRORS = 1000 # Per job document, which has to stay well under Mongo's 16 MB limit
+
+def parse_user_records(lines: Iterable[str], file_format: str = 'jsonl') -> Iterator[Any]:
+    if file_format == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported user import format {file_format}; expected jsonl or csv")
+    for line in lines:
+        if not line.strip():
+            continue # Blank lines are not records
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+def format_for_path(path: str) -> str:
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def start_import_job(engine, stream: BinaryIO, file_format: str, workers: int = None) -> str:
+    """Spools the file read from stream and imports it on a background thread. Returns the job id."""
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported user import format {file_format}; expected jsonl or csv")
+    with tempfile.NamedTemporaryFile('wb', suffix=f'.{file_format}', delete=False) as spool:
+        shutil.copyfileobj(stream, spool)
+    job_id = uuid.uuid4().hex
+    BaseModel.storage().collection(JOBS_COLLECTION).insert_one(
+        {'_id': job_id, 'status': "running", 'format': file_format, 'started': time.time()})
+    threading.Thread(target=_run_import_job, args=(engine, job_id, spool.name, file_format, workers),
+                     name=f'user-import-{job_id}', daemon=True).start()
+    return job_id
+
+def _run_import_job(engine, job_id: str, path: str, file_format: str, workers: int):
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            report = engine.import_users(parse_user_records(f, file_format), workers=workers)
+        if len(report['errors']) > MAX_STORED_ERRORS:
+            report.update(errors=report['errors'][:MAX_STORED_ERRORS], errors_truncated=True)
+        update = {'status': "done", 'report': report}
+    except Exception as e:
+        update = {'status': "failed", 'error': str(e)}
+    finally:
+        os.remove(path)
+    BaseModel.storage().collection(JOBS_COLLECTION).update_one({'_id': job_id}, {'$set': {**update, 'finished': time.time()}})
+
+def get_import_job(job_id: str) -> Dict[str, Any] | None:
+    """The job's status (running, done or failed), with its report once done."""
+    return BaseModel.storage().collection(JOBS_COLLECTION).find_one({'_id': job_id})
+
+
+if __name__ == "__main__":
+    # python -m models.user_import users.jsonl   (writes to the database configured by the environment)
+    parser = argparse.ArgumentParser(description="Import users from a JSONL or CSV file.")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="by default, csv for .csv files and jsonl otherwise")
+    parser.add_argument('--workers', type=int, help="password hashing processes, by default one per core")
+    parser.add_argument('--batch-size', type=int, default=1000, help="users written per insert_many")
+    args = parser.parse_args()
+    try:
+        from models.policy_engine import PolicyEngine
+        # With the change log, running servers pick the new users up
+        engine = PolicyEngine(change_log=os.environ.get('POLICY_CHANGE_LOG', '0') == '1',
+                              user_cache_size=int(os.environ.get('USER_CACHE_SIZE', '0')))
+        with open(args.path, newline='', encoding='utf-8') as f:
+            report = engine.import_users(parse_user_records(f, args.format or format_for_path(args.path)),
+                                         batch_size=args.batch_size, workers=args.workers)
+        engine.close()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for error in report['errors']:
+        print(f"Record {error['record']} ({error['id']}): {error['error']}")
+    print(f"Imported {report['imported']} users, {report['failed']} failed, in {report['seconds']}s "
+          f"({report['users_per_second']} users/s).")
+    sys.exit(1 if report['failed'] else 0)
@@ -0,0 +1,167 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+from .base_model import BaseModel
+from .user import User
+
+# Write-behind persistence for record_access.
+# Each access is appended to a local append-only journal (one JSON line per access) and queued
+# in memory; a background thread drains the queue and writes it to the database in batches, with one
+# bulk update per collection, once batch_size accesses are queued or flush_interval seconds pass.
+# The queue is bounded: when the database falls behind, record() blocks until there is room.
+# Every write is an idempotent $addToSet, so replaying the journal after a crash is always safe.
+# The journal is truncated whenever everything recorded so far has reached the database.
+# on_write, if given, is called from the writer with the ids of the users of every batch written.
+class AccessWriteBehind:
+    def __init__(self, journal_path: str, batch_size: int = 500, flush_interval: float = 0.1,
+                 max_pending: int = 10000, fsync: bool = False, on_write: Callable[[List[str]], None] = None):
+        self.journal_path = journal_path
+        self.on_write = on_write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync # fsync each journal append, trading latency for durability across power loss
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._journal = open(journal_path, 'a', encoding='utf-8')
+        self._lock = threading.Condition() # Guards the journal and the counters below
+        self._recorded = 0
+        self._flushed = 0
+        self._batches = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='access-write-behind', daemon=True)
+            self._thread.start()
+
+    def replay(self) -> int:
+        """Writes any accesses left in the journal by a previous run to the database. Returns their number."""
+        with open(self.journal_path, 'r', encoding='utf-8') as journal:
+            entries = []
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break # Torn final line from a crash mid-append
+                entries.append((entry['user_id'], entry['dataset_id']))
+        for i in range(0, len(entries), self.batch_size):
+            self._write_batch(entries[i:i + self.batch_size])
+        with self._lock:
+            if self._recorded == self._flushed:
+                self._truncate()
+        if entries:
+            print(f"Replayed {len(entries)} journaled accesses from {self.journal_path}.")
+        return len(entries)
+
+    def record(self, user_id: str, dataset_id: str):
+        """Journals one access and queues it for the background writer, blocking while the queue is full."""
+        with self._lock:
+            self._journal.write(json.dumps({'user_id': user_id, 'dataset_id': dataset_id}) + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._recorded += 1
+        self._queue.put((user_id, dataset_id))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until everything recorded so far is in the database. Returns False on timeout."""
+        with self._lock:
+            target = self._recorded
+            if self._thread is None or not self._thread.is_alive():
+                self._drain()
+            return self._lock.wait_for(lambda: self._flushed >= target, timeout)
+
+    def close(self):
+        """Stops the background writer after it has written everything still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._drain()
+            self._journal.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'recorded': self._recorded,
+                'flushed': self._flushed,
+                'pending': self._recorded - self._flushed,
+                'batches': self._batches
+            }
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _drain(self):
+        # Synchronous flush used when the background thread is not running
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.batch_size):
+            self._commit(batch[i:i + self.batch_size])
+
+    def _commit(self, batch: List[Tuple[str, str]]):
+        delay = self.flush_interval
+        while True:
+            try:
+                self._write_batch(batch)
+                break
+            except Exception as e:
+                if self._stop.is_set():
+                    print(f"Giving up on {len(batch)} accesses, they stay in {self.journal_path} for replay: {e}")
+                    return
+                print(f"Error writing access batch, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        with self._lock:
+            self._flushed += len(batch)
+            self._batches += 1
+            if self._recorded == self._flushed:
+                self._truncate()
+            self._lock.notify_all()
+
+    def _truncate(self):
+        if not self._journal.closed:
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    def _write_batch(self, batch: List[Tuple[str, str]]):
+        datasets_by_user: Dict[str, List[str]] = {}
+        for user_id, dataset_id in batch:
+            datasets = datasets_by_user.setdefault(user_id, [])
+            if dataset_id not in datasets:
+                datasets.append(dataset_id)
+        if not datasets_by_user:
+            return
+        storage = BaseModel.storage()
+        storage.bulk_update(User._get_collection_name(), [
+            ({'_id': user_id}, {'$addToSet': {'access_history': {'$each': datasets}}}, False)
+            for user_id, datasets in datasets_by_user.items()
+        ])
+        storage.bulk_update('access_history', [
+            ({'_id': user_id}, {'$set': {'user_id': user_id}, '$addToSet': {'accessed_datasets': {'$each': datasets}}}, True)
+            for user_id, datasets in datasets_by_user.items()
+        ])
+        if self.on_write:
+            self.on_write(list(datasets_by_user))
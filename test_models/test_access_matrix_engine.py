@@ -0,0 +1,97 @@
+import unittest
+import random
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+
+try:
+    from models.access_matrix_engine import AccessMatrixEngine
+except ImportError: # numpy not installed
+    AccessMatrixEngine = None
+
+ACTIONS = ["read", "write", "delete"]
+
+
+def build_random_policy(pe, rnd: random.Random):
+    users = [f"user{i}" for i in range(rnd.randint(1, 6))]
+    datasets = [f"ds{i}" for i in range(rnd.randint(1, 6))]
+    objects = [f"obj{i}" for i in range(rnd.randint(1, 10))]
+    roles = [f"role{i}" for i in range(rnd.randint(1, 4))]
+
+    for user_id in users:
+        pe.add_user(user_id, user_id.upper(), "pw")
+    for ds_id in datasets:
+        pe.add_dataset(ds_id, ds_id.upper())
+    for i in range(rnd.randint(0, 3)):
+        pe.add_conflict_class(f"cc{i}", f"CC{i}", rnd.sample(datasets, rnd.randint(1, len(datasets))))
+    for obj_id in objects:
+        pe.add_object(obj_id, obj_id.upper(), rnd.choice(datasets))
+    for role_id in roles:
+        pe.add_role(role_id, role_id.upper())
+        for _ in range(rnd.randint(0, 8)):
+            pe.add_permission_to_role(role_id, rnd.choice(objects), rnd.choice(ACTIONS))
+    for user_id in users:
+        for role_id in rnd.sample(roles, rnd.randint(0, len(roles))):
+            pe.assign_role_to_user(user_id, role_id)
+        for _ in range(rnd.randint(0, 4)):
+            pe.grant_direct_permission(user_id, rnd.choice(objects), rnd.choice(ACTIONS))
+        for _ in range(rnd.randint(0, 3)):
+            pe.record_access(user_id, rnd.choice(objects))
+    return users, objects
+
+
+@unittest.skipIf(AccessMatrixEngine is None, "numpy is required")
+class TestAccessMatrixEngine(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        # bcrypt dominates the runtime of these tests and is irrelevant to the decisions
+        patcher = mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_matches_check_access_on_random_policies(self):
+        from models.policy_engine import PolicyEngine
+        for seed in range(25):
+            BaseModel.use_storage(MemoryStorage())
+            pe = PolicyEngine()
+            users, objects = build_random_policy(pe, random.Random(seed))
+            engine = AccessMatrixEngine(pe, actions=ACTIONS)
+            lazy_pe = PolicyEngine(user_cache_size=2) # Compiled from storage, not the few resident users
+            lazy_pe.check_access(users[0], objects[0], ACTIONS[0])
+            lazy_engine = AccessMatrixEngine(lazy_pe, actions=ACTIONS)
+            for user_id in users:
+                for obj_id in objects:
+                    for action in ACTIONS:
+                        with self.subTest(seed=seed, user=user_id, obj=obj_id, action=action):
+                            expected = pe.check_access(user_id, obj_id, action)[0]
+                            self.assertEqual(engine.check(user_id, obj_id, action), expected)
+                            self.assertEqual(lazy_engine.check(user_id, obj_id, action), expected)
+
+    def test_row_and_column_queries(self):
+        from models.policy_engine import PolicyEngine
+        pe = PolicyEngine()
+        pe.add_user("alice", "Alice", "pw")
+        pe.add_user("bob", "Bob", "pw")
+        pe.add_dataset("ds", "DS")
+        pe.add_object("doc", "Doc", "ds")
+        pe.add_role("reader", "Reader")
+        pe.add_permission_to_role("reader", "doc", "read")
+        pe.assign_role_to_user("alice", "reader")
+        pe.grant_direct_permission("bob", "doc", "write")
+
+        engine = AccessMatrixEngine(pe)
+        self.assertEqual(engine.matrix().shape, (2, 1, 2))
+        self.assertEqual(engine.row("alice"), {"doc": ["read"]})
+        self.assertEqual(engine.column("doc"), {"alice": ["read"], "bob": ["write"]})
+        self.assertEqual(sorted(engine.allowed_triples()), [("alice", "doc", "read"), ("bob", "doc", "write")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+
+
+class TestCheckAccessBatchRoute(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        BaseModel.use_storage(MemoryStorage()) # Before the app creates its policy engine
+        from backend.app import app
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        BaseModel.use_storage(None)
+
+    def test_body_must_be_an_object(self):
+        for body in [[{'user_id': "alice", 'object_id': "doc", 'action': "read"}], "checks", 1]:
+            with self.subTest(body=body):
+                response = self.client.post('/api/check_access/batch', json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("JSON object", response.get_json()['error'])
+
+    def test_reasons_must_be_a_boolean(self):
+        response = self.client.post('/api/check_access/batch', json={'checks': [], 'reasons': "false"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/check_access/batch', json={'checks': [], 'reasons': False})
+        self.assertEqual(response.get_json(), {'results': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import pickle
+import random
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.role import Role, Permission
+from models.dataset import Dataset
+
+
+class TestDeltaSave(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        self.updates = []
+        for collection in [Role.collection(), Dataset.collection()]:
+            self._record_updates(collection)
+
+    def _record_updates(self, collection):
+        original_update_one = collection.update_one
+        def recording_update_one(query, update, *args, **kwargs):
+            self.updates.append(update)
+            return original_update_one(query, update, *args, **kwargs)
+        collection.update_one = recording_update_one
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_appends_and_removals_are_sent_as_deltas(self):
+        Role(id="analyst", name="Analyst", permissions=[Permission("doc", "read")]).save()
+        role = Role.get_by_id("analyst")
+        role.add_permission(Permission("doc", "write"))
+        role.save()
+        role.remove_permission(Permission("doc", "read"))
+        role.save()
+        role.name = "Senior Analyst"
+        role.save()
+        role.save() # Nothing changed, nothing sent
+        self.assertEqual(self.updates[1:], [
+            {'$push': {'permissions': {'$each': [{'object_id': "doc", 'action': "write"}]}}},
+            {'$pull': {'permissions': {'$in': [{'object_id': "doc", 'action': "read"}]}}},
+            {'$set': {'name': "Senior Analyst"}},
+        ])
+        self.assertEqual(Role.get_by_id("analyst").to_dict(), role.to_dict())
+
+    def test_falls_back_to_full_save_when_document_is_gone(self):
+        Role(id="analyst", name="Analyst").save()
+        role = Role.get_by_id("analyst")
+        Role.collection().delete_one({'_id': "analyst"})
+        role.name = "Auditor"
+        role.save()
+        self.assertEqual(Role.get_by_id("analyst").to_dict(), role.to_dict())
+
+    def test_projected_loads_do_not_overwrite_excluded_fields(self):
+        Role(id="analyst", name="Analyst", permissions=[Permission("doc", "read")]).save()
+        Role(id="auditor", name="Auditor").save()
+        roles = Role.iter_all(projection={'permissions': 0}, batch_size=1)
+        role = next(roles)
+        role.name = "Senior " + role.name
+        role.save()
+        self.assertEqual(self.updates[-1], {'$set': {'name': role.name}})
+        self.assertEqual([r.id for r in roles], ["auditor"])
+        self.assertEqual([p.to_dict() for p in Role.get_by_id("analyst").permissions], [{'object_id': "doc", 'action': "read"}])
+
+    def test_list_fields_are_tracked_not_copied(self):
+        Dataset(id="ds", name="DS", objects=["a", "b"]).save()
+        dataset = Dataset.get_by_id("ds")
+        self.assertIs(dataset._persisted['objects'], dataset.objects)
+        self.assertTrue(dataset.append_to('objects', "c"))
+        self.assertFalse(dataset.append_to('objects', "c"))
+        self.assertTrue(dataset.remove_from('objects', "a"))
+        dataset.save()
+        dataset.append_to('objects', "d")
+        dataset.remove_from('objects', "d") # Undone before saving, nothing to send
+        dataset.save()
+        # Mongo cannot $pull from and $push to the same field in one update
+        self.assertEqual(self.updates[1:], [{'$pull': {'objects': {'$in': ["a"]}}}, {'$push': {'objects': {'$each': ["c"]}}}])
+        dataset.remove_from('objects', "b")
+        dataset.append_to('objects', "b") # Moved to the end
+        dataset.save()
+        self.assertEqual(Dataset.get_by_id("ds").objects, ["c", "b"])
+
+    def test_random_list_edits_match_full_document(self):
+        rnd = random.Random(0)
+        Dataset(id="ds", name="DS").save()
+        dataset = Dataset.get_by_id("ds")
+        for _ in range(200):
+            choice = rnd.random()
+            if choice < 0.5:
+                dataset.append_to('objects', rnd.choice("abcdef"))
+            elif choice < 0.8 and dataset.objects:
+                dataset.remove_from('objects', rnd.choice(dataset.objects))
+            else:
+                dataset.objects = rnd.sample(dataset.objects, len(dataset.objects)) # Replaced, written in full
+            dataset.save()
+            self.assertEqual(Dataset.get_by_id("ds").objects, dataset.objects)
+
+
+class TestCompactModels(unittest.TestCase):
+
+    def test_permissions_are_values_with_interned_strings(self):
+        permission = Permission("doc", "read")
+        for copy in [Permission.from_dict({'object_id': "".join("doc"), 'action': "read"}),
+                     pickle.loads(pickle.dumps(permission, pickle.HIGHEST_PROTOCOL))]:
+            self.assertEqual(copy, permission)
+            self.assertIs(copy.object_id, permission.object_id)
+        self.assertEqual(len({permission, Permission("doc", "read"), Permission("doc", "write")}), 2)
+        with self.assertRaises(AttributeError):
+            permission.action = "write"
+
+    def test_role_permissions_are_a_set(self):
+        role = Role.from_dict({'_id': "analyst", 'permissions': [{'object_id': "doc", 'action': "read"}] * 2})
+        self.assertEqual(list(role.permissions), [Permission("doc", "read")])
+        self.assertFalse(role.add_permission(Permission("doc", "read")))
+        self.assertTrue(role.add_permission(Permission("doc", "write")))
+        self.assertTrue(role.remove_permission(Permission("doc", "read")))
+        self.assertFalse(role.remove_permission(Permission("doc", "read")))
+        self.assertEqual(role.to_dict()['permissions'], [{'object_id': "doc", 'action': "write"}])
+
+    def test_models_have_no_instance_dict(self):
+        role = Role(id="analyst", name="Analyst")
+        self.assertFalse(hasattr(role, '__dict__'))
+        self.assertIsNone(role._persisted)
+        with self.assertRaises(AttributeError):
+            role.nickname = "typo"
+
+
+if __name__ == '__main__':
+    unittest.main()
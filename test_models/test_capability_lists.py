@@ -0,0 +1,60 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.capability_lists import CapabilityList
+
+
+class TestCapabilityList(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def _documents(self):
+        return sorted((doc['user_id'], doc['object_id'], sorted(doc['actions']))
+                      for doc in CapabilityList.collection().find({}))
+
+    def test_one_document_per_user_and_object(self):
+        caps = CapabilityList.load()
+        caps.add_permission("alice", "doc", "read")
+        caps.add_permission("alice", "doc", "write")
+        caps.add_permission("bob", "doc", "read")
+        caps.save()
+        self.assertEqual(self._documents(), [("alice", "doc", ["read", "write"]), ("bob", "doc", ["read"])])
+
+        caps.remove_permission("alice", "doc", "read")
+        caps.remove_permission("bob", "doc", "read") # Last action removes the document
+        caps.save()
+        self.assertEqual(self._documents(), [("alice", "doc", ["write"])])
+        self.assertEqual(CapabilityList.load().matrix, {"alice": {"doc": {"write"}}})
+
+    def test_deletes_by_user_and_object(self):
+        caps = CapabilityList.load()
+        for user_id in ["alice", "bob"]:
+            for obj_id in ["doc", "report"]:
+                caps.add_permission(user_id, obj_id, "read")
+        caps.save()
+        caps.remove_all_permissions_for_object("doc")
+        caps.remove_user("bob")
+        caps.save()
+        self.assertEqual(self._documents(), [("alice", "report", ["read"])])
+
+    def test_migrates_legacy_singleton(self):
+        CapabilityList.collection().insert_one({
+            '_id': CapabilityList.FIXED_ID,
+            'matrix': {"alice": {"doc": ["read", "write"]}, "bob": {"report": ["read"]}}
+        })
+        caps = CapabilityList.load()
+        self.assertEqual(caps.matrix, {"alice": {"doc": {"read", "write"}}, "bob": {"report": {"read"}}})
+        self.assertIsNone(CapabilityList.collection().find_one({'_id': CapabilityList.FIXED_ID}))
+        self.assertEqual(self._documents(), [("alice", "doc", ["read", "write"]), ("bob", "report", ["read"])])
+        self.assertEqual(CapabilityList.migrate_singleton(), 0) # Nothing left to migrate
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.policy_engine import PolicyEngine
+
+
+class TestChangeLog(unittest.TestCase):
+
+    def setUp(self):
+        # Two engines sharing one database, as two worker processes would
+        BaseModel.use_storage(MemoryStorage())
+        self.writer = PolicyEngine(change_log=True)
+        self.reader = PolicyEngine(change_log=True)
+        w = self.writer
+        w.add_user("alice", "Alice", "pw")
+        w.add_role("analyst", "Analyst")
+        w.add_dataset("bank_a", "Bank A")
+        w.add_dataset("bank_b", "Bank B")
+        w.add_object("doc_a", "Doc A", "bank_a")
+        w.add_object("doc_b", "Doc B", "bank_b")
+        w.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        w.add_permission_to_role("analyst", "doc_a", "read")
+        w.add_permission_to_role("analyst", "doc_b", "read")
+        w.assign_role_to_user("alice", "analyst")
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def assertInSync(self):
+        self.assertEqual(self.reader.sync(self.writer.change_log.latest_version()), self.writer.change_log.latest_version())
+        for user_id in ["alice", "bob"]:
+            for object_id in ["doc_a", "doc_b"]:
+                for action in ["read", "write"]:
+                    self.assertEqual(self.reader.check_access(user_id, object_id, action).allowed,
+                                     self.writer.check_access(user_id, object_id, action).allowed,
+                                     (user_id, object_id, action))
+        self.assertEqual(self.reader.get_role_users("analyst"), self.writer.get_role_users("analyst"))
+        self.assertEqual(self.reader.get_dataset_objects("bank_a"), self.writer.get_dataset_objects("bank_a"))
+
+    def test_remote_mutations_are_applied(self):
+        self.assertFalse(self.reader.check_access("alice", "doc_a", "read").allowed)
+        self.assertInSync()
+        self.assertTrue(self.reader.check_access("alice", "doc_a", "read").allowed)
+
+        self.writer.add_user("bob", "Bob", "pw")
+        self.writer.grant_direct_permission("bob", "doc_b", "write")
+        self.writer.record_access("alice", "doc_a")
+        self.writer.revoke_permission_from_role("analyst", "doc_a", "read")
+        self.assertInSync()
+        self.assertEqual(self.reader.get_walled_datasets("alice"), self.writer.get_walled_datasets("alice"))
+
+        self.writer.update_object("doc_b", dataset_id="bank_a")
+        self.writer.delete_object("doc_a")
+        self.writer.delete_user("bob")
+        self.writer.delete_conflict_class("banks")
+        self.assertInSync()
+        self.assertNotIn("bob", self.reader.users)
+        self.assertEqual(self.reader.object_cap_holders, {})
+
+    def test_own_changes_are_not_reapplied(self):
+        version, policy_version = self.writer.change_log.latest_version(), self.writer.policy_version
+        self.assertEqual(self.writer.sync(version), version)
+        self.assertEqual(self.writer.policy_version, policy_version)
+
+    def test_waits_for_a_missing_entry_before_skipping_it(self):
+        self.reader.sync(self.writer.change_log.latest_version())
+        BaseModel.storage().next_sequence('policy_changelog') # Number taken, entry never written
+        self.writer.add_user("bob", "Bob", "pw")
+        self.reader.change_log.gap_timeout = 0.2
+        latest = self.writer.change_log.latest_version()
+        self.assertEqual(self.reader.sync(latest, timeout=0.05), latest - 2)
+        self.assertEqual(self.reader.sync(latest, timeout=1.0), latest)
+        self.assertIn("bob", self.reader.users)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.decision_cache import DecisionCache
+from models.decision import DecisionCode
+
+
+class TestDecisionCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = DecisionCache(max_size=4)
+        self.assertIsNone(cache.get(("u", "o", "read"), (0, 0)))
+        cache.put(("u", "o", "read"), (0, 0), (True, "ok"))
+        self.assertEqual(cache.get(("u", "o", "read"), (0, 0)), (True, "ok"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_stale_versions_are_never_served(self):
+        cache = DecisionCache(max_size=4)
+        cache.put(("u", "o", "read"), (0, 0), (True, "ok"))
+        self.assertIsNone(cache.get(("u", "o", "read"), (1, 0)))
+        self.assertIsNone(cache.get(("u", "o", "read"), (0, 0))) # Dropped once found stale
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = DecisionCache(max_size=2)
+        cache.put("a", (0,), 1)
+        cache.put("b", (0,), 2)
+        cache.get("a", (0,))
+        cache.put("c", (0,), 3)
+        self.assertIsNone(cache.get("b", (0,)))
+        self.assertEqual(cache.get("a", (0,)), 1)
+        self.assertEqual(cache.get("c", (0,)), 3)
+
+
+class TestPolicyEngineDecisionCache(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        from models.policy_engine import PolicyEngine
+        self.pe = PolicyEngine(decision_cache_size=100)
+        self.pe.add_user("alice", "Alice", "pw")
+        self.pe.add_dataset("bank_a", "Bank A")
+        self.pe.add_dataset("bank_b", "Bank B")
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("b_doc", "B Doc", "bank_b")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_permission_to_role("analyst", "b_doc", "read")
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_repeated_checks_hit_the_cache(self):
+        self.pe.check_access("alice", "b_doc", "read")
+        self.pe.check_access("alice", "b_doc", "read")
+        stats = self.pe.decision_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_mutations_invalidate_cached_decisions(self):
+        self.assertFalse(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.assign_role_to_user("alice", "analyst") # Per-user version
+        self.assertTrue(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.record_access("alice", "a_doc") # Per-user version
+        self.assertFalse(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.update_conflict_class("banks", dataset_ids=["bank_a"]) # Global version
+        self.assertTrue(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.revoke_permission_from_role("analyst", "b_doc", "read") # Global version
+        self.assertFalse(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.grant_direct_permission("alice", "b_doc", "read") # Global version
+        self.assertTrue(self.pe.check_access("alice", "b_doc", "read")[0])
+
+    def test_decision_codes_and_lazy_reasons(self):
+        decision = self.pe.check_access("alice", "missing", "read")
+        self.assertEqual((decision.allowed, decision.code), (False, DecisionCode.OBJECT_NOT_FOUND))
+
+        self.pe.assign_role_to_user("alice", "analyst")
+        decision = self.pe.check_access("alice", "b_doc", "read")
+        self.assertEqual((decision.code, decision.detail), (DecisionCode.GRANTED_BY_ROLE, "analyst"))
+        self.assertEqual(decision.to_dict(verbose=False), {"allowed": True, "code": "granted_by_role"})
+        allowed, reason = decision # Still unpacks like the old (allowed, reason) tuple
+        self.assertEqual(reason, "Permission 'read' on object 'B Doc' granted via role 'Analyst'.")
+
+        self.pe.record_access("alice", "a_doc")
+        decision = self.pe.check_access("alice", "b_doc", "read")
+        self.assertEqual((decision.code, decision.detail), (DecisionCode.CHINESE_WALL_CONFLICT, "bank_a"))
+        granted, message = self.pe.grant_access("alice", "b_doc", "read")
+        self.assertFalse(granted)
+        self.assertTrue(message.startswith("Cannot grant access: Chinese Wall conflict"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from unittest import mock
+import tempfile
+import uuid
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MongoStorage, SQLiteStorage, DuplicateKeyError
+from models.user import User
+from models.role import Role
+from models.object import Object
+from models.dataset import Dataset
+from models.conflict_class import ConflictClass
+from models.capability_lists import CapabilityList
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+MODELS = [User, Role, Object, Dataset, ConflictClass, CapabilityList]
+
+def plan_stages(plan):
+    # Every stage of an explain() plan, whatever the nesting (inputStage, inputStages, queryPlan, ...)
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+class TestMongoIndexes(unittest.TestCase):
+    # Needs a live server: MONGODB_URI, by default a local one. A throwaway database is used.
+
+    def setUp(self):
+        client = MongoClient(os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'), serverSelectionTimeoutMS=500)
+        try:
+            client.admin.command('ping')
+        except PyMongoError:
+            client.close()
+            self.skipTest("no MongoDB server to explain() queries against")
+        self.client = client
+        self.db_name = f"test_indexes_{uuid.uuid4().hex}"
+        BaseModel.use_storage(MongoStorage(db=client[self.db_name]))
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+        self.client.drop_database(self.db_name)
+        self.client.close()
+
+    def test_declared_query_patterns_use_an_index(self):
+        for model in MODELS:
+            model.ensure_indexes()
+            for fields in model.INDEXES + model.UNIQUE_INDEXES:
+                with self.subTest(collection=model._get_collection_name(), fields=fields):
+                    explain = model.collection().find({field: "x" for field in fields}).explain()
+                    stages = list(plan_stages(explain['queryPlanner']['winningPlan']))
+                    self.assertNotIn('COLLSCAN', stages)
+
+
+class TestSQLiteIndexes(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = SQLiteStorage(os.path.join(directory.name, 'policy.db'))
+        BaseModel.use_storage(self.storage)
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+        self.storage.close()
+
+    def test_top_level_fields_are_indexed_at_startup(self):
+        for model in MODELS:
+            model.ensure_indexes()
+        plan = self.storage.execute("EXPLAIN QUERY PLAN SELECT doc FROM objects "
+                                    "WHERE json_extract(doc, '$.dataset') = 'x'").fetchall()
+        self.assertIn('objects_dataset', str(plan))
+        names = {row[0] for row in self.storage.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({'capability_lists_user_id_object_id_unique', 'capability_lists_object_id'} <= names)
+        self.assertFalse({'users_roles', 'conflict_classes_datasets'} & names) # Arrays, which SQLite cannot index by element
+
+    def test_startup_stops_creating_indexes_at_the_first_failure(self):
+        from models.policy_engine import PolicyEngine
+        with mock.patch.object(User, 'ensure_indexes', side_effect=ConnectionError("no server")), \
+             mock.patch.object(Role, 'ensure_indexes') as role_indexes:
+            PolicyEngine()
+        role_indexes.assert_not_called() # Rather than waiting for the server once per model
+
+    def test_capability_pairs_are_unique(self):
+        caps = CapabilityList.collection()
+        caps.insert_one({'user_id': "alice", 'object_id': "doc1", 'actions': ["read"]})
+        caps.insert_one({'user_id': "alice", 'object_id': "doc1", 'actions': ["write"]}) # From before the constraint
+        caps.insert_one({'user_id': "alice", 'object_id': "doc2", 'actions': ["read"]})
+        CapabilityList.ensure_indexes()
+        self.assertEqual([sorted(doc['actions']) for doc in caps.find({'user_id': "alice", 'object_id': "doc1"})], [["read", "write"]])
+        with self.assertRaises(DuplicateKeyError):
+            caps.insert_one({'user_id': "alice", 'object_id': "doc2", 'actions': ["write"]})
+        caps.update_one({'user_id': "alice", 'object_id': "doc2"}, {'$addToSet': {'actions': "write"}}, upsert=True)
+        self.assertEqual(len(list(caps.find({}))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.base_model import BaseModel
+from models.storage import MemoryStorage, SQLiteStorage
+from models.policy_engine import PolicyEngine
+from models.role import Role
+
+
+class TestPolicyBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        BaseModel.use_storage(self.storage)
+        patcher = mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pe = PolicyEngine()
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_dataset("bank_a", "Bank A")
+        for object_id in ["doc_a", "doc_b"]:
+            self.pe.add_object(object_id, object_id.upper(), "bank_a")
+        for user_id in ["alice", "bob"]:
+            self.pe.add_user(user_id, user_id.title())
+
+    def make_storage(self):
+        return MemoryStorage()
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_batch_is_applied_in_order_and_persisted(self):
+        outcome = self.pe.apply_batch([
+            {'op': 'add_permission_to_role', 'role_id': "analyst", 'object_id': "doc_a", 'action': "read"},
+            {'op': 'add_permission_to_role', 'role_id': "analyst", 'object_id': "doc_b", 'action': "read"},
+            {'op': 'assign_role_to_user', 'user_id': "alice", 'role_id': "analyst"},
+            {'op': 'assign_role_to_user', 'user_id': "alice", 'role_id': "analyst"},
+            {'op': 'revoke_direct_permission', 'user_id': "bob", 'object_id': "doc_a", 'action': "write"},
+            {'op': 'grant_direct_permission', 'user_id': "bob", 'object_id': "doc_a", 'action': "write"},
+            {'op': 'revoke_permission_from_role', 'role_id': "analyst", 'object_id': "doc_b", 'action': "read"},
+        ])
+        self.assertTrue(outcome['applied'])
+        self.assertEqual([result['changed'] for result in outcome['results']], [True, True, True, False, False, True, True])
+        for pe in [self.pe, PolicyEngine()]: # The caches, then what was written
+            self.assertTrue(pe.check_access("alice", "doc_a", "read").allowed)
+            self.assertFalse(pe.check_access("alice", "doc_b", "read").allowed)
+            self.assertTrue(pe.check_access("bob", "doc_a", "write").allowed)
+        self.assertEqual(Role.get_by_id("analyst").to_dict()['permissions'], [{'object_id': "doc_a", 'action': "read"}])
+
+    def test_invalid_op_rejects_the_whole_batch(self):
+        version = self.pe.policy_version
+        outcome = self.pe.apply_batch([
+            {'op': 'assign_role_to_user', 'user_id': "alice", 'role_id': "analyst"},
+            {'op': 'grant_direct_permission', 'user_id': "bob", 'object_id': "missing", 'action': "read"},
+            {'op': 'drop_everything'},
+            {'op': 'revoke_role_from_user', 'user_id': "bob"},
+        ])
+        self.assertFalse(outcome['applied'])
+        self.assertEqual([result.get('error') is not None for result in outcome['results']], [False, True, True, True])
+        self.assertIn("missing", outcome['results'][1]['error'])
+        self.assertIn("role_id", outcome['results'][3]['error'])
+        self.assertEqual(self.pe.users["alice"].roles, [])
+        self.assertEqual(PolicyEngine().users["alice"].roles, [])
+        self.assertEqual(self.pe.policy_version, version)
+
+    def test_batch_makes_one_write_per_collection(self):
+        with mock.patch.object(self.storage, 'bulk_write', wraps=self.storage.bulk_write) as bulk_write:
+            self.pe.apply_batch([{'op': 'grant_direct_permission', 'user_id': user_id, 'object_id': object_id, 'action': "read"}
+                                 for user_id in ["alice", "bob"] for object_id in ["doc_a", "doc_b"]] +
+                                [{'op': 'assign_role_to_user', 'user_id': user_id, 'role_id': "analyst"}
+                                 for user_id in ["alice", "bob"]])
+        self.assertEqual(sorted(call.args[0] for call in bulk_write.call_args_list), ["capability_lists", "users"])
+
+
+class TestPolicyBatchSQLite(TestPolicyBatch):
+
+    def make_storage(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = SQLiteStorage(os.path.join(directory.name, 'policy.db'))
+        self.addCleanup(storage.close)
+        return storage
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import unittest
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.policy_engine import PolicyEngine
+from models.role import Permission
+from models.decision import DecisionCode
+
+
+class TestPolicyIndexes(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        self.pe = PolicyEngine()
+        self.pe.add_user("alice", "Alice", "pw")
+        for ds_id in ["bank_a", "bank_b", "oil_a"]:
+            self.pe.add_dataset(ds_id, ds_id.upper())
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def _dataset_conflict_classes(self):
+        # Translate the id-keyed index back to string identifiers
+        return {self.pe.dataset_ids.name(d): self.pe.conflict_class_ids.names(cc_ids)
+                for d, cc_ids in self.pe.dataset_conflict_classes.items()}
+
+    def _effective_permissions(self, user_id):
+        user_objects = self.pe.effective_permissions.get(self.pe.user_ids.get(user_id))
+        if user_objects is None:
+            return None
+        return {self.pe.object_ids.name(o): {self.pe.action_ids.name(a): roles for a, roles in actions.items()}
+                for o, actions in user_objects.items()}
+
+    def _walled(self, user_id, object_id):
+        return self.pe.check_access(user_id, object_id, "read").code is DecisionCode.CHINESE_WALL_CONFLICT
+
+    def test_conflict_class_index_follows_mutations(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.assertEqual(self._dataset_conflict_classes(), {"bank_a": ["banks"], "bank_b": ["banks"]})
+
+        self.pe.update_conflict_class("banks", dataset_ids=["bank_a", "oil_a"])
+        self.assertEqual(self._dataset_conflict_classes(), {"bank_a": ["banks"], "oil_a": ["banks"]})
+
+        self.pe.delete_conflict_class("banks")
+        self.assertEqual(self._dataset_conflict_classes(), {})
+
+    def test_concurrent_load_rebuilds_the_indexes(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_permission_to_role("analyst", "a_doc", "read")
+        self.pe.assign_role_to_user("alice", "analyst")
+        self.pe.record_access("alice", "a_doc")
+        loaded = PolicyEngine()
+        self.assertEqual(set(loaded.startup_stats['collections']), {'users', 'roles', 'objects', 'datasets', 'conflict_classes',
+                                                                   'capability_lists', 'access_history'})
+        self.assertEqual(loaded.users["alice"].access_history, ["bank_a"])
+        self.assertEqual(loaded.get_walled_datasets("alice"), self.pe.get_walled_datasets("alice"))
+        self.assertTrue(loaded.check_access("alice", "a_doc", "read").allowed)
+
+    def test_object_picks_up_conflict_class(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        obj = self.pe.add_object("report", "Report", "bank_a")
+        self.assertEqual(obj.conflict_class, "banks")
+        obj = self.pe.update_object("report", dataset_id="oil_a")
+        self.assertIsNone(obj.conflict_class)
+
+    def test_chinese_wall_uses_index(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("b_doc", "B Doc", "bank_b")
+        self.pe.add_object("oil_doc", "Oil Doc", "oil_a")
+        self.pe.record_access("alice", "a_doc")
+
+        self.assertFalse(self._walled("alice", "a_doc"))
+        self.assertTrue(self._walled("alice", "b_doc"))
+        self.assertIn("BANK_A", self.pe.check_access("alice", "b_doc", "read")[1])
+        self.assertFalse(self._walled("alice", "oil_doc"))
+
+        # Moving bank_b out of the class lifts the wall
+        self.pe.update_conflict_class("banks", dataset_ids=["bank_a", "oil_a"])
+        self.assertFalse(self._walled("alice", "b_doc"))
+        self.assertTrue(self._walled("alice", "oil_doc"))
+
+    def test_walled_datasets_follow_history_and_classes(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("oil_doc", "Oil Doc", "oil_a")
+        self.assertEqual(self.pe.get_walled_datasets("alice"), [])
+
+        self.pe.record_access("alice", "a_doc")
+        self.assertEqual(self.pe.get_walled_datasets("alice"), [{"dataset_id": "bank_b", "name": "BANK_B", "blocked_by": "bank_a"}])
+
+        # Conflict class changes rebuild the blocked sets from the access history
+        self.pe.add_conflict_class("energy", "Energy", ["bank_a", "oil_a"])
+        self.assertEqual(sorted(w["dataset_id"] for w in self.pe.get_walled_datasets("alice")), ["bank_b", "oil_a"])
+        self.pe.delete_conflict_class("banks")
+        self.assertEqual([w["dataset_id"] for w in self.pe.get_walled_datasets("alice")], ["oil_a"])
+        self.assertTrue(self._walled("alice", "oil_doc"))
+
+    def test_effective_permissions_follow_role_changes(self):
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_role("auditor", "Auditor")
+        self.pe.add_permission_to_role("analyst", "a_doc", "read")
+        self.pe.assign_role_to_user("alice", "analyst")
+        self.assertEqual(self._effective_permissions("alice"), {"a_doc": {"read": ["analyst"]}})
+
+        # Permissions added after assignment reach existing holders
+        self.pe.add_permission_to_role("analyst", "a_doc", "write")
+        self.pe.add_permission_to_role("auditor", "a_doc", "read")
+        self.pe.assign_role_to_user("alice", "auditor")
+        self.assertEqual(self._effective_permissions("alice")["a_doc"], {"read": ["analyst", "auditor"], "write": ["analyst"]})
+
+        # Read stays granted through the remaining role
+        self.pe.revoke_role_from_user("alice", "analyst")
+        self.assertEqual(self._effective_permissions("alice")["a_doc"], {"read": ["auditor"]})
+        allowed, reason = self.pe._check_rbac("alice", "a_doc", "read")
+        self.assertTrue(allowed)
+        self.assertIn("Auditor", reason)
+        self.assertFalse(self.pe._check_rbac("alice", "a_doc", "write")[0])
+
+        self.pe.revoke_permission_from_role("auditor", "a_doc", "read")
+        self.assertIsNone(self._effective_permissions("alice"))
+        self.assertEqual(self.pe.role_users, {"auditor": {self.pe.user_ids.get("alice")}})
+
+    def test_delete_object_drops_effective_permissions(self):
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_permission_to_role("analyst", "a_doc", "read")
+        self.pe.assign_role_to_user("alice", "analyst")
+        self.pe.delete_object("a_doc")
+        self.assertIsNone(self._effective_permissions("alice"))
+        self.assertFalse(self.pe._check_rbac("alice", "a_doc", "read")[0])
+
+    def test_delete_object_touches_only_indexed_roles_and_holders(self):
+        self.pe.add_user("bob", "Bob", "pw")
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("b_doc", "B Doc", "bank_b")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_role("auditor", "Auditor")
+        self.pe.add_permission_to_role("analyst", "a_doc", "read")
+        self.pe.add_permission_to_role("analyst", "a_doc", "write")
+        self.pe.add_permission_to_role("analyst", "b_doc", "read")
+        self.pe.add_permission_to_role("auditor", "b_doc", "read")
+        self.pe.grant_direct_permission("alice", "a_doc", "read")
+        self.pe.grant_direct_permission("bob", "b_doc", "read")
+        a_doc = self.pe.object_ids.get("a_doc")
+        self.assertEqual(self.pe.object_roles[a_doc], {"analyst": ["read", "write"]})
+        self.assertEqual(self.pe.object_cap_holders[a_doc], {self.pe.user_ids.get("alice")})
+
+        # The index is rebuilt identically on load
+        reloaded = PolicyEngine()
+        self.assertEqual(reloaded.object_roles[reloaded.object_ids.get("a_doc")], {"analyst": ["read", "write"]})
+        self.assertEqual(reloaded.object_cap_holders[reloaded.object_ids.get("b_doc")], {reloaded.user_ids.get("bob")})
+
+        self.pe.delete_object("a_doc")
+        self.assertNotIn(a_doc, self.pe.object_roles)
+        self.assertNotIn(a_doc, self.pe.object_cap_holders)
+        self.assertEqual(list(self.pe.roles["analyst"].permissions), [Permission("b_doc", "read")])
+        self.assertEqual(len(self.pe.roles["auditor"].permissions), 1)
+        self.assertEqual(self.pe.caps.matrix, {"bob": {"b_doc": {"read"}}})
+
+        self.pe.revoke_direct_permission("bob", "b_doc", "read")
+        self.assertNotIn(self.pe.object_ids.get("b_doc"), self.pe.object_cap_holders)
+
+    def test_membership_indexes_guard_deletes(self):
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.assign_role_to_user("alice", "analyst")
+        self.assertEqual(self.pe.get_role_users("analyst"), [{"id": "alice", "name": "Alice"}])
+        with self.assertRaises(Exception):
+            self.pe.delete_role("analyst")
+        self.pe.revoke_role_from_user("alice", "analyst")
+        self.assertEqual(self.pe.get_role_users("analyst"), [])
+        self.assertTrue(self.pe.delete_role("analyst"))
+
+        self.pe.add_object("doc", "Doc", "bank_a")
+        self.assertEqual([obj["_id"] for obj in self.pe.get_dataset_objects("bank_a")], ["doc"])
+        with self.assertRaises(Exception):
+            self.pe.delete_dataset("bank_a")
+        self.pe.update_object("doc", dataset_id="bank_b")
+        self.assertEqual(self.pe.get_dataset_objects("bank_a"), [])
+        self.assertTrue(self.pe.delete_dataset("bank_a"))
+        self.assertEqual(PolicyEngine().get_dataset_objects("bank_b"), self.pe.get_dataset_objects("bank_b"))
+        self.pe.delete_object("doc")
+        self.assertTrue(self.pe.delete_dataset("bank_b"))
+
+    def test_check_access_many_matches_check_access(self):
+        self.pe.add_user("bob", "Bob", "pw")
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("b_doc", "B Doc", "bank_b")
+        self.pe.add_role("analyst", "Analyst")
+        self.pe.add_permission_to_role("analyst", "a_doc", "read")
+        self.pe.add_permission_to_role("analyst", "b_doc", "read")
+        self.pe.assign_role_to_user("alice", "analyst")
+        self.pe.grant_direct_permission("bob", "b_doc", "write")
+        self.pe.record_access("alice", "a_doc")
+
+        checks = [(user_id, object_id, action)
+                  for user_id in ["alice", "bob", "nobody"]
+                  for object_id in ["a_doc", "b_doc", "missing"]
+                  for action in ["read", "write"]]
+        expected = [self.pe.check_access(*check) for check in checks]
+        self.assertEqual(self.pe.check_access_many(checks), expected)
+        self.assertEqual(self.pe.check_access_many(checks, with_reasons=False), [allowed for allowed, _ in expected])
+
+    def test_decisions_look_objects_up_by_id(self):
+        self.pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        self.pe.add_object("a_doc", "A Doc", "bank_a")
+        self.pe.add_object("b_doc", "B Doc", "bank_b")
+        self.pe.grant_direct_permission("alice", "b_doc", "read")
+        self.pe.record_access("alice", "a_doc")
+        b_doc = self.pe.object_ids.get("b_doc")
+        self.assertEqual(self.pe.object_datasets[b_doc], self.pe.dataset_ids.get("bank_b"))
+        with mock.patch.object(self.pe, 'objects', {}): # Not consulted once the object ids are known
+            self.assertEqual(self.pe.check_access("alice", "b_doc", "read").code, DecisionCode.CHINESE_WALL_CONFLICT)
+
+        self.pe.update_object("b_doc", dataset_id="oil_a")
+        self.assertEqual(self.pe.object_datasets[b_doc], self.pe.dataset_ids.get("oil_a"))
+        self.assertTrue(self.pe.check_access("alice", "b_doc", "read")[0])
+        self.pe.delete_object("b_doc")
+        self.assertNotIn(b_doc, self.pe.object_datasets)
+        self.assertEqual(self.pe.check_access("alice", "b_doc", "read").code, DecisionCode.OBJECT_NOT_FOUND)
+
+
+class TestIdInterner(unittest.TestCase):
+
+    def test_ids_are_dense_and_stable(self):
+        from models.interning import IdInterner
+        interner = IdInterner(["read", "write"])
+        self.assertEqual(interner.intern("read"), 0)
+        self.assertEqual(interner.intern("delete"), 2)
+        self.assertIsNone(interner.get("share"))
+        self.assertEqual(interner.names([2, 1]), ["delete", "write"])
+        self.assertEqual(len(interner), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import tempfile
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.storage import MemoryStorage, SQLiteStorage, MongoStorage, storage_from_config
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+# The same contract is checked against every backend
+class StorageContract:
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.roles = self.storage.collection('roles')
+
+    def tearDown(self):
+        self.storage.close()
+
+    def test_upsert_find_and_delete(self):
+        self.roles.update_one({'_id': "analyst"}, {'$set': {'_id': "analyst", 'name': "Analyst"}}, upsert=True)
+        self.assertEqual(self.roles.find_one({'_id': "analyst"}), {'_id': "analyst", 'name': "Analyst"})
+        self.assertEqual(self.roles.update_one({'_id': "missing"}, {'$set': {'name': "x"}}).matched_count, 0)
+        self.assertIsNone(self.roles.find_one({'_id': "missing"}))
+        self.roles.delete_one({'_id': "analyst"})
+        self.assertEqual(list(self.roles.find({})), [])
+
+    def test_list_operators(self):
+        self.roles.update_one({'_id': "analyst"}, {'$set': {'permissions': [{'object_id': "doc", 'action': "read"}]}}, upsert=True)
+        self.roles.update_one({'_id': "analyst"}, {'$push': {'permissions': {'$each': [{'object_id': "doc", 'action': "write"}]}}})
+        self.roles.update_one({'_id': "analyst"}, {'$pull': {'permissions': {'$in': [{'object_id': "doc", 'action': "read"}]}}})
+        self.roles.update_one({'_id': "analyst"}, {'$addToSet': {'tags': {'$each': ["a", "b"]}}})
+        self.roles.update_one({'_id': "analyst"}, {'$addToSet': {'tags': "a"}})
+        self.assertEqual(self.roles.find_one({'_id': "analyst"}),
+                         {'_id': "analyst", 'permissions': [{'object_id': "doc", 'action': "write"}], 'tags': ["a", "b"]})
+
+    def test_field_filters_and_projection(self):
+        caps = self.storage.collection('capability_lists')
+        for user_id, object_id in [("alice", "doc"), ("alice", "report"), ("bob", "doc")]:
+            caps.update_one({'user_id': user_id, 'object_id': object_id}, {'$addToSet': {'actions': "read"}}, upsert=True)
+        found = caps.find({'object_id': "doc"}, {'_id': 0, 'user_id': 1})
+        self.assertEqual(sorted(doc['user_id'] for doc in found), ["alice", "bob"])
+        self.assertEqual(list(caps.find({'object_id': "doc"}, {'_id': 0, 'user_id': 1}))[0].keys(), {'user_id'})
+        self.assertEqual(caps.delete_many({'user_id': "alice"}).deleted_count, 2)
+        self.assertEqual([doc['user_id'] for doc in caps.find({})], ["bob"])
+
+    def test_in_filters(self):
+        for role_id in ["analyst", "auditor", "admin"]:
+            self.roles.insert_one({'_id': role_id, 'name': role_id.title()})
+        found = self.roles.find({'_id': {'$in': ["admin", "analyst", "missing"]}}, {'_id': 1})
+        self.assertEqual(sorted(doc['_id'] for doc in found), ["admin", "analyst"])
+        self.assertEqual(list(self.roles.find({'_id': {'$in': []}})), [])
+        self.assertEqual([doc['_id'] for doc in self.roles.find({'name': {'$in': ["Auditor"]}})], ["auditor"])
+
+    def test_find_reads_in_batches(self):
+        for i in range(25):
+            self.roles.update_one({'_id': f"role{i:02}"}, {'$set': {'name': f"Role {i}", 'kind': i % 2}}, upsert=True)
+        found = self.roles.find({'kind': 1}, {'name': 0}, batch_size=4)
+        first = next(found)
+        self.roles.delete_one({'_id': "role24"}) # Writes between batches are safe
+        ids = [first['_id']] + [doc['_id'] for doc in found]
+        self.assertEqual(sorted(ids), [f"role{i:02}" for i in range(1, 24, 2)])
+        self.assertNotIn('name', first)
+
+    def test_bulk_update(self):
+        self.storage.bulk_update('users', [({'_id': f"user{i}"}, {'$addToSet': {'access_history': {'$each': ["ds"]}}}, True)
+                                           for i in range(3)])
+        self.assertEqual(sorted(doc['_id'] for doc in self.storage.collection('users').find({})), ["user0", "user1", "user2"])
+
+
+class TestMemoryStorage(StorageContract, unittest.TestCase):
+
+    def make_storage(self):
+        return MemoryStorage()
+
+    def test_returned_documents_are_copies(self):
+        self.roles.update_one({'_id': "analyst"}, {'$set': {'permissions': []}}, upsert=True)
+        self.roles.find_one({'_id': "analyst"})['permissions'].append("leak")
+        self.assertEqual(self.roles.find_one({'_id': "analyst"})['permissions'], [])
+
+
+class TestSQLiteStorage(StorageContract, unittest.TestCase):
+
+    def make_storage(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'policy.db')
+        return SQLiteStorage(self.path)
+
+    def test_wal_mode_and_persistence(self):
+        self.assertEqual(self.storage.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.roles.update_one({'_id': "analyst"}, {'$set': {'name': "Analyst"}}, upsert=True)
+        reopened = SQLiteStorage(self.path)
+        self.assertEqual(reopened.collection('roles').find_one({'_id': "analyst"})['name'], "Analyst")
+        reopened.close()
+
+    def test_field_filters_use_an_index(self):
+        self.storage.collection('capability_lists').find({'object_id': "doc"})
+        plan = self.storage.execute("EXPLAIN QUERY PLAN SELECT doc FROM capability_lists "
+                                    "WHERE json_extract(doc, '$.object_id') = 'doc'").fetchall()
+        self.assertIn('capability_lists_object_id', str(plan))
+
+
+@unittest.skipIf(mongomock is None, "mongomock is required to exercise the Mongo backend without a server")
+class TestMongoStorage(StorageContract, unittest.TestCase):
+
+    def make_storage(self):
+        return MongoStorage(db=mongomock.MongoClient()['test_security_policy_db'])
+
+    @unittest.skip("mongomock cannot run bulk_write with the operation objects of recent pymongo releases")
+    def test_bulk_update(self):
+        pass
+
+
+class TestStorageConfig(unittest.TestCase):
+
+    def test_backend_is_selected_by_configuration(self):
+        self.assertIsInstance(storage_from_config({'STORAGE_BACKEND': "memory"}), MemoryStorage)
+        with self.assertRaises(ValueError):
+            storage_from_config({'STORAGE_BACKEND': "cassandra"})
+
+    def test_mongo_client_options_and_fork_reconnect(self):
+        # Clients are created with connect=False, so no server is needed
+        storage = storage_from_config({'STORAGE_BACKEND': "mongo", 'MONGODB_MAX_POOL_SIZE': "7",
+                                       'MONGODB_SERVER_SELECTION_TIMEOUT_MS': "500", 'MONGODB_WRITE_CONCERN': "majority",
+                                       'MONGODB_READ_CONCERN': "local"})
+        manager = storage.connection
+        client = manager.client
+        self.assertEqual(client.options.pool_options.max_pool_size, 7)
+        self.assertEqual(client.options.server_selection_timeout, 0.5)
+        self.assertEqual(client.write_concern.document, {'w': "majority"})
+        self.assertEqual(client.read_concern.level, "local")
+        self.assertIs(manager.client, client)
+
+        with mock.patch('os.getpid', return_value=os.getpid() + 1): # As seen from a forked worker
+            self.assertIsNot(manager.client, client)
+        stats = storage.stats()
+        self.assertEqual((stats['backend'], stats['pool']['reconnects'], stats['pool']['max_pool_size']), ("mongo", 1, 7))
+        storage.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
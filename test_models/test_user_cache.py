@@ -0,0 +1,134 @@
+import unittest
+import threading
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.policy_engine import PolicyEngine
+from models.user_cache import UserCache
+from models.user import User
+
+
+class TestUserCache(unittest.TestCase):
+
+    def test_lru_eviction_and_negative_caching(self):
+        database = {"alice": "Alice", "bob": "Bob", "carol": "Carol"}
+        loads, evicted = [], []
+        def loader(user_id):
+            loads.append(user_id)
+            return database.get(user_id)
+        cache = UserCache(2, loader, evicted.append)
+        cache.get("alice")
+        cache.get("bob")
+        cache.get("alice") # bob is now the least recently used
+        cache.get("carol")
+        self.assertEqual(evicted, ["Bob"])
+        self.assertEqual(cache.keys(), ["alice", "carol"])
+        self.assertNotIn("mallory", cache)
+        self.assertNotIn("mallory", cache)
+        self.assertEqual(loads, ["alice", "bob", "carol", "mallory"])
+        cache["mallory"] = "Mallory" # Created since: forgotten by the negative cache
+        self.assertEqual(cache.get("mallory"), "Mallory")
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['negative_hits'], stats['misses']), (2, 1, 4))
+
+    def test_loads_do_not_block_other_lookups(self):
+        loading, release, loads = threading.Event(), threading.Event(), []
+        def loader(user_id):
+            loads.append(user_id)
+            if user_id == "slow":
+                loading.set()
+                release.wait(5)
+            return user_id.upper()
+        cache = UserCache(10, loader)
+        cache.get("alice")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("slow"))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(loading.wait(5))
+        self.assertEqual(cache.get("alice"), "ALICE") # Answered while "slow" is still loading
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ["SLOW"] * 3)
+        self.assertEqual(loads, ["alice", "slow"]) # One load for the concurrent lookups
+
+
+class TestLazyUsers(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        patcher = mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pe = PolicyEngine()
+        pe.add_role("analyst", "Analyst")
+        pe.add_dataset("bank_a", "Bank A")
+        pe.add_dataset("bank_b", "Bank B")
+        pe.add_object("doc_a", "Doc A", "bank_a")
+        pe.add_object("doc_b", "Doc B", "bank_b")
+        pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+        pe.add_permission_to_role("analyst", "doc_a", "read")
+        pe.add_permission_to_role("analyst", "doc_b", "read")
+        for i in range(5):
+            pe.add_user(f"user{i}", f"User {i}")
+            pe.assign_role_to_user(f"user{i}", "analyst")
+            pe.grant_direct_permission(f"user{i}", "doc_b", "write")
+        pe.record_access("user0", "doc_a")
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_decisions_match_eager_engine(self):
+        eager = PolicyEngine()
+        lazy = PolicyEngine(user_cache_size=2, prewarm_users=["user3"])
+        self.assertEqual(lazy.users.keys(), ["user3"])
+        checks = [(f"user{i}", object_id, action) for i in range(6) for object_id in ["doc_a", "doc_b"]
+                  for action in ["read", "write"]]
+        for _ in range(2): # The second round reloads evicted users
+            self.assertEqual([d.allowed for d in lazy.check_access_many(checks)], [d.allowed for d in eager.check_access_many(checks)])
+            for check in checks:
+                self.assertEqual(lazy.check_access(*check).allowed, eager.check_access(*check).allowed, check)
+        self.assertLessEqual(len(lazy.users), 2)
+        self.assertLessEqual(len(lazy.effective_permissions), 2)
+
+        lazy.add_permission_to_role("analyst", "doc_b", "write") # Reaches the non-resident holders on load
+        self.assertTrue(lazy.check_access("user4", "doc_b", "write").allowed)
+        with self.assertRaises(Exception):
+            lazy.delete_role("analyst") # Still known to be assigned to non-resident users
+        self.assertEqual(len(lazy.get_role_users("analyst")), 5)
+        self.assertEqual(lazy.get_walled_datasets("user0"), eager.get_walled_datasets("user0"))
+        self.assertGreater(lazy.user_cache_stats()['hit_ratio'], 0)
+
+    def test_get_users_streams_from_storage(self):
+        lazy = PolicyEngine(user_cache_size=2)
+        self.assertEqual(sorted(user['_id'] for user in lazy.get_users()), [f"user{i}" for i in range(5)])
+        self.assertEqual(len(lazy.users), 0)
+
+    def test_password_hashes_stay_in_storage(self):
+        for pe in [PolicyEngine(), PolicyEngine(user_cache_size=2)]:
+            self.assertFalse(any('password' in user for user in pe.get_users()))
+            with mock.patch('models.user.verify_password_util', lambda plain, hashed: hashed == "hashed"):
+                self.assertTrue(pe.change_user_password("user1", "old", "new"))
+            self.assertEqual(User.collection().find_one({'_id': "user1"})['password'], "hashed")
+            self.assertNotIn('password', pe.users["user1"].to_dict())
+
+    def test_remote_changes_to_non_resident_users(self):
+        writer = PolicyEngine(change_log=True)
+        lazy = PolicyEngine(change_log=True, user_cache_size=1)
+        writer.add_role("auditor", "Auditor")
+        writer.add_permission_to_role("auditor", "doc_a", "write")
+        writer.assign_role_to_user("user2", "auditor")
+        writer.add_user("user9", "User 9")
+        self.assertFalse(lazy.check_access("user9", "doc_a", "read").allowed) # Negative cached before the sync
+        lazy.sync(writer.change_log.latest_version())
+        self.assertTrue(lazy.check_access("user2", "doc_a", "write").allowed)
+        self.assertIn("user9", lazy.users)
+        self.assertEqual([user['id'] for user in lazy.get_role_users("auditor")], ["user2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import io
+import time
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from unittest import mock
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.policy_engine import PolicyEngine
+from models.user import User, verify_password_util
+from models.user_import import parse_user_records, start_import_job, get_import_job
+
+
+class TestUserImport(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        patcher = mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pe = PolicyEngine()
+        self.pe.add_user("alice", "Alice")
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def test_parse_jsonl_and_csv(self):
+        jsonl = io.StringIO('{"id": "bob", "name": "Bob", "password": "pw"}\n\nnot json\n')
+        records = list(parse_user_records(jsonl))
+        self.assertEqual(records[0], {'id': "bob", 'name': "Bob", 'password': "pw"})
+        self.assertIsInstance(records[1], ValueError)
+        csv = io.StringIO('id,name,password\nbob,"Bob, Jr.",pw\n')
+        self.assertEqual(list(parse_user_records(csv, 'csv')), [{'id': "bob", 'name': "Bob, Jr.", 'password': "pw"}])
+
+    def test_import_hashes_in_workers_and_reports_errors(self):
+        records = parse_user_records(io.StringIO(
+            '{"id": "bob", "name": "Bob", "password": "bob-pw"}\n'
+            '{"id": "alice", "name": "Alice", "password": "pw"}\n'
+            '{"id": "carol", "name": "Carol"}\n'
+            '{"id": "bob", "name": "Bob again", "password": "pw"}\n'
+            '{"id": "dave"\n'
+            '{"id": "erin", "name": "Erin", "password": "erin-pw"}\n'))
+        report = self.pe.import_users(records, batch_size=1, workers=1)
+        self.assertEqual((report['imported'], report['failed']), (2, 4))
+        self.assertEqual([(error['record'], error['id']) for error in report['errors']],
+                         [(2, "alice"), (3, "carol"), (4, "bob"), (5, None)])
+        self.assertIn("already exists", report['errors'][0]['error'])
+        self.assertIn("password", report['errors'][1]['error'])
+        for user_id, password in [("bob", "bob-pw"), ("erin", "erin-pw")]:
+            self.assertTrue(verify_password_util(password, User.collection().find_one({'_id': user_id})['password']))
+            self.assertNotIn('password', self.pe.users[user_id].to_dict())
+        self.assertEqual(sorted(user['_id'] for user in PolicyEngine().get_users()), ["alice", "bob", "erin"])
+
+    def test_storage_insert_errors_are_per_record(self):
+        User.collection().insert_one({'_id': "bob", 'name': "Bob"}) # Created by another process since startup
+        with mock.patch('models.policy_engine.PasswordHasher.submit', lambda self, password: mock.Mock(result=lambda: "hashed")):
+            report = self.pe.import_users([{'id': "bob", 'name': "Bob", 'password': "pw"},
+                                           {'id': "carol", 'name': "Carol", 'password': "pw"}])
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['errors'], [{'record': 1, 'id': "bob", 'error': "Duplicate _id bob"}])
+        self.assertIn("carol", self.pe.users)
+
+    def test_hashes_in_flight_are_bounded(self):
+        in_flight, peak = [], []
+        class Hash:
+            def __init__(self):
+                in_flight.append(self)
+                peak.append(len(in_flight))
+            def result(self):
+                in_flight.remove(self)
+                return "hashed"
+        self.pe.password_hasher = mock.Mock() # The interactive pool, which imports must not queue on
+        with mock.patch('models.policy_engine.PasswordHasher.submit', lambda self, password: Hash()):
+            report = self.pe.import_users(({'id': f"user{i}", 'name': "User", 'password': "pw"} for i in range(50)),
+                                          batch_size=7, workers=2)
+        self.assertEqual(report['imported'], 50)
+        self.assertEqual(max(peak), 4)
+        self.pe.password_hasher.submit.assert_not_called()
+
+    def test_lazy_import_checks_existing_users_per_batch(self):
+        pe = PolicyEngine(user_cache_size=2)
+        pe.users.get("alice")
+        users = User.collection()
+        records = [{'id': user_id, 'name': "User", 'password': "pw"} for user_id in ["alice", "bob", "carol", "dave"]]
+        with mock.patch('models.policy_engine.PasswordHasher.submit', lambda self, password: mock.Mock(result=lambda: "hashed")), \
+             mock.patch.object(users, 'find', wraps=users.find) as find, \
+             mock.patch.object(users, 'find_one', wraps=users.find_one) as find_one:
+            report = pe.import_users(records, batch_size=2, workers=1)
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual(report['errors'], [{'record': 1, 'id': "alice", 'error': "User alice already exists."}])
+        self.assertEqual(find.call_count, 2) # One query per batch
+        find_one.assert_not_called()
+        self.assertEqual(pe.users.keys(), ["alice"]) # Hot users are not evicted by the import
+        self.assertEqual(pe.users["dave"].name, "User")
+
+    def test_import_job_runs_in_the_background(self):
+        body = io.BytesIO(b'id,name,password\nbob,Bob,pw\nalice,Alice,pw\n')
+        with mock.patch('models.policy_engine.PasswordHasher.submit', lambda self, password: mock.Mock(result=lambda: "hashed")):
+            job_id = start_import_job(self.pe, body, 'csv')
+            for _ in range(100):
+                job = get_import_job(job_id)
+                if job['status'] != "running":
+                    break
+                time.sleep(0.05)
+        self.assertEqual(job['status'], "done")
+        self.assertEqual((job['report']['imported'], job['report']['failed']), (1, 1))
+        self.assertIn("bob", self.pe.users)
+        with self.assertRaises(ValueError):
+            start_import_job(self.pe, io.BytesIO(b''), 'xml')
+
+    def test_add_user_hashes_in_the_worker_pool(self):
+        pe = PolicyEngine(password_hash_workers=1)
+        self.addCleanup(pe.close)
+        pe.add_user("bob", "Bob", "bob-pw")
+        self.assertTrue(verify_password_util("bob-pw", User.collection().find_one({'_id': "bob"})['password']))
+
+
+if __name__ == '__main__':
+    unittest.main()
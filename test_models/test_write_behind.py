@@ -0,0 +1,102 @@
+import unittest
+import tempfile
+import sys
+import os
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.base_model import BaseModel
+from models.storage import MemoryStorage
+from models.user import User
+
+
+class TestAccessWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        BaseModel.use_storage(MemoryStorage())
+        patcher = mock.patch('models.policy_engine.hash_password_util', lambda password: "hashed")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal_path = os.path.join(directory.name, 'access.journal')
+
+        from models.policy_engine import PolicyEngine
+        self.PolicyEngine = PolicyEngine
+        pe = PolicyEngine()
+        pe.add_user("alice", "Alice", "pw")
+        for ds_id in ["bank_a", "bank_b"]:
+            pe.add_dataset(ds_id, ds_id.upper())
+            pe.add_object(f"{ds_id}_doc", "Doc", ds_id)
+        pe.add_conflict_class("banks", "Banks", ["bank_a", "bank_b"])
+
+    def tearDown(self):
+        BaseModel.use_storage(None)
+
+    def _stored_history(self):
+        doc = BaseModel.get_access_history_collection().find_one({'_id': "alice"})
+        return User.get_by_id("alice").access_history, doc['accessed_datasets'] if doc else []
+
+    def test_accesses_are_flushed_in_the_background(self):
+        pe = self.PolicyEngine(access_journal_path=self.journal_path)
+        pe.record_access("alice", "bank_a_doc")
+        self.assertFalse(pe.check_access("alice", "bank_b_doc", "read")[0]) # In-memory state is immediate
+        self.assertTrue(pe.access_writer.flush(timeout=5))
+        self.assertEqual(self._stored_history(), (["bank_a"], ["bank_a"]))
+        self.assertEqual(os.path.getsize(self.journal_path), 0) # Truncated once everything is stored
+
+        pe.add_role("analyst", "Analyst")
+        pe.assign_role_to_user("alice", "analyst") # A later user.save() must not repeat the access
+        pe.close()
+        self.assertEqual(self._stored_history(), (["bank_a"], ["bank_a"]))
+
+    def test_later_saves_do_not_repeat_accesses_after_a_restart(self):
+        pe = self.PolicyEngine(access_journal_path=self.journal_path)
+        pe.record_access("alice", "bank_a_doc")
+        pe.close()
+        pe.add_role("analyst", "Analyst")
+        history = ["bank_a"]
+        for lazy in [False, True]: # The history is merged into the users at load, or when a user is fetched
+            with self.subTest(lazy=lazy):
+                ds_id = f"oil_{lazy}"
+                pe.add_dataset(ds_id, "OIL")
+                pe.add_object(f"{ds_id}_doc", "Doc", ds_id)
+                restarted = self.PolicyEngine(access_journal_path=self.journal_path, user_cache_size=10 if lazy else 0)
+                restarted.record_access("alice", f"{ds_id}_doc")
+                self.assertTrue(restarted.access_writer.flush(timeout=5))
+                restarted.assign_role_to_user("alice", "analyst")
+                restarted.revoke_role_from_user("alice", "analyst")
+                restarted.close()
+                history.append(ds_id)
+                self.assertEqual(self._stored_history(), (history, history))
+
+    def test_accesses_of_a_loaded_user_are_pushed(self):
+        self.PolicyEngine().record_access("alice", "bank_a_doc")
+        users = User.collection()
+        for lazy in [False, True]:
+            with self.subTest(lazy=lazy):
+                ds_id = f"oil_{lazy}"
+                self.PolicyEngine().add_dataset(ds_id, "OIL")
+                self.PolicyEngine().add_object(f"{ds_id}_doc", "Doc", ds_id)
+                restarted = self.PolicyEngine(user_cache_size=10 if lazy else 0)
+                with mock.patch.object(users, 'update_one', wraps=users.update_one) as update_one:
+                    restarted.record_access("alice", f"{ds_id}_doc")
+                self.assertEqual([call.args[1] for call in update_one.call_args_list],
+                                 [{'$push': {'access_history': {'$each': [ds_id]}}}]) # Not the whole history
+        self.assertEqual(self._stored_history()[0], ["bank_a", "oil_False", "oil_True"])
+
+    def test_journal_is_replayed_on_startup(self):
+        pe = self.PolicyEngine(access_journal_path=self.journal_path)
+        with mock.patch.object(pe.access_writer, '_write_batch', side_effect=ConnectionError("down")):
+            pe.access_writer._stop.set() # Give up instead of retrying, like a crash before the flush
+            pe.record_access("alice", "bank_a_doc")
+            pe.close()
+        self.assertEqual(self._stored_history(), ([], []))
+
+        restarted = self.PolicyEngine(access_journal_path=self.journal_path)
+        self.assertEqual(self._stored_history(), (["bank_a"], ["bank_a"]))
+        self.assertFalse(restarted.check_access("alice", "bank_b_doc", "read")[0])
+        restarted.close()
+
+
+if __name__ == '__main__':
+    unittest.main()